@@ -0,0 +1,193 @@
+import os
+import socket
+import struct
+from logging import getLogger
+from struct import Struct
+
+import numpy as np
+
+log = getLogger()
+
+MAGIC = b'MAPITADJ'
+VERSION = 1
+# magic, version, reserved, number of addresses, number of edges
+HEADER = Struct('<8sIIQQ')
+
+
+def align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def ipnum(address):
+    return struct.unpack('!L', socket.inet_aton(address))[0]
+
+
+def ntoa(ipnum):
+    return socket.inet_ntoa(struct.pack('!L', ipnum))
+
+
+def ipnum6(address):
+    """IPv6 address as its high and low 64 bits."""
+    return struct.unpack('!QQ', socket.inet_pton(socket.AF_INET6, address))
+
+
+def ntoa6(high, low):
+    return socket.inet_ntop(socket.AF_INET6, struct.pack('!QQ', high, low))
+
+
+def pack6(addresses):
+    """Packs IPv6 address strings into an (n, 2) uint64 array of their high and low 64 bits."""
+    packed = b''.join(socket.inet_pton(socket.AF_INET6, address) for address in addresses)
+    return np.frombuffer(packed, dtype='>u8').reshape(-1, 2).astype(np.uint64)
+
+
+def keys6(pairs):
+    """
+    Views an (n, 2) uint64 array of IPv6 addresses as 16 byte big-endian keys, which sort, compare, and searchsorted in
+    address order.
+    """
+    return np.ascontiguousarray(pairs, dtype='>u8').view('S16').ravel()
+
+
+def is_binary(filename):
+    """True if filename is in the binary adjacency format."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class BinaryAdjacencies:
+    """
+    Memory-mapped binary adjacency file.
+
+    The file has a header, the sorted table of unique IPv4 addresses as little-endian uint32, padded to 8 bytes, and
+    the deduplicated (source id, target id) uint32 pairs sorted by source and then target, where ids are indices into the
+    address table. Iterating yields (address, address) string tuples, like the sets returned for text files.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('Truncated adjacency file {}'.format(filename))
+        magic, version, _, num_addresses, num_edges = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} binary adjacency file'.format(filename, VERSION))
+        edges_offset = align(HEADER.size + 4 * num_addresses)
+        self.addresses = memmap(filename, HEADER.size, (num_addresses,))
+        edges = memmap(filename, edges_offset, (num_edges, 2))
+        self.sources = edges[:, 0]
+        self.targets = edges[:, 1]
+
+    def __iter__(self):
+        strings = self.address_strings()
+        for source, target in zip(self.sources.tolist(), self.targets.tolist()):
+            yield strings[source], strings[target]
+
+    def __len__(self):
+        return len(self.sources)
+
+    def address_strings(self):
+        return [ntoa(address) for address in self.addresses.tolist()]
+
+
+def memmap(filename, offset, shape):
+    if 0 in shape:
+        return np.zeros(shape, dtype='<u4')
+    return np.memmap(filename, dtype='<u4', mode='r', offset=offset, shape=shape)
+
+
+def read_binary_adjacencies(filename):
+    log.info('Memory mapping binary adjacencies from {}'.format(filename))
+    return BinaryAdjacencies(filename)
+
+
+def adjacency_arrays(adjacencies):
+    """
+    Converts adjacencies to integer arrays.
+    :param adjacencies: BinaryAdjacencies or collection of (address, address) string tuples with IPv4 addresses
+    :return: Sorted unique addresses as integers, and the source and target indices into them for each adjacency
+    """
+    if isinstance(adjacencies, BinaryAdjacencies):
+        return (np.asarray(adjacencies.addresses, dtype=np.int64), np.asarray(adjacencies.sources, dtype=np.int64),
+                np.asarray(adjacencies.targets, dtype=np.int64))
+    unique = list({u for u, _ in adjacencies} | {v for _, v in adjacencies})
+    unique_ipnums = np.array([ipnum(address) for address in unique], dtype=np.int64)
+    order = np.argsort(unique_ipnums, kind='stable')
+    ids = dict(zip([unique[i] for i in order.tolist()], range(len(unique))))
+    sources = np.fromiter((ids[u] for u, _ in adjacencies), dtype=np.int64, count=len(adjacencies))
+    targets = np.fromiter((ids[v] for _, v in adjacencies), dtype=np.int64, count=len(adjacencies))
+    return unique_ipnums[order], sources, targets
+
+
+def address_arrays(adjacencies):
+    """
+    Converts adjacencies with IPv4 and IPv6 addresses to integer arrays. The IPv4 addresses get the ids 0 to n4 - 1 in
+    address order, and the IPv6 addresses get the following ids, also in address order.
+    :param adjacencies: BinaryAdjacencies or collection of (address, address) string tuples
+    :return: Sorted unique IPv4 addresses as integers, sorted unique IPv6 addresses as an (n6, 2) uint64 array, and the
+    source and target ids for each adjacency
+    """
+    if isinstance(adjacencies, BinaryAdjacencies):
+        ipnums, sources, targets = adjacency_arrays(adjacencies)
+        return ipnums, np.zeros((0, 2), dtype=np.uint64), sources, targets
+    unique = {u for u, _ in adjacencies} | {v for _, v in adjacencies}
+    unique4 = [address for address in unique if ':' not in address]
+    unique6 = [address for address in unique if ':' in address]
+    ipnums = np.array([ipnum(address) for address in unique4], dtype=np.int64)
+    order4 = np.argsort(ipnums, kind='stable')
+    pairs = pack6(unique6)
+    order6 = np.argsort(keys6(pairs), kind='stable')
+    ordered = [unique4[i] for i in order4.tolist()] + [unique6[i] for i in order6.tolist()]
+    ids = dict(zip(ordered, range(len(ordered))))
+    sources = np.fromiter((ids[u] for u, _ in adjacencies), dtype=np.int64, count=len(adjacencies))
+    targets = np.fromiter((ids[v] for _, v in adjacencies), dtype=np.int64, count=len(adjacencies))
+    return ipnums[order4], pairs[order6], sources, targets
+
+
+def write_binary_arrays(filename, ipnums, sources, targets):
+    """
+    Writes the binary adjacency format, deduplicating and sorting the edges.
+    :param ipnums: Sorted unique IPv4 addresses as integers
+    :param sources: Index of each edge's source address in ipnums
+    :param targets: Index of each edge's target address in ipnums
+    """
+    pairs = np.unique((np.asarray(sources, dtype=np.uint64) << np.uint64(32)) | np.asarray(targets, dtype=np.uint64))
+    write_binary_chunks(filename, ipnums, len(pairs), [(pairs >> np.uint64(32), pairs & np.uint64(0xffffffff))])
+
+
+def write_binary_chunks(filename, ipnums, num_edges, chunks):
+    """
+    Writes the binary adjacency format from edges that are already deduplicated and sorted, without holding all of them
+    in memory.
+    :param ipnums: Sorted unique IPv4 addresses as integers
+    :param num_edges: Total number of edges in the chunks
+    :param chunks: Iterable of (sources, targets) arrays of address ids, in order
+    """
+    tmp = filename + '.tmp'
+    written = 0
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(ipnums), num_edges))
+        f.write(np.asarray(ipnums, dtype='<u4').tobytes())
+        f.write(b'\0' * (align(f.tell()) - f.tell()))
+        for sources, targets in chunks:
+            edges = np.empty((len(sources), 2), dtype='<u4')
+            edges[:, 0] = sources
+            edges[:, 1] = targets
+            f.write(edges.tobytes())
+            written += len(edges)
+    if written != num_edges:
+        os.remove(tmp)
+        raise ValueError('Expected {:,d} edges but the chunks had {:,d}'.format(num_edges, written))
+    os.replace(tmp, filename)
+
+
+def write_binary_adjacencies(filename, adjacencies):
+    """Writes (address, address) string tuples in the binary format. Adjacencies with non-IPv4 addresses are skipped."""
+    ipv4 = [(u, v) for u, v in adjacencies if ':' not in u and ':' not in v]
+    if len(ipv4) < len(adjacencies):
+        log.warning('Skipped {:,d} adjacencies with IPv6 addresses.'.format(len(adjacencies) - len(ipv4)))
+    write_binary_arrays(filename, *adjacency_arrays(ipv4))
@@ -1,9 +1,12 @@
 from collections import defaultdict
 from logging import getLogger
+from time import perf_counter
 
-import numpy as np
-
+from interning import org_code
+from metrics import phase
+from progress import Progress
 from updates import Updates
+from votes import Votes
 
 log = getLogger()
 
@@ -11,8 +14,8 @@ log = getLogger()
 def max2(iterable, key=lambda x: x):
     first = None
     second = None
-    first_value = np.NINF
-    second_value = np.NINF
+    first_value = float('-inf')
+    second_value = float('-inf')
     for v in iterable:
         n = key(v)
         if n > first_value:
@@ -26,16 +29,27 @@ def max2(iterable, key=lambda x: x):
     return first, first_value, second, second_value
 
 
-def connected_org(half, updates, f):
+def connected_org(half, updates, f, votes=None):
+    if votes is not None:
+        return votes.connected_org(half)
     orgs = defaultdict(list)
     for neighbor in half.neighbors:
-        if neighbor in updates:
-            asn, org = updates.mapping(neighbor)
-            orgs[org].append(asn)
+        entry = updates.entry(neighbor)
+        if entry is not None:
+            orgs[entry.org].append(entry.asn)
         else:
             orgs[neighbor.org].append(neighbor.asn)
+    return choose_org(orgs, half.num_neighbors, f)
+
+
+def choose_org(orgs, num_neighbors, f):
+    """
+    Picks the org with the most neighbors, and its most common ASN, if it has enough of the neighbors.
+    :param orgs: Mapping of each neighbor org to the list of the neighbors' ASNs, in neighbor order
+    :return: (asn, org) or None
+    """
     org, first, _, second = max2(orgs, key=lambda x: len(orgs[x]))
-    if len(orgs) == 1 or (first != second and first > half.num_neighbors * f):
+    if len(orgs) == 1 or (first != second and first > num_neighbors * f):
         asns = defaultdict(int)
         for asn in orgs[org]:
             asns[asn] += 1
@@ -43,12 +57,17 @@ def connected_org(half, updates, f):
         return asn, org
 
 
-def add_borders(halves, updates, f):
+def add_borders(halves, updates, f, votes=None, pool=None):
+    if pool is not None:
+        return pool.add_borders(halves, updates, f)
+    if votes is not None:
+        votes.sync(updates)
     new_updates = updates.copy()
-    for half in halves:
+    pb = Progress(len(halves), 'Adding borders', transient=True)
+    for half in pb.iterator(halves):
         if not updates.isdirect(half):
             if half.asn != -2 or half.direction:
-                network = connected_org(half, updates, f)
+                network = connected_org(half, updates, f, votes)
                 if network:
                     asn, org = network
                     if org != half.org and asn != -2:
@@ -82,9 +101,22 @@ def resolve_indirect(direct_half, indirect_half, new_updates):
         new_updates.remove(remove_half.otherside)
 
 
-def dual_inferences(new_updates):
-    # Only need to search through current updates
-    for half in [half for half in new_updates if half.direction and half.otherhalf in new_updates and half.asn > 0]:
+def dual_inferences(new_updates, halves=None):
+    """
+    Resolves conflicting inferences on the two halves of an interface.
+    :param new_updates: Updates object which is directly modified
+    :param halves: Only consider these halves, or None for all of them
+    :return: Forward halves which are still in conflict
+    """
+    if halves is None:
+        # Only need to search through current updates
+        candidates = [half for half in new_updates if half.direction and half.otherhalf in new_updates and half.asn > 0]
+    else:
+        candidates = sorted((
+            half for half in halves if half.direction and half in new_updates and half.otherhalf in new_updates and
+            half.asn > 0), key=identifier)
+        log.debug('Dual: rechecked {:,d} of {:,d} inferences'.format(len(candidates), len(new_updates)))
+    for half in candidates:
         if half in new_updates and half.otherhalf in new_updates:
             # Only need to look through the forward halves because we are looking for updates on both halves
             forward_asn, forward_org = new_updates.mapping(half)
@@ -96,14 +128,26 @@ def dual_inferences(new_updates):
                     resolve_indirect(half, half.otherhalf, new_updates)
                 elif new_updates.isdirect(half.otherhalf):
                     resolve_indirect(half.otherhalf, half, new_updates)
+    return {half for half in candidates if half.otherhalf in new_updates and half in new_updates and
+            new_updates.org(half) != new_updates.org(half.otherhalf)}
 
 
 def is_inverse(half, neighbor, updates):
     return half.org == updates.org_default(neighbor, None) and updates.org(half) == neighbor.org
 
 
-def inverse_inferences(new_updates):
-    for half in tuple(new_updates.direct):
+def inverse_inferences(new_updates, halves=None):
+    """
+    Removes backward inferences whose neighbors are inferred to be connected to the half's own org.
+    :param new_updates: Updates object which is directly modified
+    :param halves: Only consider these halves, or None for all of them
+    """
+    if halves is None:
+        direct = tuple(new_updates.direct)
+    else:
+        direct = sorted((half for half in halves if new_updates.isdirect(half)), key=identifier)
+        log.debug('Inverse: rechecked {:,d} of {:,d} direct halves'.format(len(direct), len(new_updates.direct)))
+    for half in direct:
         if not half.direction and not new_updates.isdirect(half.otherside):
             for neighbor in half.neighbors:
                 if is_inverse(half, neighbor, new_updates):
@@ -113,44 +157,133 @@ def inverse_inferences(new_updates):
                     break
 
 
+def identifier(half):
+    """Sort key that visits the halves in the same order on every run, unlike the order of a set of halves."""
+    return half.identifier
+
+
+def affected_halves(changed):
+    """
+    Halves whose inference, otherhalf inference, otherside inference, or neighbor inferences are in changed. Neighbors
+    are symmetric, so the halves next to a changed half are exactly the halves it neighbors.
+    :param changed: Halves whose inferences changed
+    """
+    affected = set()
+    for half in changed:
+        affected.add(half)
+        affected.update(half.neighbors)
+        if half.otherhalf:
+            affected.add(half.otherhalf)
+        if half.otherside:
+            affected.add(half.otherside)
+    return affected
+
+
+class Worklist:
+    """
+    Remembers the Revision committed after the last dual_inferences and inverse_inferences passes, so the next pass
+    only re-examines halves affected by changes since then. Halves that are unaffected reach the same decision as
+    before, which was to leave them alone, except for the conflicts dual_inferences could not resolve, which are always
+    re-examined.
+
+    The changes come from Updates.changed_since rather than a set from Updates.watch, since add_step can return an
+    earlier state than the one the last pass ran on, and the revisions find the changes on both sides.
+    """
+
+    def __init__(self):
+        self.dual_revision = None
+        self.conflicts = set()
+        self.inverse_revision = None
+
+    def dual_inferences(self, new_updates):
+        halves = self.affected(new_updates, self.dual_revision)
+        if halves is not None:
+            halves |= self.conflicts
+        self.conflicts = dual_inferences(new_updates, halves)
+        new_updates.commit()
+        self.dual_revision = new_updates.revision
+
+    def inverse_inferences(self, new_updates):
+        inverse_inferences(new_updates, self.affected(new_updates, self.inverse_revision))
+        new_updates.commit()
+        self.inverse_revision = new_updates.revision
+
+    @staticmethod
+    def affected(new_updates, revision):
+        """Halves affected by changes since revision, or None to examine every half."""
+        if revision is None:
+            return None
+        changed = new_updates.changed_since(revision)
+        if changed is None:
+            return None
+        return affected_halves(changed)
+
+
 def create_rerun(updates, new_updates):
     return {neighbor for half in new_updates.difference(updates) if half for neighbor in half.neighbors if
             neighbor.num_neighbors > 1}
 
 
-def add_step(halves, updates, threshold):
-    previous = []
+def add_step(halves, updates, threshold, votes=None, worklist=None, pool=None):
+    if worklist is None:
+        worklist = Worklist()
+    previous = {}
+    iteration = 0
     while True:
-        new_updates = add_borders(halves, updates, threshold)
+        with phase('add_borders', items=len(halves)) as record:
+            new_updates = add_borders(halves, updates, threshold, votes, pool)
+            record['inferences'] = len(new_updates)
         log.info('Direct: {:,d} inferences'.format(len(new_updates)))
         # if new_updates.direct == updates.direct:
         #     return new_updates
-        add_othersides(new_updates)
+        with phase('add_othersides') as record:
+            add_othersides(new_updates)
+            record['inferences'] = len(new_updates)
         log.info('Indirect: {:,d} inferences'.format(len(new_updates)))
-        dual_inferences(new_updates)
+        with phase('dual_inferences') as record:
+            worklist.dual_inferences(new_updates)
+            record['inferences'] = len(new_updates)
         log.info('Dual: {:,d} inferences'.format(len(new_updates)))
-        inverse_inferences(new_updates)
+        with phase('inverse_inferences') as record:
+            worklist.inverse_inferences(new_updates)
+            record['inferences'] = len(new_updates)
         log.info('Inverse: {:,d} inferences'.format(len(new_updates)))
         halves = create_rerun(updates, new_updates)
-        if updates in previous:
+        if updates.fingerprint in previous:
+            first = previous[updates.fingerprint]
+            log.debug('Add step pass {} repeats pass {} (cycle length {})'.format(iteration, first, iteration - first))
             return updates
-        previous.append(updates)
+        previous[updates.fingerprint] = iteration
         updates = new_updates.copy()
+        iteration += 1
 
 
 def discard_update(half, updates):
     if half.otherside and updates.isdirect(half.otherside):
-        updates.direct.remove(half)
+        updates.remove_direct(half)
     else:
         updates.remove(half)
         if half.otherside:
             updates.remove(half.otherside)
 
 
-def remove_borders(updates, threshold):
+def remove_borders(updates, threshold, votes=None, halves=None):
+    """
+    Discards the direct inferences which no longer agree with the neighbors.
+
+    The decision for each half only depends on updates, and a discarded half only affects its own otherside, so the
+    halves can be examined in any order.
+    :param halves: Only re-examine these halves, or None for every direct inference
+    """
+    if votes is not None:
+        votes.sync(updates)
     new_updates = updates.copy()
-    for half in updates.direct:
-        network = connected_org(half, updates, threshold)
+    direct = updates.direct
+    if halves is not None:
+        direct = sorted((half for half in halves if updates.isdirect(half)), key=identifier)
+        log.debug('Remove: rechecked {:,d} of {:,d} direct halves'.format(len(direct), len(updates.direct)))
+    for half in direct:
+        network = connected_org(half, updates, threshold, votes)
         if network:
             _, org = network
             if org != updates[half]:
@@ -160,20 +293,26 @@ def remove_borders(updates, threshold):
     return new_updates
 
 
-def remove_step(updates, factor):
+def remove_step(updates, factor, votes=None):
     """
     The remove step discards inferences which no longer appear valid.
 
     This step will continue until there are no changes left to be made.
     :param updates: Updates object with current inferences
     :param factor: 0 <= factor <= 1
+    :param votes: Optional Votes, which keeps the neighbor tallies across passes
     :return: Updates object without discarded inferences
     """
+    halves = None
     while True:
-        new_updates = remove_borders(updates, factor)
+        with phase('remove_borders', items=len(halves) if halves is not None else len(updates)) as record:
+            new_updates = remove_borders(updates, factor, votes, halves)
+            record['inferences'] = len(new_updates)
         log.info('Remove: {:,d} inferences'.format(len(new_updates)))
         if updates == new_updates:
             return updates
+        # Halves kept in this pass keep being kept unless a neighbor's inference changed
+        halves = affected_halves(new_updates.changed(updates))
         updates = new_updates
 
 
@@ -188,8 +327,10 @@ def stub_heuristic(allhalves, updates, providers):
     links with only a single neighbor.
     :param allhalves: All InterfaceHalf objects
     :param updates: The current Update object after completing the main loop which will be directly modified
-    :param providers: Set of ISP ASNs
+    :param providers: Set of ISP ASNs (ints) and ORGs (strings)
     """
+    provider_asns = {provider for provider in providers if not isinstance(provider, str)}
+    provider_orgs = {org_code(provider) for provider in providers if isinstance(provider, str)}
     for half in allhalves:
         # Only need to look at IHs in forward direction with a single neighbor
         if half.direction and half.num_neighbors == 1:
@@ -202,35 +343,69 @@ def stub_heuristic(allhalves, updates, providers):
                 # If the neighbor has an IP2AS mapping and is not the same ORG as the half
                 # If there is no inference for the neighbor and the neighbor is not an ISP
                 if neighbor.asn > 0 and neighbor.org != half.org and neighbor not in updates and (
-                                neighbor.asn not in providers and neighbor.org not in providers):
+                                neighbor.asn not in provider_asns and neighbor.org not in provider_orgs):
                     updates.update(half, neighbor.asn, neighbor.org, isdirect=True, isstub=True)
                     if half.otherside:
                         updates.update(half.otherside, neighbor.asn, neighbor.org, isdirect=False, isstub=True)
 
 
-def algorithm(allhalves, factor=0.5, providers=None, iterations=100):
+def main_loop(halves, factor, iterations, pool=None, stats=None, initial=None, tallies=True):
+    """
+    Alternates the add step and the remove step until the inferences repeat or the iteration limit is reached.
+    :param halves: InterfaceHalf objects with more than one neighbor
+    :param factor: 0 <= factor <= 1
+    :param pool: Optional BorderPool used to run add_borders on multiple processes
+    :param stats: Optional list, which gets a dict with the time and number of inferences for each iteration
+    :param initial: Optional Updates used as the starting inferences instead of an empty Updates
+    :param tallies: Keep the neighbor tallies with Votes across passes, instead of recounting the neighbors on every
+    connected_org call
+    :return: Updates
+    """
+    previous_updates = {}
+    updates = Updates() if initial is None else initial
+    votes = Votes(factor) if tallies else None
+    worklist = Worklist()
+    for iteration in range(iterations):
+        log.info('***** Iteration {} *****'.format(iteration))
+        start = perf_counter()
+        updates = add_step(halves, updates, factor, votes, worklist, pool)
+        updates = remove_step(updates, factor, votes)
+        if stats is not None:
+            stats.append({'iteration': iteration, 'seconds': perf_counter() - start, 'inferences': len(updates)})
+        if updates.fingerprint in previous_updates:
+            first = previous_updates[updates.fingerprint]
+            log.info('Iteration {} repeats iteration {}: cycle length {}, first appeared in iteration {}'.format(
+                iteration, first, iteration - first, first))
+            break
+        previous_updates[updates.fingerprint] = iteration
+    if votes is not None:
+        votes.close()
+    return updates
+
+
+def apply_stub_heuristic(allhalves, updates, providers):
+    with phase('stub_heuristic', items=len(allhalves)) as record:
+        stub_heuristic(allhalves, updates, providers)
+        record['inferences'] = len(updates)
+    log.info('Stubs Heuristic: Added {:,d} Total {:,d}'.format(len(updates.scan_stubs()), len(updates)))
+
+
+def algorithm(allhalves, factor=0.5, providers=None, iterations=100, pool=None, stats=None, initial=None):
     """
     The main MAP-IT algorithm, with the main loop which calls the add step and the remove step.
     :param allhalves: All InterfaceHalf objects created from the traceroutes, including those with 1 neighbor
     :param factor: 0 <= factor <= 1
     :param providers: Set of ISP ASNs
+    :param pool: Optional BorderPool used to run add_borders on multiple processes
+    :param stats: Optional list, which gets a dict with the time and number of inferences for each iteration
+    :param initial: Optional Updates used as the starting inferences instead of an empty Updates
     :return: Updates object with the final set of inter-AS links
     """
-    previous_updates = []
-    updates = Updates()
     halves = [half for half in allhalves if half.num_neighbors > 1]
     if not halves:
         log.warning('The interface graph is too sparse. No interface has more than one neighbor in the forward or backward direction.')
         log.warning('Only applying the stub heuristic.')
-    for iteration in range(iterations):
-        log.info('***** Iteration {} *****'.format(iteration))
-        updates = add_step(halves, updates, factor)
-        updates = remove_step(updates, factor)
-        if updates in previous_updates:
-            break
-        previous_updates.append(updates)
-        iteration += 1
+    updates = main_loop(halves, factor, iterations, pool=pool, stats=stats, initial=initial)
     if providers is not None:
-        stub_heuristic(allhalves, updates, providers)
-        log.info('Stubs Heuristic: Added {:,d} Total {:,d}'.format(len(updates.stubs), len(updates)))
+        apply_stub_heuristic(allhalves, updates, providers)
     return updates
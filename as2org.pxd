@@ -33,5 +33,11 @@ cdef class Info:
 
 cdef class AS2Org(dict):
     cdef public dict data
+    cdef public str filename
+    cdef public str compression
+    cdef public str additional
+    cdef public bint include_potaroo
+    cdef public bint loaded
     cpdef Info info(self, int asn)
-    cpdef str name(self, int asn)
\ No newline at end of file
+    cpdef str name(self, int asn)
+    cpdef load_info(self)
\ No newline at end of file
@@ -2,9 +2,12 @@ import os
 import re
 from functools import partial
 
-import lxml.html
+import numpy as np
 
-from utils import File2
+from utils import File2, load_pickle, save_pickle
+
+# Part of the lean cache key, so caches written with different sibling merging are rebuilt
+LEAN_VERSION = 2
 
 
 cdef class OrgInfo:
@@ -91,10 +94,46 @@ cdef class Info:
 
 
 cdef class AS2Org(dict):
-    def __init__(self, str filename, bint include_potaroo=False, str compression='infer', str additional='validation-siblings.txt', *args, **kwargs):
+    """
+    Maps ASNs to org ids.
+
+    With lean=True, only the aut|org_id pairs are read and the sibling file is applied by merge_siblings, line by line
+    as load_info does.
+    The mapping can be cached in a binary file that is reused while the input files are unchanged. The full Info
+    metadata is only loaded when info() or name() is called.
+    """
+    def __init__(self, str filename, bint include_potaroo=False, str compression='infer', str additional='validation-siblings.txt', bint lean=False, str cache=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.data = {}
-        ases, orgs = read_caida(filename, compression)
+        self.filename = filename
+        self.compression = compression
+        self.additional = additional
+        self.include_potaroo = include_potaroo
+        self.loaded = False
+        if lean:
+            self.update(load_lean(filename, compression, additional, cache))
+        else:
+            self.load_info()
+            for asn, info in self.data.items():
+                self[asn] = info.org
+
+    def __missing__(self, key):
+        return str(key)
+
+    cpdef Info info(self, int asn):
+        if not self.loaded:
+            self.load_info()
+        return self.data[asn]
+
+    cpdef str name(self, int asn):
+        if not self.loaded:
+            self.load_info()
+        return self.data[asn].name if asn in self.data else str(asn)
+
+    cpdef load_info(self):
+        """Parses the full AS and org records (and the potaroo names, if included) into Info objects."""
+        ases, orgs = read_caida(self.filename, self.compression)
+        additional = self.additional
         if additional:
             if os.path.exists(additional):
                 with open(additional) as f:
@@ -116,24 +155,75 @@ cdef class AS2Org(dict):
                 print('WARNING: The file {} does not exists.'.format(additional))
         for asn, asinfo in ases.items():
             self.data[asn] = Info(asinfo=asinfo, orginfo=orgs[asinfo.org_id])
-        if include_potaroo:
+        if self.include_potaroo:
             pots = {p.aut: p for p in potaroo()}
             for asn, potarooinfo in pots.items():
-                if asn in self:
+                if asn in self.data:
                     self.data[asn].potarooinfo = potarooinfo
                 else:
                     self.data[asn] = Info(potarooinfo=potarooinfo)
-        for asn, info in self.data.items():
-            self[asn] = info.org
-    
-    def __missing__(self, key):
-        return str(key)
+        self.loaded = True
 
-    cpdef Info info(self, int asn):
-        return self.data[asn]
 
-    cpdef str name(self, int asn):
-        return self.data[asn].name if asn in self.data else str(asn)
+def read_caida_orgs(filename, compression):
+    """Reads only the ASN to org id mappings from a CAIDA as2org file."""
+    asorgs = {}
+    reading = False
+    with File2(filename, compression=compression) as f:
+        for line in f:
+            if line[0] == '#':
+                if line.startswith('# format:'):
+                    reading = line[9:].strip().startswith('aut')
+            elif reading:
+                aut, _, _, org_id, _ = line.split('|', 4)
+                asorgs[int(aut)] = org_id
+    return asorgs
+
+
+def merge_siblings(asorgs, additional):
+    """
+    Applies the siblings file the same way as load_info. The lines are read in order, and every ASN on a line is mapped
+    to the current org of the first ASN on the line that has one. ASNs that are not listed keep their orgs.
+    """
+    with open(additional) as f:
+        for line in f:
+            if line.strip() and line[0] != '#':
+                asns = list(map(int, line.split()))
+                org = next((asorgs[asn] for asn in asns if asn in asorgs), None)
+                if org is None:
+                    continue
+                for asn in asns:
+                    asorgs[asn] = org
+    return asorgs
+
+
+def lean_key(filename, additional):
+    files = [filename] + ([additional] if additional and os.path.exists(additional) else [])
+    return (LEAN_VERSION,) + tuple((os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files)
+
+
+def load_lean(filename, compression, additional, cache=None):
+    """
+    Returns the ASN to org id dict, using the cache file when it was built from the same input files. The cache stores
+    the mapping as a sorted ASN array, an org code array, and the list of org ids.
+    """
+    key = lean_key(filename, additional)
+    if cache and os.path.exists(cache):
+        saved_key, asns, codes, org_ids = load_pickle(cache)
+        if saved_key == key:
+            return dict(zip(asns.tolist(), [org_ids[code] for code in codes.tolist()]))
+    asorgs = read_caida_orgs(filename, compression)
+    if additional:
+        if os.path.exists(additional):
+            merge_siblings(asorgs, additional)
+        else:
+            print('WARNING: The file {} does not exists.'.format(additional))
+    if cache:
+        org_ids = sorted(set(asorgs.values()))
+        codes = {org: i for i, org in enumerate(org_ids)}
+        asns = np.array(sorted(asorgs), dtype=np.int64)
+        save_pickle(cache, (key, asns, np.array([codes[asorgs[asn]] for asn in asns.tolist()], dtype=np.int32), org_ids))
+    return asorgs
 
 
 def add_asn(ases, t):
@@ -163,6 +253,7 @@ def read_caida(filename, compression):
 
 
 def potaroo(filename='autnums2.html'):
+    import lxml.html
     regex = re.compile(r'AS(\d+)\s+(-Reserved AS-|[A-Za-z0-9-]+)?(?:\s+-\s+)?(.*),\s+([A-Z]{2})')
     t = lxml.html.parse(filename).getroot()
     t.make_links_absolute('http://bgp.potaroo.net/cidr/autnums.html')
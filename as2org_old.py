@@ -3,9 +3,6 @@ from collections import namedtuple, UserDict
 from functools import partial
 from logging import getLogger
 
-import lxml.html
-import requests
-
 from utils import File2
 
 log = getLogger()
@@ -136,6 +133,8 @@ def read_caida(filename, compression):
 
 
 def potaroo(url='http://bgp.potaroo.net/cidr/autnums.html'):
+    import lxml.html
+    import requests
     regex = re.compile(r'AS(\d+)\s+(-Reserved AS-|[A-Za-z0-9-]+)?(?:\s+-\s+)?(.*),\s+([A-Z]{2})')
     r = requests.get(url)
     t = lxml.html.fromstring(r.text)
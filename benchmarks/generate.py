@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Generates synthetic MAP-IT inputs: a pfx2as table, an as2org file, an adjacency list, and a small warts file.
+
+The topology has ASes of heavy-tailed sizes, routers with a heavy-tailed degree distribution, and point-to-point links
+addressed from /30 or /31 prefixes taken from one endpoint's AS. Adjacencies are consecutive inbound interfaces of
+router-level paths, and a fraction of them use a third-party address of the next router instead.
+
+Run from the repository root: python -m benchmarks.generate -d DIR -H 1000000
+"""
+import os
+import socket
+import struct
+from argparse import ArgumentParser
+from collections import namedtuple
+
+import numpy as np
+
+from warts import WARTS_MAGIC, WARTS_TYPE_TRACE, HEADER, UINT16, UINT32
+
+Topology = namedtuple('Topology', ['router_asns', 'endpoints', 'addresses', 'prefixes', 'offsets', 'incident'])
+
+# Start of the synthetic address space, which stays clear of the private and reserved prefixes
+FIRST_ADDRESS = 11 << 24
+LAST_ADDRESS = 100 << 24
+
+
+def ntoa(ipnum):
+    return socket.inet_ntoa(struct.pack('!L', ipnum))
+
+
+def heavy_tailed(rng, n, exponent):
+    """Pareto distributed weights, normalized to sum to 1."""
+    weights = rng.pareto(exponent, n) + 1
+    return weights / weights.sum()
+
+
+def generate_topology(rng, num_links, num_ases, routers_per_as=20, degree_exponent=1.5, interas=0.1, slash31=0.5):
+    """
+    Creates the router-level topology and assigns the link addresses.
+    :param num_links: Number of point-to-point links
+    :param num_ases: Number of ASes
+    :param routers_per_as: Mean number of routers in each AS
+    :param degree_exponent: Pareto exponent of the router degree and AS size distributions, where smaller is more skewed
+    :param interas: Fraction of links between routers in different ASes
+    :param slash31: Fraction of links addressed from a /31 instead of a /30
+    :return: Topology
+    """
+    as_sizes = np.maximum(1, np.round(heavy_tailed(rng, num_ases, degree_exponent) * num_ases * routers_per_as)).astype(np.int64)
+    router_asns = np.repeat(np.arange(1, num_ases + 1), as_sizes)
+    num_routers = len(router_asns)
+    as_offsets = np.zeros(num_ases + 1, dtype=np.int64)
+    np.cumsum(as_sizes, out=as_offsets[1:])
+    router_weights = heavy_tailed(rng, num_routers, degree_exponent)
+
+    # Every link has one endpoint chosen by degree weight, and the other from the same AS or, for inter-AS links, any AS
+    u = rng.choice(num_routers, num_links, p=router_weights)
+    same = rng.random(num_links) >= interas
+    v = rng.choice(num_routers, num_links, p=router_weights)
+    asn_index = router_asns[u] - 1
+    local = as_offsets[asn_index] + (rng.random(num_links) * as_sizes[asn_index]).astype(np.int64)
+    v = np.where(same, local, v)
+    keep = u != v
+    u, v = u[keep], v[keep]
+    endpoints = np.stack([u, v], axis=1)
+    num_links = len(u)
+
+    # The link's prefix comes from a random endpoint's AS
+    owners = router_asns[np.where(rng.random(num_links) < 0.5, u, v)]
+    order = np.argsort(owners, kind='stable')
+    counts = np.bincount(owners, minlength=num_ases + 1)[1:]
+    prefixes = []
+    bases = np.zeros(num_ases, dtype=np.int64)
+    address = FIRST_ADDRESS
+    for asn, count in enumerate(counts.tolist(), 1):
+        size = 1 << max(8, int(np.ceil(np.log2(max(count, 1) * 4))))
+        address = (address + size - 1) // size * size
+        bases[asn - 1] = address
+        prefixes.append((address, 32 - size.bit_length() + 1, asn))
+        address += size
+    if address > LAST_ADDRESS:
+        raise ValueError('Too many links for the synthetic address space')
+    rank = np.empty(num_links, dtype=np.int64)
+    sorted_owners = owners[order]
+    starts = np.searchsorted(sorted_owners, sorted_owners)
+    rank[order] = np.arange(num_links) - starts
+    networks = bases[owners - 1] + 4 * rank
+    is31 = rng.random(num_links) < slash31
+    first = np.where(is31, networks, networks + 1)
+    addresses = np.stack([first, first + 1], axis=1)
+
+    # Links incident to each router, as (link, side) pairs in CSR order
+    routers = endpoints.ravel()
+    incident = np.argsort(routers, kind='stable')
+    offsets = np.zeros(num_routers + 1, dtype=np.int64)
+    np.cumsum(np.bincount(routers, minlength=num_routers), out=offsets[1:])
+    return Topology(router_asns, endpoints, addresses, prefixes, offsets, incident)
+
+
+def random_incident(rng, topology, routers):
+    """Picks a random (link * 2 + side) incident to each router."""
+    starts = topology.offsets[routers]
+    degrees = topology.offsets[routers + 1] - starts
+    return topology.incident[starts + (rng.random(len(routers)) * degrees).astype(np.int64)]
+
+
+def generate_adjacencies(rng, topology, num_adjacencies, noise=0.02):
+    """
+    Samples adjacencies from two-hop router paths u -> v -> w.
+    :param noise: Fraction of adjacencies where w responds with a third-party address
+    :return: Array of unique (address, address) pairs as integers
+    """
+    links = rng.integers(0, len(topology.endpoints), num_adjacencies)
+    sides = rng.integers(0, 2, num_adjacencies)
+    # Arrive at v over the first link, where v's inbound interface is on the opposite side from u
+    v = topology.endpoints[links, 1 - sides]
+    inbound = topology.addresses[links, 1 - sides]
+    out = random_incident(rng, topology, v)
+    out_links, out_sides = out >> 1, out & 1
+    w = topology.endpoints[out_links, 1 - out_sides]
+    nxt = topology.addresses[out_links, 1 - out_sides]
+    third_party = rng.random(num_adjacencies) < noise
+    other = random_incident(rng, topology, w[third_party])
+    nxt[third_party] = topology.addresses[other >> 1, other & 1]
+    keep = (out_links != links) & (inbound != nxt)
+    pairs = (inbound[keep] << 32) | nxt[keep]
+    pairs = np.unique(pairs)
+    return np.stack([pairs >> 32, pairs & 0xffffffff], axis=1)
+
+
+def write_adjacencies(filename, adjacencies):
+    with open(filename, 'w') as f:
+        for x, y in adjacencies.tolist():
+            f.write('{} {}\n'.format(ntoa(x), ntoa(y)))
+
+
+def more_specifics(rng, prefixes, num_prefixes, other_asn=0.1):
+    """
+    Random /24 to /28 prefixes inside the AS blocks, so the table has a realistic number of nested prefixes. A fraction
+    are originated by a different AS, like customer prefixes announced by the customer.
+    """
+    blocks = rng.integers(0, len(prefixes), num_prefixes)
+    lengths = rng.integers(24, 29, num_prefixes)
+    extra = set()
+    for block, prefixlen in zip(blocks.tolist(), lengths.tolist()):
+        address, blocklen, asn = prefixes[block]
+        if prefixlen <= blocklen:
+            continue
+        subnet = int(rng.integers(0, 1 << (prefixlen - blocklen)))
+        if rng.random() < other_asn:
+            asn = int(rng.integers(1, len(prefixes) + 1))
+        extra.add((address + (subnet << (32 - prefixlen)), prefixlen, asn))
+    return sorted(extra)
+
+
+def write_pfx2as(filename, prefixes):
+    with open(filename, 'w') as f:
+        f.write('prefix,asn\n')
+        for address, prefixlen, asn in prefixes:
+            f.write('{}/{},{}\n'.format(ntoa(address), prefixlen, asn))
+
+
+def write_as2org(filename, num_ases, rng, siblings=0.1):
+    """Writes a CAIDA format as2org file, where a fraction of the ASes share the org of the previous AS."""
+    orgs = {}
+    for asn in range(1, num_ases + 1):
+        orgs[asn] = orgs[asn - 1] if asn > 1 and rng.random() < siblings else 'ORG-{}'.format(asn)
+    with open(filename, 'w') as f:
+        f.write('# format:org_id|changed|org_name|country|source\n')
+        for org in sorted(set(orgs.values())):
+            f.write('{}|20170101|{} name|US|ARIN\n'.format(org, org))
+        f.write('# format:aut|changed|aut_name|org_id|source\n')
+        for asn, org in orgs.items():
+            f.write('{}|20170101|AS{}|{}|ARIN\n'.format(asn, asn, org))
+
+
+def flags_bytes(flags):
+    mask = 0
+    for flag in flags:
+        mask |= 1 << (flag - 1)
+    if not mask:
+        return b'\x00'
+    out = bytearray()
+    while mask:
+        b = mask & 0x7f
+        mask >>= 7
+        out.append(b | (0x80 if mask else 0))
+    return bytes(out)
+
+
+def params(items):
+    if not items:
+        return b'\x00'
+    body = b''.join(value for _, value in sorted(items))
+    return flags_bytes([flag for flag, _ in items]) + UINT16.pack(len(body)) + body
+
+
+def warts_trace(src, dst, hops, stop_reason=1):
+    """Encodes a trace record with the fields WartsReader decodes. Hops are (address, probe_ttl) pairs."""
+    table = {}
+
+    def address(ipnum):
+        if ipnum in table:
+            return b'\x00' + UINT32.pack(table[ipnum])
+        table[ipnum] = len(table)
+        return bytes([4, 1]) + struct.pack('!L', ipnum)
+
+    items = [(6, bytes([stop_reason])), (19, UINT16.pack(max([ttl for _, ttl in hops], default=0))),
+             (26, address(src)), (27, address(dst))]
+    body = params(items) + UINT16.pack(len(hops))
+    for ipnum, ttl in hops:
+        body += params([(2, bytes([ttl])), (18, address(ipnum))])
+    body += b'\x00\x00'
+    return HEADER.pack(WARTS_MAGIC, WARTS_TYPE_TRACE, len(body)) + body
+
+
+def write_warts(filename, rng, topology, num_traces, max_length=12):
+    """Writes random walks through the topology as traceroutes."""
+    with open(filename, 'wb') as f:
+        for _ in range(num_traces):
+            router = int(rng.integers(0, len(topology.router_asns)))
+            hops = []
+            for ttl in range(1, int(rng.integers(3, max_length)) + 1):
+                link = int(random_incident(rng, topology, np.array([router]))[0])
+                side = 1 - (link & 1)
+                router = int(topology.endpoints[link >> 1, side])
+                hops.append((int(topology.addresses[link >> 1, side]), ttl))
+            f.write(warts_trace(FIRST_ADDRESS, hops[-1][0], hops))
+
+
+def generate(directory, halves, seed=0, ases=None, degree_exponent=1.5, interas=0.1, noise=0.02, traces=1000, prefixes=None):
+    """
+    Writes the synthetic inputs to directory, skipping files that already exist.
+    :param halves: Approximate number of interface halves in the adjacency list
+    :param prefixes: Number of more specific prefixes added to the pfx2as table, by default one for every 10 halves
+    :return: Dict of the input filenames
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {name: os.path.join(directory, 'synthetic.{}'.format(name)) for name in ['pfx2as', 'as2org', 'adj', 'warts']}
+    if all(os.path.exists(filename) for filename in files.values()):
+        return files
+    rng = np.random.default_rng(seed)
+    ases = ases or max(10, halves // 200)
+    # Calibrated so the adjacencies produce about the requested number of halves
+    num_adjacencies = halves * 9 // 10
+    topology = generate_topology(rng, max(num_adjacencies // 2, 10), ases, degree_exponent=degree_exponent, interas=interas)
+    extra = more_specifics(rng, topology.prefixes, halves // 10 if prefixes is None else prefixes)
+    write_pfx2as(files['pfx2as'], topology.prefixes + extra)
+    write_as2org(files['as2org'], ases, rng)
+    write_adjacencies(files['adj'], generate_adjacencies(rng, topology, num_adjacencies, noise=noise))
+    write_warts(files['warts'], rng, topology, traces)
+    return files
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--directory', required=True, help='Output directory')
+    parser.add_argument('-H', '--halves', type=int, default=10000, help='Approximate number of interface halves')
+    parser.add_argument('-a', '--ases', type=int, help='Number of ASes')
+    parser.add_argument('-e', '--degree-exponent', type=float, default=1.5, help='Pareto exponent of the router degrees')
+    parser.add_argument('-i', '--interas', type=float, default=0.1, help='Fraction of inter-AS links')
+    parser.add_argument('-n', '--noise', type=float, default=0.02, help='Fraction of third-party addresses')
+    parser.add_argument('-t', '--traces', type=int, default=1000, help='Number of traces in the warts fixture')
+    parser.add_argument('-p', '--prefixes', type=int, help='Number of more specific prefixes in the pfx2as table')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+    files = generate(args.directory, args.halves, seed=args.seed, ases=args.ases, degree_exponent=args.degree_exponent,
+                     interas=args.interas, noise=args.noise, traces=args.traces, prefixes=args.prefixes)
+    for name, filename in sorted(files.items()):
+        print('{}: {}'.format(name, filename))
+
+
+if __name__ == '__main__':
+    main()
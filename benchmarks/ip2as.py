@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Compares RoutingTable.lookup_many against one radix search_best per address.
+
+Run from the repository root: python -m benchmarks.ip2as -b routeviews-rv2-20170101-1200.pfx2as.csv
+"""
+import random
+import socket
+import struct
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from routing_table import RoutingTable
+
+
+def radix_lookups(rt, addresses, default=0):
+    asns = []
+    for address in addresses:
+        node = rt.search_best(address)
+        asns.append(node.data['asn'] if node is not None else default)
+    return asns
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-b', '--ip2as', required=True, help='BGP prefixes')
+    parser.add_argument('-n', '--num', type=int, default=1000000, help='Number of random addresses to look up')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    rt = RoutingTable.ip2as(args.ip2as)
+    rt.add_private(inet='ipv4')
+    rt.add_multicast(inet='ipv4')
+    print('Loaded radix table: {:.2f}s'.format(perf_counter() - start))
+
+    rng = random.Random(args.seed)
+    ipnums = np.array([rng.getrandbits(32) for _ in range(args.num)], dtype=np.int64)
+    addresses = [socket.inet_ntoa(struct.pack('!L', ipnum)) for ipnum in ipnums.tolist()]
+
+    start = perf_counter()
+    expected = radix_lookups(rt, addresses)
+    radix_time = perf_counter() - start
+    print('Radix search_best: {:,d} lookups in {:.2f}s ({:,.0f}/s)'.format(args.num, radix_time, args.num / radix_time))
+
+    start = perf_counter()
+    flat = rt.flatten()
+    print('Flattened to {:,d} intervals: {:.2f}s'.format(len(flat), perf_counter() - start))
+    start = perf_counter()
+    asns = rt.lookup_many(ipnums)
+    flat_time = perf_counter() - start
+    print('lookup_many: {:,d} lookups in {:.2f}s ({:,.0f}/s), {:.1f}x'.format(args.num, flat_time, args.num / flat_time, radix_time / flat_time))
+
+    mismatches = int((asns != np.array(expected, dtype=np.int64)).sum())
+    print('Mismatches: {:,d}'.format(mismatches))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
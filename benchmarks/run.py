@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Times ip2as loading, as2org loading, warts parsing, interface half creation, and algorithm on synthetic inputs, and
+compares the results against stored baselines.
+
+Each scale runs in its own process, so the peak RSS only covers that scale. The inputs are generated on the first run
+and reused afterwards. The baselines are machine specific, so they are kept next to the inputs, and the first run of
+each scale records its results as the baseline. Every run also times a fixed calibration workload, and the timings are
+scaled by how much faster or slower it ran than when the baseline was recorded.
+
+Run from the repository root: python -m benchmarks.run -s 10k 1m --check
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+from benchmarks.generate import generate
+
+# Approximate number of interface halves at each scale
+SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+PHASES = ['ip2as', 'as2org', 'traces', 'halves', 'algorithm']
+TIMINGS = PHASES + ['total']
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def calibrate(repeat=5):
+    """
+    Times a fixed pure Python workload of dict updates and sorting, similar to the algorithm's.
+    :return: Seconds taken by the fastest of repeat runs
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        counts = {}
+        for i in range(1000000):
+            key = i * 7919 % 1009
+            counts[key] = counts.get(key, 0) + 1
+        sorted(counts.items(), key=lambda item: item[1])
+        seconds = perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def measure(files, csr=False):
+    """Runs each phase once and returns the timings in seconds, peak RSS, per-iteration timings, and calibration."""
+    from algorithm import algorithm
+    from as2org import AS2Org
+    from graph import build_graph
+    from mapit import read_adjacencies, create_halves
+    from routing_table import RoutingTable
+    from trace import process_trace_file
+
+    results = {'calibration': calibrate()}
+    start = perf_counter()
+    ip2as = RoutingTable.ip2as(files['pfx2as'])
+    results['ip2as'] = perf_counter() - start
+
+    start = perf_counter()
+    as2org = AS2Org(files['as2org'], include_potaroo=False, lean=True)
+    results['as2org'] = perf_counter() - start
+
+    start = perf_counter()
+    process_trace_file(files['warts'])
+    results['traces'] = perf_counter() - start
+
+    adjacencies = read_adjacencies(files['adj'])
+    start = perf_counter()
+    if csr:
+        allhalves = build_graph(adjacencies, ip2as, as2org).allhalves()
+    else:
+        allhalves = create_halves(adjacencies, ip2as, as2org)
+    results['halves'] = perf_counter() - start
+    results['num_halves'] = len(allhalves)
+
+    iterations = []
+    start = perf_counter()
+    updates = algorithm(allhalves, factor=0, stats=iterations)
+    results['algorithm'] = perf_counter() - start
+    results['inferences'] = len(updates)
+    results['iterations'] = iterations
+    results['total'] = sum(results[phase] for phase in PHASES)
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def run_scale(scale, data, csr=False, seed=0):
+    """Generates the inputs for scale if needed, then measures them in a separate process."""
+    files = generate(os.path.join(data, scale), SCALES[scale], seed=seed)
+    command = [sys.executable, '-m', 'benchmarks.run', '--single', json.dumps(files)]
+    if csr:
+        command.append('--csr')
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def baseline_key(scale, csr):
+    return '{}-csr'.format(scale) if csr else scale
+
+
+def speed_factor(results, baseline):
+    """How many times longer the calibration took than when the baseline was recorded, or 1 without calibrations."""
+    old, new = baseline.get('calibration'), results.get('calibration')
+    if not old or not new:
+        return 1
+    return new / old
+
+
+def regressions(results, baseline, threshold, slack=0.1):
+    """
+    Compares the phase timings and peak RSS against a baseline. The timings are divided by speed_factor first.
+    :param threshold: Allowed fractional increase, such as 0.25 for 25%
+    :param slack: Timing increases smaller than this fraction of the baseline total are ignored as noise, since the
+    short phases vary by more than the threshold from run to run
+    :return: List of (metric, baseline, current) for each regression, with the current timings normalized
+    """
+    factor = speed_factor(results, baseline)
+    noise = slack * baseline.get('total', 0)
+    found = []
+    for metric in TIMINGS + ['peak_rss_mb']:
+        old, new = baseline.get(metric), results.get(metric)
+        if old is None or new is None:
+            continue
+        if metric in TIMINGS:
+            new /= factor
+            if new - old <= noise:
+                continue
+        if new > old * (1 + threshold):
+            found.append((metric, old, new))
+    return found
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--scales', nargs='+', choices=sorted(SCALES), default=['10k'])
+    parser.add_argument('-d', '--data', default='benchmark-data', help='Directory for the generated inputs')
+    parser.add_argument('-b', '--baselines', help='JSON file with the stored baselines, by default in --data')
+    parser.add_argument('-t', '--threshold', type=float, default=0.25, help='Allowed fractional slowdown')
+    parser.add_argument('--slack', type=float, default=0.1,
+                        help='Slowdowns smaller than this fraction of the baseline total are ignored')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('--csr', action='store_true', help='Use the CSR interface graph')
+    parser.add_argument('--check', action='store_true', help='Exit with an error if any metric regressed')
+    parser.add_argument('--save', action='store_true', help='Replace the stored baselines with the results')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--single', help='Internal: measure the JSON encoded input files and print the results')
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(json.loads(args.single), csr=args.csr)))
+        return
+
+    filename = args.baselines or os.path.join(args.data, 'baselines.json')
+    baselines = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            baselines = json.load(f)
+    all_results = {}
+    recorded = False
+    failed = False
+    for scale in args.scales:
+        key = baseline_key(scale, args.csr)
+        results = all_results[key] = run_scale(scale, args.data, csr=args.csr, seed=args.seed)
+        print('{}: {:,d} halves, {:,d} inferences, {:,d} iterations'.format(
+            key, results['num_halves'], results['inferences'], len(results['iterations'])))
+        for phase in TIMINGS:
+            print('  {:<10} {:8.2f}s'.format(phase, results[phase]))
+        print('  {:<10} {:8.0f}MB'.format('peak rss', results['peak_rss_mb']))
+        for stats in results['iterations']:
+            print('  iteration {iteration}: {seconds:.2f}s, {inferences:,d} inferences'.format(**stats))
+        if key in baselines:
+            print('  {:<10} {:8.2f}x the baseline'.format('calibration', speed_factor(results, baselines[key])))
+            for metric, old, new in regressions(results, baselines[key], args.threshold, args.slack):
+                failed = True
+                print('  REGRESSION {}: {:.2f} -> {:.2f}'.format(metric, old, new))
+        elif not args.save:
+            print('  No baseline for {}, recording these results in {}'.format(key, filename))
+            baselines[key] = results
+            recorded = True
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+    if args.save:
+        baselines.update(all_results)
+    if args.save or recorded:
+        with open(filename, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    if args.check and failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Measures the time to import mapit with python -X importtime, and fails if it exceeds a budget or if any of the
+heavyweight modules that should only be imported on the code paths that need them are imported at startup.
+
+Run from the repository root: python -m benchmarks.startup --budget 250
+"""
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# Modules that must not be imported by import mapit
+LAZY = ['pandas', 'ipyparallel', 'IPython', 'lxml', 'requests']
+
+
+def importtime(module=None):
+    """
+    Imports module in a new interpreter.
+    :param module: Module name, or None to only start the interpreter
+    :return: Dict of the cumulative import time in microseconds of every imported module
+    """
+    code = 'import {}'.format(module) if module else 'pass'
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], check=True,
+                            stderr=subprocess.PIPE, universal_newlines=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-m', '--module', default='mapit', help='Module to import')
+    parser.add_argument('-b', '--budget', type=float, default=250, help='Allowed import time in milliseconds')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of imports, of which the fastest is used')
+    parser.add_argument('-n', '--top', type=int, default=10, help='Number of slowest imported modules to show')
+    args = parser.parse_args()
+
+    runs = [importtime(args.module) for _ in range(args.repeat)]
+    times = min(runs, key=lambda run: run[args.module])
+    total = times[args.module] / 1000
+    print('import {}: {:.1f}ms (budget {:.0f}ms)'.format(args.module, total, args.budget))
+    # Modules imported by the interpreter itself, such as site, are not part of the module's import time
+    interpreter = importtime()
+    top_level = sorted(((name, us) for name, us in times.items()
+                        if name != args.module and '.' not in name and name not in interpreter),
+                       key=lambda item: item[1], reverse=True)
+    for name, us in top_level[:args.top]:
+        print('  {:<20} {:8.1f}ms'.format(name, us / 1000))
+    failed = False
+    if total > args.budget:
+        failed = True
+        print('REGRESSION: import time {:.1f}ms exceeds the {:.0f}ms budget'.format(total, args.budget))
+    lazy = sorted(name for name in times if name.split('.')[0] in LAZY)
+    if lazy:
+        failed = True
+        print('REGRESSION: imported at startup: {}'.format(', '.join(sorted({name.split('.')[0] for name in lazy}))))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Compares the main loop with the incremental Votes tallies against recounting the neighbors on every connected_org call.
+
+The inputs are generated on the first run and reused afterwards. Both variants run on the same interface halves, in
+alternating order, and must reach the same inferences.
+
+Run from the repository root: python -m benchmarks.votes -H 300000
+"""
+import os
+from argparse import ArgumentParser
+from time import process_time
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-H', '--halves', type=int, default=300000, help='Approximate number of interface halves')
+    parser.add_argument('-d', '--data', default='benchmark-data', help='Directory for the generated inputs')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs of each variant, of which the fastest is shown')
+    parser.add_argument('-f', '--factor', type=float, default=0)
+    parser.add_argument('-I', '--iterations', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from algorithm import main_loop
+    from as2org import AS2Org
+    from benchmarks.generate import generate
+    from mapit import create_halves, read_adjacencies
+    from routing_table import RoutingTable
+
+    files = generate(os.path.join(args.data, 'votes-{}'.format(args.halves)), args.halves, seed=args.seed)
+    ip2as = RoutingTable.ip2as(files['pfx2as'])
+    as2org = AS2Org(files['as2org'], include_potaroo=False)
+    allhalves = create_halves(read_adjacencies(files['adj']), ip2as, as2org)
+    halves = [half for half in allhalves if half.num_neighbors > 1]
+    print('{:,d} halves, {:,d} with more than one neighbor'.format(len(allhalves), len(halves)))
+
+    times = {True: [], False: []}
+    results = {}
+    for _ in range(args.repeat):
+        for tallies in (False, True):
+            start = process_time()
+            updates = main_loop(halves, args.factor, args.iterations, tallies=tallies)
+            times[tallies].append(process_time() - start)
+            results[tallies] = sorted(updates.rows())
+    recount = min(times[False])
+    tallied = min(times[True])
+    print('connected_org recount: {:.2f}s CPU'.format(recount))
+    print('Votes tallies:         {:.2f}s CPU, {:.2f}x'.format(tallied, recount / tallied))
+    if results[True] != results[False]:
+        print('The inferences differ')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import hashlib
+import os
+from collections import namedtuple
+from logging import getLogger
+
+from utils import load_pickle, save_pickle
+
+log = getLogger()
+
+CacheEntry = namedtuple('CacheEntry', ['size', 'mtime', 'digest', 'results'])
+
+
+def file_digest(filename, blocksize=1 << 20):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TraceCache:
+    """
+    On-disk cache of the process_trace_file output for each traceroute file.
+
+    An entry is reused while the file's path, size, and mtime are unchanged. When use_hash is True, a file whose mtime
+    changed but whose contents hash to the cached digest is also reused.
+    """
+
+    def __init__(self, directory, use_hash=False):
+        self.directory = directory
+        self.use_hash = use_hash
+        self.index_filename = os.path.join(directory, 'index.pickle')
+        os.makedirs(directory, exist_ok=True)
+        self.index = load_pickle(self.index_filename) if os.path.exists(self.index_filename) else {}
+        self.modified = False
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    def drop(self, filename):
+        """Removes a file's cached results so it no longer contributes to merged results."""
+        entry = self.index.pop(os.path.abspath(filename), None)
+        if entry is not None:
+            remove_quietly(os.path.join(self.directory, entry.results))
+            self.modified = True
+            return True
+        return False
+
+    def get(self, filename):
+        """
+        Returns the cached (adjacencies, addresses) for filename, or None if the file is not cached or has changed.
+        """
+        path = os.path.abspath(filename)
+        entry = self.index.get(path)
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if stat.st_size != entry.size:
+            return None
+        if stat.st_mtime_ns != entry.mtime:
+            if not self.use_hash or entry.digest is None or file_digest(path) != entry.digest:
+                return None
+            self.index[path] = entry._replace(mtime=stat.st_mtime_ns)
+            self.modified = True
+        try:
+            return load_pickle(os.path.join(self.directory, entry.results))
+        except (OSError, EOFError):
+            log.warning('Cached results for {} are missing or corrupt.'.format(path))
+            return None
+
+    def put(self, filename, results, stat):
+        """
+        Stores the results for filename.
+        :param stat: os.stat result from before the file was read, so a file that changes while it is read does not
+        match the entry
+        """
+        path = os.path.abspath(filename)
+        digest = None
+        if self.use_hash:
+            digest = file_digest(path)
+            current = os.stat(path)
+            # The file changed since it was read, so the digest is not for the contents the results came from
+            if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                digest = None
+        name = '{}.pickle'.format(hashlib.sha1(path.encode()).hexdigest())
+        save_pickle(os.path.join(self.directory, name), results)
+        self.index[path] = CacheEntry(stat.st_size, stat.st_mtime_ns, digest, name)
+        self.modified = True
+
+    def save(self):
+        if self.modified:
+            tmp = self.index_filename + '.tmp'
+            save_pickle(tmp, self.index)
+            os.replace(tmp, self.index_filename)
+            self.modified = False
+
+
+def remove_quietly(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,232 @@
+from logging import getLogger, WARNING
+from multiprocessing import get_context
+
+import numpy as np
+
+import metrics
+from algorithm import apply_stub_heuristic, main_loop
+from metrics import phase
+from progress import Progress
+from updates import Updates
+
+log = getLogger()
+
+# Set by component_algorithm before the pool is created, so the forked workers inherit them instead of unpickling the
+# halves for every task
+_halves = None
+_initial = None
+
+
+def component_labels(n, sources, targets):
+    """
+    Labels the connected components of an undirected graph with a vectorized union-find. Each round hooks the larger
+    root of every edge whose endpoints have different roots onto the smaller root, and then follows the parent pointers
+    until every label is a root.
+    :param n: Number of nodes
+    :param sources: Array of edge endpoints
+    :param targets: Array of the other edge endpoints
+    :return: Array with the smallest node in each node's component
+    """
+    labels = np.arange(n)
+    while len(sources):
+        source_labels = labels[sources]
+        target_labels = labels[targets]
+        different = source_labels != target_labels
+        # Edges whose endpoints are already in the same component stay that way
+        sources = sources[different]
+        targets = targets[different]
+        source_labels = source_labels[different]
+        target_labels = target_labels[different]
+        np.minimum.at(labels, np.maximum(source_labels, target_labels), np.minimum(source_labels, target_labels))
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+    return labels
+
+
+def half_links(allhalves):
+    """
+    Positions in allhalves of the halves joined by neighbor, otherhalf, and otherside links.
+    :return: Arrays of sources and targets
+    """
+    # Keyed by id, since hashing the halves themselves calls InterfaceHalf.__hash__ for every link
+    positions = {id(half): i for i, half in enumerate(allhalves)}
+    ids = np.arange(len(allhalves), dtype=np.int64)
+    # Neighbors are symmetric, so the forward neighbors cover every neighbor link
+    counts = np.fromiter((half.num_neighbors if half.direction else 0 for half in allhalves), dtype=np.int64,
+                         count=len(allhalves))
+    neighbor_sources = np.repeat(ids, counts)
+    neighbor_targets = np.fromiter(
+        (positions[id(other)] for half in allhalves if half.direction for other in half.neighbors), dtype=np.int64,
+        count=counts.sum())
+    # id(None) is not a position, so halves without an otherhalf or otherside get -1
+    otherhalf = np.fromiter((positions.get(id(half.otherhalf), -1) for half in allhalves), dtype=np.int64,
+                            count=len(allhalves))
+    otherside = np.fromiter((positions.get(id(half.otherside), -1) for half in allhalves), dtype=np.int64,
+                            count=len(allhalves))
+    has_otherhalf = otherhalf >= 0
+    has_otherside = otherside >= 0
+    sources = np.concatenate([neighbor_sources, ids[has_otherhalf], ids[has_otherside]])
+    targets = np.concatenate([neighbor_targets, otherhalf[has_otherhalf], otherside[has_otherside]])
+    return sources, targets
+
+
+def graph_links(graph):
+    """Same as half_links for graph.allhalves(), using the graph's arrays."""
+    n = len(graph.asns)
+    positions = np.cumsum(graph.valid) - 1
+    counts = np.diff(graph.forward_offsets)
+    # Neighbors are symmetric, so the forward neighbors cover every neighbor link
+    neighbor_sources = np.repeat(2 * np.arange(n, dtype=np.int64) + 1, counts)
+    neighbor_targets = 2 * graph.forward_indices.astype(np.int64)
+    ids = np.arange(2 * n, dtype=np.int64)
+    has_otherhalf = graph.otherhalf >= 0
+    has_otherside = graph.otherside >= 0
+    sources = np.concatenate([neighbor_sources, ids[has_otherhalf], ids[has_otherside]])
+    targets = np.concatenate([neighbor_targets, graph.otherhalf[has_otherhalf], graph.otherside[has_otherside]])
+    return positions[sources], positions[targets]
+
+
+def components(allhalves, graph=None):
+    """
+    Splits the halves into the components connected by neighbor, otherhalf, and otherside links. The inferences for a
+    half only depend on the halves in its component.
+    :param graph: Graph when the halves are graph.allhalves(), used to find the links without visiting every half
+    :return: List of arrays of positions in allhalves, one per component, in allhalves order
+    """
+    sources, targets = graph_links(graph) if graph is not None else half_links(allhalves)
+    labels = component_labels(len(allhalves), sources, targets)
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, boundaries)
+
+
+def batches(comps, batch_size):
+    """
+    Groups the components into tasks, largest first so the slowest components start first. Components smaller than
+    batch_size are combined until each task has at least batch_size halves.
+    """
+    comps = sorted(comps, key=len, reverse=True)
+    tasks = []
+    batch = []
+    size = 0
+    for comp in comps:
+        if len(comp) >= batch_size:
+            tasks.append([comp])
+            continue
+        batch.append(comp)
+        size += len(comp)
+        if size >= batch_size:
+            tasks.append(batch)
+            batch = []
+            size = 0
+    if batch:
+        tasks.append(batch)
+    return tasks
+
+
+def init_worker():
+    # The per-iteration messages for thousands of components would flood the log, and the metrics file is written
+    # only by the main process
+    log.setLevel(max(log.level, WARNING))
+    metrics.configure()
+
+
+def run_components(args):
+    """
+    Runs one main loop on all of the components in a batch, which do not share any links.
+    :return: The (position, Entry) of every inference, the iteration stats, and the number of halves
+    """
+    batch, factor, iterations = args
+    positions = np.concatenate(batch).tolist()
+    comp_halves = [_halves[i] for i in positions]
+    initial = None
+    if _initial is not None:
+        initial = Updates(entries={half: _initial.entry(half) for half in comp_halves if half in _initial})
+    halves = [half for half in comp_halves if half.num_neighbors > 1]
+    stats = []
+    updates = main_loop(halves, factor, iterations, stats=stats, initial=initial)
+    index = dict(zip(comp_halves, positions))
+    return [(index[half], entry) for half, entry in updates.entries()], stats, len(positions)
+
+
+def add_results(results, allhalves, base, task_stats, pb):
+    entries, stats, size = results
+    base.update((allhalves[i], entry) for i, entry in entries)
+    task_stats.append(stats)
+    pb.add(size)
+
+
+def merge_stats(task_stats):
+    """
+    Combines the per-task iteration stats. Iteration i has the total time of every task's iteration i, and the total
+    inferences, where tasks that already stopped contribute their final inferences.
+    """
+    stats = []
+    for iteration in range(max((len(task) for task in task_stats), default=0)):
+        seconds = 0
+        inferences = 0
+        for task in task_stats:
+            if iteration < len(task):
+                seconds += task[iteration]['seconds']
+            inferences += task[min(iteration, len(task) - 1)]['inferences'] if task else 0
+        stats.append({'iteration': iteration, 'seconds': seconds, 'inferences': inferences})
+    return stats
+
+
+def component_algorithm(allhalves, factor=0.5, providers=None, iterations=100, workers=1, batch_size=10000, graph=None,
+                        stats=None, initial=None):
+    """
+    Runs the MAP-IT main loop separately on each batch of connected components, then applies the stub heuristic to all
+    halves.
+
+    Components with at least batch_size halves run alone, and smaller components are combined into one main loop per
+    batch, so the thousands of tiny components do not each pay for setting up a main loop. Each batch stops as soon as
+    its own inferences repeat, so small components that converge quickly are not rescanned while the giant component is
+    still changing. The inferences are the same as algorithm unless a component oscillates, in which case it stops at
+    its batch's repeat instead of when the combined inferences repeat.
+    :param workers: Number of processes. With 1, the components are run in this process
+    :param batch_size: Components with fewer halves are batched together until a task has at least this many halves
+    :param graph: Graph when the halves are graph.allhalves(), used to find the components faster
+    :return: Updates object with the final set of inter-AS links
+    """
+    global _halves, _initial
+    with phase('components', items=len(allhalves)) as record:
+        comps = components(allhalves, graph=graph)
+        record['components'] = len(comps)
+    # Components without a half that has multiple neighbors cannot get inferences, except by keeping initial ones
+    multiple = np.fromiter((half.num_neighbors > 1 for half in allhalves), dtype=bool, count=len(allhalves))
+    if initial is not None:
+        multiple |= np.fromiter((half in initial for half in allhalves), dtype=bool, count=len(allhalves))
+    comps = [comp for comp in comps if multiple[comp].any()]
+    tasks = batches(comps, batch_size)
+    log.info('Running {:,d} components (largest {:,d} halves) as {:,d} tasks on {:,d} processes'.format(
+        len(comps), max((len(comp) for comp in comps), default=0), len(tasks), workers))
+    _halves = allhalves
+    _initial = initial
+    args = [(batch, factor, iterations) for batch in tasks]
+    base = {}
+    task_stats = []
+    try:
+        pb = Progress(sum(len(comp) for comp in comps), 'Running components',
+                      callback=lambda: '{:,d} of {:,d} tasks'.format(len(task_stats), len(tasks)))
+        with phase('main_loop', components=len(comps)):
+            if workers > 1:
+                with get_context('fork').Pool(workers, initializer=init_worker) as pool, pb:
+                    for results in pool.imap_unordered(run_components, args):
+                        add_results(results, allhalves, base, task_stats, pb)
+            else:
+                with pb:
+                    for task in args:
+                        add_results(run_components(task), allhalves, base, task_stats, pb)
+    finally:
+        _halves = None
+        _initial = None
+    updates = Updates(entries=base)
+    if stats is not None:
+        stats.extend(merge_stats(task_stats))
+    if providers is not None:
+        apply_stub_heuristic(allhalves, updates, providers)
+    return updates
@@ -0,0 +1,290 @@
+from logging import getLogger
+
+import numpy as np
+
+from adjacency import address_arrays, ipnum, ipnum6, keys6, ntoa, ntoa6, pack6
+from interning import org_code
+from metrics import phase
+from progress import status, finish_status
+
+log = getLogger()
+
+
+class GraphHalf:
+    """
+    View of a single interface half in a Graph. It has the same attributes as InterfaceHalf, but everything is read
+    from the graph's arrays. Each half has exactly one view, so identity is used for equality and hashing.
+    """
+
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    def __repr__(self):
+        return 'GraphHalf{}'.format(str(self.identifier))
+
+    @property
+    def address(self):
+        return self.graph.address(self.index >> 1)
+
+    @property
+    def asn(self):
+        return int(self.graph.asns[self.index >> 1])
+
+    @property
+    def direction(self):
+        return bool(self.index & 1)
+
+    @property
+    def identifier(self):
+        return self.address, self.direction
+
+    @property
+    def neighbors(self):
+        halves = self.graph.halves
+        return [halves[i] for i in self.graph.neighbor_indices(self.index).tolist()]
+
+    @property
+    def num_neighbors(self):
+        return self.graph.num_neighbors(self.index)
+
+    @property
+    def org(self):
+        return int(self.graph.orgs[self.index >> 1])
+
+    @property
+    def otherhalf(self):
+        i = self.graph.otherhalf[self.index]
+        return self.graph.halves[i] if i >= 0 else None
+
+    @property
+    def otherside(self):
+        i = self.graph.otherside[self.index]
+        return self.graph.halves[i] if i >= 0 else None
+
+    @property
+    def otherside_address(self):
+        return self.graph.otherside_address(self.index >> 1)
+
+
+class Graph:
+    """
+    Interface graph stored as integer arrays.
+
+    Every address has a dense id, and the half for address id a in direction d has id 2 * a + d. The IPv4 addresses
+    come first, in order of the addresses as integers (ipnums), followed by the IPv6 addresses in address order
+    (ipnums6, an (n6, 2) uint64 array of the high and low 64 bits). The otherside_ipnums and otherside_ipnums6 arrays
+    hold the other side address of each IPv4 and IPv6 address. The forward neighbors of address a are
+    forward_indices[forward_offsets[a]:forward_offsets[a + 1]] (CSR), and likewise for the backward neighbors. The
+    otherhalf and otherside arrays hold half ids, with -1 when the half does not exist. The orgs array holds the
+    interned org code of each address. Address strings are only created when a half's address is read.
+    """
+
+    def __init__(self, ipnums, asns, orgs, otherside_ipnums, forward, backward, forward_valid, backward_valid, othersides,
+                 ipnums6=None, otherside_ipnums6=None):
+        self.ipnums = ipnums
+        self.ipnums6 = np.zeros((0, 2), dtype=np.uint64) if ipnums6 is None else ipnums6
+        self.keys6 = keys6(self.ipnums6)
+        self.asns = asns
+        self.orgs = orgs
+        self.otherside_ipnums = otherside_ipnums
+        self.otherside_ipnums6 = np.zeros((0, 2), dtype=np.uint64) if otherside_ipnums6 is None else otherside_ipnums6
+        self.forward_offsets, self.forward_indices = forward
+        self.backward_offsets, self.backward_indices = backward
+        n = len(asns)
+        valid = np.zeros(2 * n, dtype=bool)
+        valid[1::2] = forward_valid
+        valid[0::2] = backward_valid
+        self.valid = valid
+        ids = np.arange(2 * n, dtype=np.int64)
+        self.otherhalf = np.where(valid[ids ^ 1], ids ^ 1, -1)
+        self.otherhalf[~valid] = -1
+        self.otherside = np.full(2 * n, -1, dtype=np.int64)
+        has_otherside = othersides >= 0
+        for direction in (0, 1):
+            sides = 2 * othersides + (1 - direction)
+            mask = has_otherside & valid[direction::2]
+            mask[mask] = valid[sides[mask]]
+            self.otherside[direction::2][mask] = sides[mask]
+        self.halves = [GraphHalf(self, i) if v else None for i, v in enumerate(valid.tolist())]
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    def allhalves(self):
+        return [half for half in self.halves if half is not None]
+
+    def address(self, a):
+        """Address string for address id a."""
+        n4 = len(self.ipnums)
+        if a < n4:
+            return ntoa(int(self.ipnums[a]))
+        return ntoa6(*self.ipnums6[a - n4].tolist())
+
+    def find(self, address, direction):
+        """Returns the half for the address and direction, or None if it is not in the graph."""
+        if ':' in address:
+            offset = len(self.ipnums)
+            i = int(index_sorted(keys6(np.array([ipnum6(address)], dtype=np.uint64)), self.keys6)[0])
+        else:
+            offset = 0
+            i = int(index_sorted(np.array([ipnum(address)]), self.ipnums)[0])
+        if i < 0:
+            return None
+        return self.halves[2 * (offset + i) + int(direction)]
+
+    def neighbor_indices(self, index):
+        """Half ids of the neighbors of half index."""
+        a = index >> 1
+        if index & 1:
+            return 2 * self.forward_indices[self.forward_offsets[a]:self.forward_offsets[a + 1]]
+        return 2 * self.backward_indices[self.backward_offsets[a]:self.backward_offsets[a + 1]] + 1
+
+    def num_neighbors(self, index):
+        a = index >> 1
+        offsets = self.forward_offsets if index & 1 else self.backward_offsets
+        return int(offsets[a + 1] - offsets[a])
+
+    def otherside_address(self, a):
+        n4 = len(self.ipnums)
+        if a < n4:
+            return ntoa(int(self.otherside_ipnums[a]))
+        return ntoa6(*self.otherside_ipnums6[a - n4].tolist())
+
+
+def csr(sources, targets, n):
+    """
+    Builds CSR arrays from parallel arrays of source and target ids.
+    :return: offsets (length n + 1) and indices, where each row's indices are sorted
+    """
+    order = np.lexsort((targets, sources))
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return offsets, targets[order].astype(np.uint32)
+
+
+def index_sorted(values, sorted_values):
+    """Vectorized index of each value in a sorted array of unique values, or -1 if the value is missing."""
+    if len(sorted_values) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    idx = np.searchsorted(sorted_values, values)
+    idx[idx == len(sorted_values)] = 0
+    return np.where(sorted_values[idx] == values, idx, -1)
+
+
+def isin_sorted(values, sorted_values):
+    """Vectorized membership test of values in a sorted array."""
+    return index_sorted(values, sorted_values) >= 0
+
+
+def otherside_offsets(remainder, seen):
+    """
+    Offset from each address to its other side.
+    :param remainder: Each address modulo 4
+    :param seen: Whether the first or last address of each address' /30 (or /126) is a known interface address
+    :return: Array of +1 and -1
+    """
+    # Addresses 0 and 3 are definitely in a /31. For addresses 1 and 2, if the network or broadcast address was seen,
+    # then it's definitely a /31. Otherwise, we can't be sure if it's a /30 or /31, so we assume it's a /30.
+    upward = (remainder == 0) | ((remainder == 1) & ~seen) | ((remainder == 2) & seen)
+    return np.where(upward, 1, -1)
+
+
+def determine_othersides(ipnums, all_interfaces):
+    """
+    Vectorized version of determine_otherside that decides between /30 and /31 prefixes for every address at once.
+    :param ipnums: Array of IPv4 interface addresses as integers
+    :param all_interfaces: Sorted array of all known IPv4 interface addresses as integers
+    :return: Array of the other side addresses as integers
+    """
+    ipnums = np.asarray(ipnums, dtype=np.int64)
+    remainder = ipnums % 4
+    network_address = ipnums - remainder
+    broadcast_address = network_address + 3
+    seen = isin_sorted(network_address, all_interfaces) | isin_sorted(broadcast_address, all_interfaces)
+    return ipnums + otherside_offsets(remainder, seen)
+
+
+def determine_othersides6(pairs, all_interfaces):
+    """
+    IPv6 version of determine_othersides, which decides between /126 and /127 prefixes in the same way. The other side
+    is always in the same /126, so only the low 64 bits change.
+    :param pairs: (n, 2) uint64 array of IPv6 interface addresses
+    :param all_interfaces: Sorted keys6 of all known IPv6 interface addresses
+    :return: (n, 2) uint64 array of the other side addresses
+    """
+    high = pairs[:, 0]
+    low = pairs[:, 1]
+    remainder = low & np.uint64(3)
+    network_address = low - remainder
+    broadcast_address = network_address + np.uint64(3)
+    seen = (isin_sorted(keys6(np.column_stack([high, network_address])), all_interfaces)
+            | isin_sorted(keys6(np.column_stack([high, broadcast_address])), all_interfaces))
+    # Adding 2 ** 64 - 1 wraps around to subtracting 1
+    return np.column_stack([high, low + otherside_offsets(remainder, seen).astype(np.uint64)])
+
+
+def build_graph(adjacencies, ip2as, as2org, seen=None):
+    """
+    Creates the Graph for a set of adjacencies.
+    :param adjacencies: Collection of (address, address) tuples, or BinaryAdjacencies
+    :param ip2as: RoutingTable
+    :param as2org: AS2Org, or None to treat each AS as its own org
+    :param seen: Additional addresses used when determining the other sides, as strings or as an array of IPv4
+    addresses as integers
+    :return: Graph
+    """
+    status('Assigning ids to addresses')
+    interface_ipnums, interface_ipnums6, all_sources, all_targets = address_arrays(adjacencies)
+    num_ipv4 = len(interface_ipnums)
+    finish_status('Found {:,d}'.format(num_ipv4 + len(interface_ipnums6)))
+    log.info('Mapping IP addresses to ASes.')
+    asns_all = ip2as.lookup_many(interface_ipnums)
+    if len(interface_ipnums6):
+        asns_all = np.concatenate([asns_all, ip2as.lookup_many6(interface_ipnums6)])
+    keep = asns_all != -2
+    ipnums = interface_ipnums[keep[:num_ipv4]]
+    ipnums6 = interface_ipnums6[keep[num_ipv4:]]
+    asns = asns_all[keep]
+    n = len(asns)
+    log.info('Mapping ASes to Orgs.')
+    unique_asns, inverse = np.unique(asns, return_inverse=True)
+    codes = np.array([org_code(as2org[asn] if as2org else asn) for asn in unique_asns.tolist()], dtype=np.int32)
+    orgs = codes[inverse]
+    log.info('Building CSR neighbor arrays.')
+    # Ids after dropping the addresses mapped to -2, which is -1 for the dropped addresses
+    remap = np.cumsum(keep) - 1
+    remap[~keep] = -1
+    sources = remap[all_sources]
+    targets = remap[all_targets]
+    # A half exists if its address appears in an adjacency, even when the other address was dropped
+    forward_valid = np.zeros(n, dtype=bool)
+    forward_valid[sources[sources >= 0]] = True
+    backward_valid = np.zeros(n, dtype=bool)
+    backward_valid[targets[targets >= 0]] = True
+    both = (sources >= 0) & (targets >= 0)
+    sources = sources[both]
+    targets = targets[both]
+    forward = csr(sources, targets, n)
+    backward = csr(targets, sources, n)
+    log.info('Determining other sides for each address (assuming point-to-point).')
+    with phase('othersides', items=n):
+        all_interfaces = interface_ipnums
+        all_interfaces6 = keys6(interface_ipnums6)
+        if isinstance(seen, np.ndarray):
+            all_interfaces = np.union1d(all_interfaces, seen.astype(np.int64))
+        elif seen:
+            seen_ipnums = np.array([ipnum(address) for address in seen if ':' not in address], dtype=np.int64)
+            all_interfaces = np.union1d(all_interfaces, seen_ipnums)
+            seen_ipnums6 = pack6([address for address in seen if ':' in address])
+            all_interfaces6 = np.union1d(all_interfaces6, keys6(seen_ipnums6))
+        otherside_ipnums = determine_othersides(ipnums, all_interfaces)
+        otherside_ipnums6 = determine_othersides6(ipnums6, all_interfaces6)
+        othersides6 = index_sorted(keys6(otherside_ipnums6), keys6(ipnums6))
+        othersides = np.concatenate([
+            index_sorted(otherside_ipnums, ipnums), np.where(othersides6 >= 0, othersides6 + len(ipnums), -1)])
+    log.info('Creating interface halves.')
+    return Graph(ipnums, asns, orgs, otherside_ipnums, forward, backward, forward_valid, backward_valid, othersides,
+                 ipnums6=ipnums6, otherside_ipnums6=otherside_ipnums6)
@@ -0,0 +1,34 @@
+class Interner:
+    """
+    Assigns dense int codes to values in the order they are first seen, so the algorithm can compare and hash ints
+    instead of the values themselves.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def decode(self, code):
+        return self.values[code]
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+# Process-wide org codes. Orgs are encoded when the interface halves are created and decoded only for output.
+ORGS = Interner()
+
+
+def org_code(org):
+    return ORGS.encode(str(org))
+
+
+def org_name(code):
+    return ORGS.decode(code)
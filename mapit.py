@@ -1,19 +1,36 @@
 #!/usr/bin/env python
+import json
+import os
 import socket
 import struct
 import sys
 from argparse import ArgumentParser, FileType
 from collections import defaultdict
+from contextlib import contextmanager
+from importlib.util import find_spec
 from logging import getLogger, StreamHandler
+from tempfile import TemporaryDirectory
+from time import perf_counter
 
-import pandas as pd
+import numpy as np
 
+from adjacency import is_binary, ntoa, pack6, read_binary_adjacencies, write_binary_adjacencies
 from algorithm import algorithm
 from as2org import AS2Org
+from cache import TraceCache
+from components import component_algorithm
+from graph import build_graph
 from interface_half import InterfaceHalf
+from interning import org_code
+from parallel import BorderPool
+import metrics
+from metrics import phase
 from progress import Progress, status, finish_status
-from routing_table import RoutingTable
-from utils import File2
+from routing_table import FlatTable, RoutingTable
+from spill import SpilledAddresses, SpilledAdjacencies
+from trace import process_trace_files
+from updates import read_updates
+from utils import File2, ls
 
 log = getLogger()
 if not log.hasHandlers():
@@ -21,14 +38,22 @@ if not log.hasHandlers():
     log.addHandler(ch)
 
 
+def address_int(address):
+    """IPv4 or IPv6 address as an integer."""
+    if ':' in address:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+    return struct.unpack("!L", socket.inet_aton(address))[0]
+
+
 def determine_otherside(address, all_interfaces):
     """
-    Attempts to determine if an interface address in assigned from a /30 or /31 prefix.
-    :param address: IPv4 interface address in dot notation
-    :param all_interfaces: All known IPv4 interface addresses already converted to integers
-    :return: IPv4 address in dot notation
+    Attempts to determine if an interface address in assigned from a /30 or /31 prefix, or for IPv6, from a /126 or /127
+    prefix.
+    :param address: IPv4 address in dot notation, or IPv6 address
+    :param all_interfaces: All known interface addresses already converted to integers with address_int
+    :return: Address in the same notation
     """
-    ip = struct.unpack("!L", socket.inet_aton(address))[0]
+    ip = address_int(address)
     remainder = ip % 4
     network_address = ip - remainder
     broadcast_address = network_address + 3
@@ -44,41 +69,77 @@ def determine_otherside(address, all_interfaces):
         # It's between the network and broadcast address
         # We can't be sure if it's a /30 or /31, so we assume it's a /30
         otherside = (ip + 1) if remainder == 1 else (ip - 1)
+    if ':' in address:
+        return socket.inet_ntop(socket.AF_INET6, otherside.to_bytes(16, 'big'))
     return socket.inet_ntoa(struct.pack('!L', otherside))
 
 
 def read_adjacencies(filename):
+    """
+    Reads a text file with one pair of addresses per line, or memory maps a binary adjacency file.
+    :return: Set of (address, address) tuples, or BinaryAdjacencies
+    """
+    if is_binary(filename):
+        return read_binary_adjacencies(filename)
     log.info('Reading adjacencies from {}'.format(filename))
     with File2(filename) as f:
         return {tuple(l.split()) for l in f}
 
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument('-a', '--adjacencies', help='Adjacencies derived from traceroutes')
-    parser.add_argument('-b', '--ip2as', help='BGP prefixes')
-    parser.add_argument('-c', '--addresses', help='List of addresses')
-    parser.add_argument('-f', '--factor', type=float, default=0, help='Factor used in the paper')
-    parser.add_argument('-i', '--interfaces', dest='interfaces', help='Interface information')
-    parser.add_argument('-o', '--as2org', help='AS2ORG mappings')
-    parser.add_argument('-v', dest='verbose', action='count', default=0, help='Increase verbosity for each v')
-    parser.add_argument('-w', '--output', type=FileType('w'), default='-', help='Output filename')
-    parser.add_argument('--addresses-exit', dest='addresses_exit', type=FileType('w'), help='Extract addresses from traces and exit.')
-    parser.add_argument('--potaroo', action='store_true', help='Include AS identifiers and names from http://bgp.potaroo.net/cidr/autnums.html')
-    parser.add_argument('--trace-exit', type=FileType('w'), help='Extract adjacencies and addresses from the traceroutes and exit')
-    providers_group = parser.add_mutually_exclusive_group()
-    providers_group.add_argument('-r', '--rel-graph', help='CAIDA relationship graph')
-    providers_group.add_argument('-p', '--asn-providers', help='List of ISP ASes')
-    providers_group.add_argument('-q', '--org-providers', help='List of ISP ORGs')
-    parser.add_argument('-I', '--iterations', type=int, default=100)
-    args = parser.parse_args()
+def read_list(filename, convert=str):
+    with File2(filename) as f:
+        return {convert(line.strip()) for line in f if line.strip() and line[0] != '#'}
 
-    log.setLevel(max((3 - args.verbose) * 10, 10))
 
-    ip2as = RoutingTable.ip2as(args.ip2as)
-    as2org = AS2Org(args.as2org, include_potaroo=False)
+@contextmanager
+def output_file(filename):
+    """
+    Opens filename for writing only when it is written, unlike FileType, so that rejected arguments do not truncate it.
+    :param filename: Filename, or - for stdout
+    """
+    if filename == '-':
+        yield sys.stdout
+    else:
+        with open(filename, 'w') as f:
+            yield f
 
-    adjacencies = read_adjacencies(args.adjacencies)
+
+def write_adjacencies(f, adjacencies):
+    for x, y in adjacencies:
+        f.write('{} {}\n'.format(x, y))
+
+
+def write_addresses(f, addresses):
+    for address in addresses:
+        f.write('{}\n'.format(address))
+
+
+def map_addresses(addresses, ip2as):
+    """
+    Maps each address to its ASN. A FlatTable maps all of the IPv4 and all of the IPv6 addresses in one vectorized
+    lookup each, since each of its single address lookups is a separate binary search call.
+    :return: Dict of address to ASN
+    """
+    if not isinstance(ip2as, FlatTable):
+        return {address: ip2as[address] for address in addresses}
+    addresses4 = [address for address in addresses if ':' not in address]
+    addresses6 = [address for address in addresses if ':' in address]
+    ipnums = np.frombuffer(b''.join(map(socket.inet_aton, addresses4)), dtype='>u4').astype(np.int64)
+    asns = dict(zip(addresses4, ip2as.lookup_many(ipnums).tolist()))
+    if addresses6:
+        asns.update(zip(addresses6, ip2as.lookup_many6(pack6(addresses6)).tolist()))
+    return asns
+
+
+def create_halves(adjacencies, ip2as, as2org, seen=frozenset()):
+    """
+    Creates an InterfaceHalf for each address and direction in the adjacencies.
+    :param adjacencies: Set of (address, address) tuples
+    :param ip2as: RoutingTable
+    :param as2org: AS2Org, or None to treat each AS as its own org
+    :param seen: Additional addresses used when determining the other sides
+    :return: List of InterfaceHalf objects
+    """
     neighbors = defaultdict(list)
     for x, y in adjacencies:
         neighbors[(x, True)].append(y)
@@ -87,21 +148,19 @@ def main():
     unique_interfaces = {u for u, _ in adjacencies} | {v for _, v in adjacencies}
     finish_status('Found {:,d}'.format(len(unique_interfaces)))
     status('Converting addresses to ipnums')
-    addresses = {struct.unpack("!L", socket.inet_aton(addr.strip()))[0] for addr in unique_interfaces}
+    addresses = {address_int(addr.strip()) for addr in unique_interfaces | seen}
     finish_status()
     log.info('Mapping IP addresses to ASes.')
-    asns = {}
-    for address in unique_interfaces:
-        asn = ip2as[address]
-        if asn != -2:
-            asns[address] = asn
+    asns = {address: asn for address, asn in map_addresses(unique_interfaces, ip2as).items() if asn != -2}
     if as2org:
         log.info('Mapping ASes to Orgs.')
-        orgs = {address: as2org[asn] for address, asn in asns.items()}
+        codes = {asn: org_code(as2org[asn]) for asn in set(asns.values())}
     else:
-        orgs = asns
+        codes = {asn: org_code(asn) for asn in set(asns.values())}
+    orgs = {address: codes[asn] for address, asn in asns.items()}
     log.info('Determining other sides for each address (assuming point-to-point).')
-    othersides = {address: determine_otherside(address, addresses) for address in asns}
+    with phase('othersides', items=len(asns)):
+        othersides = {address: determine_otherside(address, addresses) for address in asns}
     log.info('Creating interface halves.')
     halves_dict = {
         (address, direction): InterfaceHalf(address, asns[address], orgs[address], direction, othersides[address])
@@ -112,20 +171,299 @@ def main():
         half.set_otherside(halves_dict.get((half.otherside_address, not direction)))
         half.set_neighbors([halves_dict[(neighbor, not direction)] for neighbor in neighbors[(address, direction)] if
                             neighbor in asns])
-    allhalves = list(halves_dict.values())
+    return list(halves_dict.values())
+
+
+def process_trace_files_spilled(filenames, memory_limit, jobs=1, cache=None, directory=None, adjacencies_filename=None):
+    """
+    Extracts the adjacencies and addresses from the traceroute files with bounded memory, by spilling them to sorted
+    runs in a temporary directory, and merges the adjacencies into a binary adjacency file. IPv6 adjacencies and
+    addresses are skipped.
+    :param memory_limit: Memory budget in bytes, split between the adjacencies (3/4) and the addresses (1/4)
+    :param directory: Parent directory of the temporary directory, or None for the system default
+    :param adjacencies_filename: Binary adjacency file to write, or None to write it in the temporary directory
+    :return: BinaryAdjacencies, and sorted array of the IPv4 addresses as integers
+    """
+    with TemporaryDirectory(prefix='mapit-spill-', dir=directory) as tmp:
+        adjacencies = SpilledAdjacencies(tmp, memory_limit * 3 // 4)
+        addresses = SpilledAddresses(tmp, memory_limit // 4)
+        try:
+            process_trace_files(filenames, jobs=jobs, cache=cache, adjacencies=adjacencies, addresses=addresses)
+            filename = adjacencies_filename or os.path.join(tmp, 'adjacencies.bin')
+            adjacencies.write(filename)
+            trace_addresses = addresses.sorted()
+        finally:
+            adjacencies.close()
+            addresses.close()
+        # The file is memory mapped before the temporary directory is removed, and the mapping stays valid afterwards
+        return read_binary_adjacencies(filename), trace_addresses
+
+
+def read_run_stats(filename):
+    """Reads the iterations and time that a previous run wrote with --stats, or returns None if they cannot be read."""
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_run_stats(filename, stats, seconds, warm_start=None):
+    """Writes the number of iterations and the algorithm time, for comparison with later warm starts."""
+    with open(filename, 'w') as f:
+        json.dump({'iterations': len(stats), 'seconds': seconds, 'warm_start': warm_start, 'stats': stats}, f)
+
+
+def half_finder(allhalves, graph=None):
+    """
+    Function from (address, direction) to the half, or None if there is no such half.
+    :param graph: Graph when the halves are GraphHalf objects, used to find halves without building a dictionary
+    """
+    if graph is not None:
+        return graph.find
+    halves = {half.identifier: half for half in allhalves}
+    return lambda address, direction: halves.get((address, direction))
+
+
+def warm_start(filename, allhalves, graph=None):
+    """
+    Loads a previous run's results as the initial inferences for the current halves.
+    :param filename: CSV results from a previous run
+    :param graph: Graph when the halves are GraphHalf objects, used to find halves without building a dictionary
+    """
+    initial, missing = read_updates(filename, half_finder(allhalves, graph))
+    log.info('Warm start: {:,d} direct inferences from {} ({:,d} halves no longer exist)'.format(
+        len(initial), filename, missing))
+    return initial
+
+
+def report_warm_start(previous, stats, seconds):
+    if previous is None:
+        log.info('Warm start: {:,d} iterations in {:.2f}s (no stats for the previous run)'.format(
+            len(stats), seconds))
+        return
+    log.info('Warm start: {:,d} iterations in {:.2f}s, previous run took {:,d} iterations in {:.2f}s, '
+             'saving {:,d} iterations and {:.2f}s'.format(
+                 len(stats), seconds, previous['iterations'], previous['seconds'],
+                 previous['iterations'] - len(stats), previous['seconds'] - seconds))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-a', '--adjacencies', help='Adjacencies derived from traceroutes')
+    parser.add_argument('-b', '--ip2as', help='BGP prefixes')
+    parser.add_argument('-c', '--addresses', help='List of addresses')
+    parser.add_argument('-f', '--factor', type=float, default=0, help='Factor used in the paper')
+    parser.add_argument('-i', '--interfaces', dest='interfaces', help='Interface information')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes used to read the traceroute files')
+    parser.add_argument('-o', '--as2org', help='AS2ORG mappings')
+    parser.add_argument('-t', '--traceroutes', help='Unix-style filename regex for the traceroute files')
+    parser.add_argument('-v', dest='verbose', action='count', default=0, help='Increase verbosity for each v')
+    parser.add_argument('-x', '--ixp-asns', help='List of ASNs used at IXPs')
+    parser.add_argument('-y', '--ixp-prefixes', help='List of IXP prefixes')
+    parser.add_argument('-w', '--output', type=FileType('w'), default='-', help='Output filename')
+    parser.add_argument('--output-format', choices=['csv', 'npz', 'parquet'], default='csv', help='Output format. npz and parquet require -w')
+    parser.add_argument('--cache', help='Directory used to cache the adjacencies and addresses of each traceroute file')
+    parser.add_argument('--cache-hash', action='store_true', help='Reuse cached results for files whose mtime changed but whose contents did not')
+    parser.add_argument('--cache-drop', action='append', default=[], help='Remove a traceroute file from the cache and exclude it from this run')
+    parser.add_argument('--as2org-lean', action='store_true', help='Read only the ASN to org mappings from the AS2ORG file')
+    parser.add_argument('--as2org-cache', help='File used to cache the ASN to org mappings between runs (requires --as2org-lean)')
+    parser.add_argument('--ip2as-cache', help='Directory for compiled ip2as snapshots that are memory mapped on later runs')
+    parser.add_argument('--private', action='store_true', help='Map private and reserved prefixes to -2')
+    parser.add_argument('--multicast', action='store_true', help='Map multicast prefixes to -3')
+    parser.add_argument('--csr', action='store_true', help='Store the interface graph as integer CSR arrays to reduce memory')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used by the add step (implies --csr)')
+    parser.add_argument('--components', action='store_true', help='Run the main loop separately on each connected component, using --workers processes')
+    parser.add_argument('--addresses-exit', dest='addresses_exit', help='Extract addresses from traces and exit. Use - for stdout')
+    parser.add_argument('--potaroo', action='store_true', help='Include AS identifiers and names from http://bgp.potaroo.net/cidr/autnums.html')
+    parser.add_argument('--trace-exit', help='Extract adjacencies and addresses from the traceroutes and exit. Use - for stdout')
+    parser.add_argument('--binary', action='store_true', help='Write the --trace-exit adjacencies in the binary format')
+    parser.add_argument('--memory-limit', type=int, help='Spill the traceroute adjacencies and addresses to disk to keep them within this many MB (implies --csr)')
+    parser.add_argument('--spill-dir', help='Directory for the temporary files written with --memory-limit')
+    providers_group = parser.add_mutually_exclusive_group()
+    providers_group.add_argument('-r', '--rel-graph', help='CAIDA relationship graph')
+    providers_group.add_argument('-p', '--asn-providers', help='List of ISP ASes')
+    providers_group.add_argument('-q', '--org-providers', help='List of ISP ORGs')
+    parser.add_argument('-I', '--iterations', type=int, default=100)
+    parser.add_argument('--warm-start', help='Start from the direct inferences in the CSV results of a previous run')
+    parser.add_argument('--warm-start-stats', help='Stats file written with --stats by the --warm-start run, to report the iterations and time saved')
+    parser.add_argument('--stats', help='Write the number of iterations, the algorithm time, and the stats of each iteration to this file as JSON')
+    parser.add_argument('--metrics', help='Write the time, memory, and item counts of each phase to this file as JSON lines')
+    parser.add_argument('--profile', help='Directory where the cProfile stats of each phase are written')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='Keep the tables, graph, and inferences in memory and answer lookups over HTTP on this address (localhost by default)')
+    args = parser.parse_args()
+    if (args.trace_exit or args.addresses_exit) and not args.traceroutes:
+        parser.error('--trace-exit and --addresses-exit require -t')
+    if args.binary and args.trace_exit in (None, '-'):
+        parser.error('--binary requires a --trace-exit filename')
+    if args.output_format != 'csv' and args.output is sys.stdout:
+        parser.error('--output-format {} requires an output filename'.format(args.output_format))
+    if args.output_format == 'parquet' and find_spec('pyarrow') is None:
+        parser.error('--output-format parquet requires pyarrow')
+    if args.as2org_cache and not args.as2org_lean:
+        parser.error('--as2org-cache requires --as2org-lean')
+    if args.serve and (args.trace_exit or args.addresses_exit):
+        parser.error('--serve cannot be used with --trace-exit or --addresses-exit')
+
+    log.setLevel(max((3 - args.verbose) * 10, 10))
+
+    metrics.configure(args.metrics, args.profile)
+    try:
+        run(args)
+    finally:
+        metrics.close()
+
+
+def read_inputs(args):
+    """
+    Reads the adjacencies from the traceroute files (-t) or the adjacency file (-a).
+    :return: Adjacencies, and the addresses seen in the traceroutes
+    """
+    if not args.traceroutes:
+        with phase('adjacencies') as record:
+            adjacencies = read_adjacencies(args.adjacencies)
+            record['adjacencies'] = len(adjacencies)
+        return adjacencies, set()
+    filenames = sorted(ls(args.traceroutes))
+    cache = TraceCache(args.cache, use_hash=args.cache_hash) if args.cache else None
+    if args.cache_drop:
+        dropped = {os.path.abspath(filename) for filename in args.cache_drop}
+        if cache is not None:
+            for filename in dropped:
+                cache.drop(filename)
+            cache.save()
+        filenames = [filename for filename in filenames if os.path.abspath(filename) not in dropped]
+    log.info('Processing {:,d} traceroute files using {:,d} processes'.format(len(filenames), args.jobs))
+    with phase('traces', files=len(filenames)) as record:
+        if args.memory_limit:
+            adjacencies_filename = None
+            if args.trace_exit and args.binary:
+                adjacencies_filename = args.trace_exit
+            adjacencies, trace_addresses = process_trace_files_spilled(
+                filenames, args.memory_limit << 20, jobs=args.jobs, cache=cache, directory=args.spill_dir,
+                adjacencies_filename=adjacencies_filename)
+        else:
+            adjacencies, trace_addresses = process_trace_files(filenames, jobs=args.jobs, cache=cache)
+        record.update(adjacencies=len(adjacencies), addresses=len(trace_addresses))
+    return adjacencies, trace_addresses
+
+
+def write_trace_exit(args, adjacencies, trace_addresses):
+    with phase('output'):
+        if args.trace_exit:
+            if args.binary:
+                if not args.memory_limit:
+                    write_binary_adjacencies(args.trace_exit, adjacencies)
+            else:
+                with output_file(args.trace_exit) as f:
+                    write_adjacencies(f, adjacencies)
+        if args.addresses_exit:
+            if args.memory_limit:
+                trace_addresses = (ntoa(address) for address in trace_addresses.tolist())
+            with output_file(args.addresses_exit) as f:
+                write_addresses(f, trace_addresses)
+
+
+def load_tables(args):
+    """
+    Loads the ip2as and AS2Org mappings.
+    :return: RoutingTable and AS2Org
+    """
+    ixp_asns = read_list(args.ixp_asns, int) if args.ixp_asns else None
+    ixp_prefixes = read_list(args.ixp_prefixes) if args.ixp_prefixes else None
+    with phase('ip2as'):
+        if args.ip2as_cache:
+            ip2as = RoutingTable.compiled(args.ip2as, args.ip2as_cache, ixp_asns=ixp_asns, ixp_prefixes=ixp_prefixes,
+                                          private=args.private, multicast=args.multicast)
+        else:
+            ip2as = RoutingTable.ip2as(args.ip2as, ixp_asns=ixp_asns, ixp_prefixes=ixp_prefixes, private=args.private,
+                                       multicast=args.multicast)
+    with phase('as2org') as record:
+        as2org = AS2Org(args.as2org, include_potaroo=False, lean=args.as2org_lean, cache=args.as2org_cache)
+        record['asns'] = len(as2org)
+    return ip2as, as2org
+
+
+def uses_graph(args):
+    return args.csr or args.workers > 1 or args.memory_limit
+
+
+def create_interface_graph(args, adjacencies, ip2as, as2org, trace_addresses):
+    """
+    Creates the interface halves, as a Graph with --csr, --workers, or --memory-limit.
+    :return: List of halves, and the Graph or None
+    """
+    graph = None
+    with phase('graph') as record:
+        if uses_graph(args):
+            graph = build_graph(adjacencies, ip2as, as2org, seen=trace_addresses)
+            allhalves = graph.allhalves()
+        else:
+            allhalves = create_halves(adjacencies, ip2as, as2org, seen=trace_addresses)
+        record['halves'] = len(allhalves)
+    return allhalves, graph
+
+
+def read_providers(args):
     if args.asn_providers:
         with File2(args.providers) as f:
-            providers = {int(asn.strip()) for asn in f}
+            return {int(asn.strip()) for asn in f}
     elif args.org_providers:
         with File2(args.providers) as f:
-            providers = {asn.strip() for asn in f}
+            return {asn.strip() for asn in f}
     elif args.rel_graph:
+        import pandas as pd
         rels = pd.read_csv(args.rel_graph, sep='|', comment='#', names=['AS1', 'AS2', 'Rel'], usecols=[0, 1, 2])
-        providers = set(rels[rels.Rel == -1].AS1.unique())
+        return set(rels[rels.Rel == -1].AS1.unique())
+    return None
+
+
+def infer(args, allhalves, graph=None):
+    """
+    Runs the algorithm on the halves.
+    :return: Updates, the stats of each iteration, and the algorithm time in seconds
+    """
+    providers = read_providers(args)
+    initial = warm_start(args.warm_start, allhalves, graph) if args.warm_start else None
+    stats = []
+    start = perf_counter()
+    if args.components:
+        updates = component_algorithm(allhalves, factor=args.factor, providers=providers, iterations=args.iterations,
+                                      workers=args.workers, graph=graph, stats=stats, initial=initial)
+    elif args.workers > 1:
+        with BorderPool(graph, args.workers) as pool:
+            updates = algorithm(allhalves, factor=args.factor, providers=providers, iterations=args.iterations, pool=pool,
+                                stats=stats, initial=initial)
     else:
-        providers = None
-    updates = algorithm(allhalves, factor=args.factor, providers=providers, iterations=args.iterations)
-    updates.write(args.output)
+        updates = algorithm(allhalves, factor=args.factor, providers=providers, iterations=args.iterations, stats=stats,
+                            initial=initial)
+    seconds = perf_counter() - start
+    if args.warm_start:
+        previous = read_run_stats(args.warm_start_stats) if args.warm_start_stats else None
+        report_warm_start(previous, stats, seconds)
+    return updates, stats, seconds
+
+
+def run(args):
+    if args.serve:
+        from service import serve
+        serve(args)
+        return
+    adjacencies, trace_addresses = read_inputs(args)
+    if args.trace_exit or args.addresses_exit:
+        write_trace_exit(args, adjacencies, trace_addresses)
+        return
+    ip2as, as2org = load_tables(args)
+    allhalves, graph = create_interface_graph(args, adjacencies, ip2as, as2org, trace_addresses)
+    updates, stats, seconds = infer(args, allhalves, graph)
+    with phase('output', inferences=len(updates)):
+        if args.output_format == 'csv':
+            updates.write(args.output)
+        else:
+            args.output.close()
+            updates.write(args.output.name, format=args.output_format)
+    if args.stats:
+        write_run_stats(args.stats, stats, seconds, warm_start=args.warm_start)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+import cProfile
+import json
+import os
+import resource
+import time
+from logging import getLogger
+
+log = getLogger()
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb():
+    """Current resident set size, or the peak when /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / (1 << 20)
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Phase:
+    """
+    Context manager that records one phase. The dict returned by __enter__ can be given item counts, which are written
+    with the timings.
+    """
+
+    __slots__ = ('metrics', 'name', 'record', 'wall', 'cpu', 'rss', 'profiler')
+
+    def __init__(self, metrics, name, counts):
+        self.metrics = metrics
+        self.name = name
+        self.record = counts
+
+    def __enter__(self):
+        metrics = self.metrics
+        self.profiler = None
+        if metrics.profile and not metrics.profiling:
+            # Only one profiler can be active, so nested phases are included in the outermost phase's profile
+            self.profiler = cProfile.Profile()
+            metrics.profiling = True
+        metrics.stack.append(self.name)
+        self.rss = rss_mb()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self.record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if self.profiler is not None:
+            self.profiler.disable()
+        metrics = self.metrics
+        metrics.stack.pop()
+        rss = rss_mb()
+        record = {
+            'phase': self.name, 'parent': metrics.stack[-1] if metrics.stack else None,
+            'start': self.wall - metrics.start, 'wall': wall - self.wall, 'cpu': cpu - self.cpu, 'rss_mb': rss,
+            'rss_delta_mb': rss - self.rss, 'peak_rss_mb': peak_rss_mb()}
+        record.update(self.record)
+        metrics.write(record)
+        if self.profiler is not None:
+            metrics.profiling = False
+            metrics.dump(self.name, self.profiler)
+
+
+class NullPhase:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class Metrics:
+    """
+    Records the wall time, CPU time, memory, and item counts of each phase as JSON lines.
+
+    Memory is the process RSS when the phase finishes, the change in RSS during the phase, and the peak RSS so far.
+    When profile is a directory, each phase that is not nested inside another phase is run under cProfile and its
+    stats are dumped to <profile>/<sequence>-<phase>.prof.
+    """
+
+    def __init__(self, filename=None, profile=None):
+        self.filename = filename
+        self.profile = profile
+        self.enabled = bool(filename or profile)
+        self.f = open(filename, 'w') if filename else None
+        if profile:
+            os.makedirs(profile, exist_ok=True)
+        self.stack = []
+        self.profiling = False
+        self.dumped = 0
+        self.start = time.perf_counter()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def dump(self, name, profiler):
+        filename = os.path.join(self.profile, '{:04d}-{}.prof'.format(self.dumped, name))
+        profiler.dump_stats(filename)
+        self.dumped += 1
+
+    def phase(self, name, **counts):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name, counts)
+
+    def write(self, record):
+        if self.f is not None:
+            self.f.write(json.dumps(record) + '\n')
+            self.f.flush()
+
+
+_metrics = Metrics()
+
+
+def configure(filename=None, profile=None):
+    """Replaces the process-wide Metrics used by phase."""
+    global _metrics
+    _metrics.close()
+    _metrics = Metrics(filename, profile)
+    return _metrics
+
+
+def close():
+    _metrics.close()
+
+
+def phase(name, **counts):
+    """
+    Records a phase with the process-wide Metrics, or does nothing when metrics are not enabled.
+    :param name: Phase name
+    :param counts: Item counts known before the phase starts
+    """
+    return _metrics.phase(name, **counts)
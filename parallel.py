@@ -0,0 +1,149 @@
+from collections import defaultdict
+from logging import getLogger
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from algorithm import choose_org
+from progress import Progress
+from updates import Updates
+
+log = getLogger()
+
+# Arrays attached by each worker process
+_arrays = {}
+_blocks = []
+
+
+def attach(specs):
+    for name, (shm_name, shape, dtype) in specs.items():
+        block = SharedMemory(name=shm_name)
+        _blocks.append(block)
+        _arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def find_borders(args):
+    """
+    Runs the add_borders decision for a chunk of half ids using the shared arrays.
+    :return: Half ids, ASNs, and org codes of the new direct inferences, in chunk order
+    """
+    ids, f = args
+    g = _arrays
+    addresses = ids >> 1
+    forward = (ids & 1).astype(bool)
+    keep = ~g['direct'][ids] & ((g['asns'][addresses] != -2) | forward)
+    ids, addresses, forward = ids[keep], addresses[keep], forward[keep]
+    starts = np.where(forward, g['forward_offsets'][addresses], g['backward_offsets'][addresses])
+    counts = np.where(forward, g['forward_offsets'][addresses + 1], g['backward_offsets'][addresses + 1]) - starts
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts, counts)
+    from_forward = np.repeat(forward, counts)
+    neighbors = np.empty(len(positions), dtype=np.int64)
+    neighbors[from_forward] = g['forward_indices'][positions[from_forward]]
+    neighbors[~from_forward] = g['backward_indices'][positions[~from_forward]]
+    # Forward halves neighbor backward halves, and backward halves neighbor forward halves
+    neighbor_halves = 2 * neighbors + ~from_forward
+    inferred = g['has'][neighbor_halves]
+    vote_orgs = np.where(inferred, g['inferred_orgs'][neighbor_halves], g['orgs'][neighbors]).tolist()
+    vote_asns = np.where(inferred, g['inferred_asns'][neighbor_halves], g['asns'][neighbors]).tolist()
+    half_orgs = g['orgs'][addresses].tolist()
+    offsets = offsets.tolist()
+    found_ids, found_asns, found_orgs = [], [], []
+    for i, half in enumerate(ids.tolist()):
+        start, end = offsets[i], offsets[i + 1]
+        orgs = defaultdict(list)
+        for org, asn in zip(vote_orgs[start:end], vote_asns[start:end]):
+            orgs[org].append(asn)
+        network = choose_org(orgs, end - start, f)
+        if network:
+            asn, org = network
+            if org != half_orgs[i] and asn != -2:
+                found_ids.append(half)
+                found_asns.append(asn)
+                found_orgs.append(org)
+    return found_ids, found_asns, found_orgs
+
+
+class BorderPool:
+    """
+    Runs add_borders for a Graph on a pool of processes.
+
+    The graph's CSR arrays, the ASN and org code of every address, and the current inference for every half are kept in
+    shared memory. Before each pass, only the halves whose inferences changed since the last pass are rewritten. The
+    halves are split into contiguous chunks, and the results are applied in chunk order, so the new inferences are
+    added in the same order as the serial add_borders.
+    """
+
+    def __init__(self, graph, workers, chunks_per_worker=4):
+        self.graph = graph
+        self.workers = workers
+        self.chunks_per_worker = chunks_per_worker
+        n = len(graph.asns)
+        arrays = {
+            'forward_offsets': graph.forward_offsets, 'forward_indices': graph.forward_indices,
+            'backward_offsets': graph.backward_offsets, 'backward_indices': graph.backward_indices,
+            'asns': np.asarray(graph.asns, dtype=np.int64), 'orgs': np.asarray(graph.orgs, dtype=np.int32),
+            'has': np.zeros(2 * n, dtype=bool), 'direct': np.zeros(2 * n, dtype=bool),
+            'inferred_asns': np.zeros(2 * n, dtype=np.int64), 'inferred_orgs': np.zeros(2 * n, dtype=np.int32)}
+        self.blocks = []
+        self.arrays = {}
+        specs = {}
+        for name, array in arrays.items():
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.blocks.append(block)
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[:] = array
+            self.arrays[name] = shared
+            specs[name] = (block.name, array.shape, array.dtype.str)
+        self.state = Updates()
+        self.pool = Pool(workers, initializer=attach, initargs=(specs,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_borders(self, halves, updates, f):
+        """Same as algorithm.add_borders for halves of the pool's Graph."""
+        self.sync(updates)
+        ids = np.fromiter((half.index for half in halves), dtype=np.int64, count=len(halves))
+        chunks = [(chunk, f) for chunk in np.array_split(ids, self.workers * self.chunks_per_worker) if len(chunk)]
+        new_updates = updates.copy()
+        graph_halves = self.graph.halves
+        with Progress(len(ids), 'Adding borders', transient=True) as pb:
+            for (chunk, _), (found_ids, found_asns, found_orgs) in zip(chunks, self.pool.imap(find_borders, chunks)):
+                for index, asn, org in zip(found_ids, found_asns, found_orgs):
+                    new_updates.update(graph_halves[index], asn, org, True)
+                pb.add(len(chunk))
+        return new_updates
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def sync(self, updates):
+        """Copies the inferences that changed since the last pass into the shared arrays."""
+        has = self.arrays['has']
+        direct = self.arrays['direct']
+        asns = self.arrays['inferred_asns']
+        orgs = self.arrays['inferred_orgs']
+        for half in updates.changed(self.state):
+            index = half.index
+            entry = updates.entry(half)
+            if entry is None:
+                has[index] = False
+                direct[index] = False
+            else:
+                has[index] = True
+                direct[index] = entry.direct
+                asns[index] = entry.asn
+                orgs[index] = entry.org
+        self.state = updates.copy()
@@ -1,5 +1,10 @@
-import sys
 import logging
+import os
+import sys
+import threading
+from datetime import timedelta
+from multiprocessing import Value
+from time import monotonic, sleep
 
 
 log = logging.getLogger()
@@ -7,43 +12,214 @@ if not log.hasHandlers():
     ch = logging.StreamHandler(sys.stderr)
     log.addHandler(ch)
 
+# Seconds between redraws of the progress line on a terminal, and between updates of Counter values
+INTERVAL = 0.5
+# Seconds between progress log lines when stderr is not a terminal
+LOG_INTERVAL = 30
+
+
+class Counter:
+    """
+    Count shared by processes, so that pool workers can report their items to a Progress in the parent process. It has
+    to be created before the workers, and handed to them through the Pool initializer or inherited by fork. Workers add
+    to a local count, which is added to the shared value at most once per interval, so the lock is rarely taken.
+    """
+
+    def __init__(self, name='items', interval=INTERVAL):
+        """
+        :param name: Name of the items shown in the progress line
+        :param interval: Seconds between updates of the shared value
+        """
+        self.name = name
+        self.interval = interval
+        self.value = Value('q', 0)
+        self.pending = 0
+        self.flushed = monotonic()
+
+    def add(self, n=1):
+        self.pending += n
+        now = monotonic()
+        if now - self.flushed >= self.interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """Adds the local count to the shared value. Workers should flush when they finish a task."""
+        if self.pending:
+            with self.value.get_lock():
+                self.value.value += self.pending
+            self.pending = 0
+        self.flushed = monotonic() if now is None else now
+
+    @property
+    def count(self):
+        return self.value.value
+
 
 class Progress:
-    """A class for creating progress updates for long running operations."""
-    def __init__(self, total=None, message='', increment=1, multiplier=1, start=0, callback=None):
+    """
+    A class for creating progress updates for long running operations.
+
+    Updating the count only increments an attribute. While progress objects are running, a daemon thread redraws the
+    line of the innermost one on stderr every INTERVAL seconds, with the rate and, when the total is known, the
+    estimated time left. When stderr is not a terminal, the line is logged every log_interval seconds instead. Nothing is
+    started when INFO messages are not output, and iterator returns the iterable itself.
+    """
+
+    def __init__(self, total=None, message='', start=0, callback=None, counter=None, transient=False,
+                 log_interval=LOG_INTERVAL):
+        """
+        :param total: Number of items, or None if unknown
+        :param message: Description shown at the start of the line
+        :param start: Initial count
+        :param callback: Optional function returning extra text for the end of the line
+        :param counter: Optional Counter of items processed by other processes, shown with its own rate
+        :param transient: Clear the line when finished instead of leaving it on the terminal
+        :param log_interval: Seconds between log lines when stderr is not a terminal
+        """
         self.total = total
         self.message = message
-        self.increment = increment
-        self.multiplier = multiplier
         self.current = start
-        self.callback = callback if callback else str
+        self.callback = callback
+        self.counter = counter
+        self.transient = transient
+        self.log_interval = log_interval
+        self.enabled = should_output()
+        self.tty = sys.stderr.isatty()
+        self.started = None
+        self.finished = None
+        self.start_count = start
+        self.start_counter = 0
+        self.logged = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+        return False
+
+    def add(self, n=1):
+        self.current += n
 
     def iterator(self, iterable):
-        """Iterates over iterable and automatically updates the status at the predefined increments."""
-        if should_output():
-            self.show()
-            i = 0
+        """Iterates over iterable and counts each item after it is processed."""
+        if not self.enabled:
+            return iterable
+        return self._iterate(iterable)
+
+    def _iterate(self, iterable):
+        self.start()
+        try:
             for n in iterable:
-                i += self.multiplier
                 yield n
-                if i == self.increment:
-                    self.current += i
-                    i = 0
-                    self.show()
-            self.current += i
+                self.current += 1
+        finally:
             self.finish()
-        else:
-            yield from iterable
+
+    def start(self):
+        global _renderer
+        if not self.enabled or self.started is not None:
+            return
+        self.started = monotonic()
+        self.start_count = self.current
+        self.start_counter = self.counter.count if self.counter is not None else 0
+        with _lock:
+            if self.tty:
+                self.show()
+            _active.append(self)
+            if _renderer is None:
+                _renderer = threading.Thread(target=render, daemon=True)
+                _renderer.start()
 
     def finish(self):
-        self.show()
-        sys.stderr.write('\n')
+        if self.started is None or self.finished is not None:
+            return
+        with _lock:
+            _active.remove(self)
+            self.finished = monotonic()
+            if not self.tty:
+                # Operations that finished before the first log line stay quiet
+                if self.logged is not None:
+                    self.show()
+            elif self.transient:
+                sys.stderr.write('\r\033[K')
+            else:
+                self.show()
+                sys.stderr.write('\n')
+
+    def tick(self, now):
+        if self.tty:
+            self.show()
+        elif now - (self.started if self.logged is None else self.logged) >= self.log_interval:
+            self.show()
+            self.logged = now
 
     def show(self):
+        if self.tty:
+            sys.stderr.write('\r\033[K{:s}'.format(self.line()))
+            sys.stderr.flush()
+        else:
+            log.info(self.line())
+
+    def line(self):
+        now = monotonic() if self.finished is None else self.finished
+        elapsed = max(now - self.started, 1e-9) if self.started is not None else 0
+        current = self.current
+        rate = (current - self.start_count) / elapsed if elapsed else 0
         if self.total:
-            sys.stderr.write('\r\033[K{:s} {:.2%} ({:,d} / {:,d}). {:s}'.format(self.message, self.current / self.total, self.current, self.total, self.callback()))
+            line = '{:s} {:.2%} ({:,d} / {:,d}), {:s}/s'.format(self.message, current / self.total, current, self.total,
+                                                                 format_rate(rate))
+            if current < self.total and rate > 0:
+                line += ', ETA {}'.format(format_seconds((self.total - current) / rate))
         else:
-            sys.stderr.write('\r\033[K{:s} {:,d}. {:s}'.format(self.message, self.current, self.callback()))
+            line = '{:s} {:,d}, {:s}/s'.format(self.message, current, format_rate(rate))
+        if self.finished is not None:
+            line += ', {} elapsed'.format(format_seconds(elapsed))
+        if self.counter is not None:
+            count = self.counter.count
+            counter_rate = (count - self.start_counter) / elapsed if elapsed else 0
+            line += '. {:,d} {:s} ({:s}/s)'.format(count, self.counter.name, format_rate(counter_rate))
+        if self.callback is not None:
+            line += '. {:s}'.format(self.callback())
+        return line
+
+
+# Running Progress objects, innermost last, and the thread that redraws them
+_active = []
+_lock = threading.Lock()
+_renderer = None
+
+
+def render():
+    """Shows the innermost running Progress every INTERVAL seconds, and exits once none are running."""
+    global _renderer
+    while True:
+        sleep(INTERVAL)
+        with _lock:
+            if not _active:
+                _renderer = None
+                return
+            _active[-1].tick(monotonic())
+
+
+def reset_after_fork():
+    # A forked child has no renderer thread, and the lock may have been held by the parent's renderer
+    global _active, _lock, _renderer
+    _active = []
+    _lock = threading.Lock()
+    _renderer = None
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def format_rate(rate):
+    return '{:,.1f}'.format(rate) if rate < 100 else '{:,.0f}'.format(rate)
+
+
+def format_seconds(seconds):
+    return str(timedelta(seconds=round(seconds)))
 
 
 def finish_status(message='Done'):
@@ -1,7 +1,14 @@
 import csv
+import hashlib
+import os
+import socket
+import struct
 from itertools import chain
 
+import numpy as np
 from radix import Radix
+
+from adjacency import keys6, pack6
 from utils import File2
 
 cdef list PRIVATE4 = ['0.0.0.0/8', '10.0.0.8/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12',
@@ -14,8 +21,149 @@ cdef list PRIVATE6 = ['::1/128', '::/128', '::ffff:0:0/96', '64:ff9b::/96', '100
 cdef str  MULTICAST4 = '224.0.0.0/3'
 cdef str MULTICAST6 = 'FF00::/8'
 
+# Marks the gaps between prefixes in a FlatTable
+MISSING = np.iinfo(np.int64).min
+
+# Compiled FlatTable files: magic, 40 byte hex key, uint64 IPv4 and IPv6 interval counts, then the IPv4 starts and
+# asns as int64 arrays, the IPv6 starts as 16 byte big-endian keys, and the IPv6 asns as an int64 array
+FLAT_MAGIC = b'MAPITFT2'
+FLAT_HEADER = struct.Struct('<8s40sQQ')
+
+
+class FlatTable:
+    """
+    IPv4 and IPv6 longest prefix matches flattened into sorted, non-overlapping intervals.
+
+    Interval i starts at starts[i] and ends where interval i + 1 starts. Lookups are a binary search over starts, so an
+    array of addresses is mapped in a single vectorized call. The IPv6 starts are keys6 values, so the same binary
+    search works on 128-bit addresses. Addresses without a matching prefix map to default, as in RoutingTable.
+    """
+    def __init__(self, starts, asns, starts6=None, asns6=None, default=0):
+        self.starts = starts
+        self.asns = asns
+        self.starts6 = np.zeros(0, dtype='S16') if starts6 is None else starts6
+        self.asns6 = np.zeros(0, dtype=np.int64) if asns6 is None else asns6
+        self.default = default
+
+    def __getitem__(self, str address):
+        if ':' in address:
+            return int(self.lookup_many6(pack6([address]))[0])
+        return int(self.lookup_many(np.array([struct.unpack('!L', socket.inet_aton(address))[0]]))[0])
+
+    def __len__(self):
+        return len(self.starts) + len(self.starts6)
+
+    @classmethod
+    def load(cls, filename, key=None, default=0):
+        """
+        Memory maps a compiled table.
+        :param filename: File written by save
+        :param key: If supplied, None is returned unless the file was saved with the same key
+        :param default: Value for addresses without a matching prefix
+        :return: FlatTable or None
+        """
+        with open(filename, 'rb') as f:
+            header = f.read(FLAT_HEADER.size)
+        if len(header) < FLAT_HEADER.size:
+            return None
+        magic, saved_key, n, n6 = FLAT_HEADER.unpack(header)
+        if magic != FLAT_MAGIC or (key is not None and saved_key.decode() != key):
+            return None
+        offset = FLAT_HEADER.size
+        starts = memmap(filename, '<i8', offset, n)
+        asns = memmap(filename, '<i8', offset + 8 * n, n)
+        starts6 = memmap(filename, 'S16', offset + 16 * n, n6)
+        asns6 = memmap(filename, '<i8', offset + 16 * n + 16 * n6, n6)
+        return cls(starts, asns, starts6, asns6, default=default)
+
+    def save(self, filename, key=''):
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(FLAT_HEADER.pack(FLAT_MAGIC, key.encode().ljust(40), len(self.starts), len(self.starts6)))
+            f.write(np.ascontiguousarray(self.starts, dtype='<i8').tobytes())
+            f.write(np.ascontiguousarray(self.asns, dtype='<i8').tobytes())
+            f.write(np.ascontiguousarray(self.starts6, dtype='S16').tobytes())
+            f.write(np.ascontiguousarray(self.asns6, dtype='<i8').tobytes())
+        os.replace(tmp, filename)
+
+    def lookup_many(self, ipnums, default=None):
+        """
+        Maps every address to the ASN of its longest matching prefix.
+        :param ipnums: Array of IPv4 addresses as integers
+        :param default: Value used for addresses without a matching prefix, instead of the table's default
+        :return: Array of ASNs, including the -1/-2/-3 codes used for IXP, private, and multicast prefixes
+        """
+        return lookup_intervals(self.starts, self.asns, ipnums, self.default if default is None else default)
+
+    def lookup_many6(self, pairs, default=None):
+        """
+        Maps every IPv6 address to the ASN of its longest matching prefix.
+        :param pairs: (n, 2) uint64 array of IPv6 addresses
+        :param default: Value used for addresses without a matching prefix, instead of the table's default
+        :return: Array of ASNs
+        """
+        return lookup_intervals(self.starts6, self.asns6, keys6(pairs), self.default if default is None else default)
+
+
+def memmap(filename, dtype, offset, n):
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(n,))
+
+
+def lookup_intervals(starts, asns, values, default):
+    if len(starts) == 0:
+        return np.full(len(values), default, dtype=np.int64)
+    idx = np.searchsorted(starts, values, side='right') - 1
+    found = asns[idx]
+    found[(idx < 0) | (found == MISSING)] = default
+    return found
+
+
+def flatten(prefixes, size, dtype=np.int64):
+    """
+    Flattens nested prefixes into non-overlapping intervals where the most specific prefix wins.
+    :param prefixes: (start, end, asn) tuples sorted by start, then by prefix length
+    :param size: Size of the address space
+    :param dtype: dtype of the starts, which is object for IPv6 since the starts do not fit in 64 bits
+    :return: Arrays of the interval starts and ASNs
+    """
+    starts = []
+    asns = []
+    stack = []
+
+    def emit(start, asn):
+        if starts and starts[-1] == start:
+            asns[-1] = asn
+        elif start < size:
+            starts.append(start)
+            asns.append(asn)
+
+    def close(position):
+        while stack and stack[-1][0] <= position:
+            end, _ = stack.pop()
+            emit(end, stack[-1][1] if stack else MISSING)
+
+    for start, end, asn in prefixes:
+        close(start)
+        emit(start, asn)
+        stack.append((end, asn))
+    close(size)
+    starts = np.array(starts, dtype=dtype)
+    asns = np.array(asns, dtype=np.int64)
+    if len(asns):
+        # Merge adjacent intervals that map to the same ASN
+        keep = np.ones(len(asns), dtype=bool)
+        keep[1:] = asns[1:] != asns[:-1]
+        starts, asns = starts[keep], asns[keep]
+    return starts, asns
+
 
 class RoutingTable(Radix):
+    """
+    Radix tree of prefixes to ASNs. Addresses without a matching prefix map to default, which is 0 unless changed.
+    """
+
     @classmethod
     def private(cls, inet='both'):
         rt = cls()
@@ -24,7 +172,15 @@ class RoutingTable(Radix):
         return rt
 
     @classmethod
-    def ip2as(cls, filename):
+    def ip2as(cls, filename, ixp_asns=None, ixp_prefixes=None, bint private=False, bint multicast=False):
+        """
+        Loads a prefix to AS file and applies the optional overlays.
+        :param filename: CSV of prefix, ASN with a header line
+        :param ixp_asns: ASNs whose prefixes are treated as IXP prefixes (-1)
+        :param ixp_prefixes: Prefixes treated as IXP prefixes (-1)
+        :param private: Map private and reserved prefixes to -2
+        :param multicast: Map multicast prefixes to -3
+        """
         rt = cls()
         with File2(filename) as f:
             f.readline()
@@ -34,17 +190,91 @@ class RoutingTable(Radix):
                 except TypeError:
                     print(asn, prefix)
                     raise
+        if ixp_asns:
+            for node in rt.nodes():
+                if node.data['asn'] in ixp_asns:
+                    node.data['asn'] = -1
+        if ixp_prefixes:
+            for prefix in ixp_prefixes:
+                rt.add_ixp(prefix)
+        if private:
+            rt.add_private()
+        if multicast:
+            rt.add_multicast()
         return rt
 
-    def __init__(self):
+    @classmethod
+    def compiled(cls, filename, str cache_dir, ixp_asns=None, ixp_prefixes=None, bint private=False, bint multicast=False):
+        """
+        Returns the flattened ip2as table, memory mapped from cache_dir when a compiled snapshot exists for the same
+        source file and overlays. Otherwise, the table is loaded with ip2as, flattened, and saved to cache_dir.
+        :return: FlatTable
+        """
+        key = snapshot_key(filename, ixp_asns, ixp_prefixes, private, multicast)
+        path = os.path.abspath(filename)
+        snapshot = os.path.join(cache_dir, '{}.flat'.format(hashlib.sha1(path.encode()).hexdigest()))
+        if os.path.exists(snapshot):
+            flat = FlatTable.load(snapshot, key=key)
+            if flat is not None:
+                return flat
+        flat = cls.ip2as(filename, ixp_asns=ixp_asns, ixp_prefixes=ixp_prefixes, private=private, multicast=multicast).flatten()
+        os.makedirs(cache_dir, exist_ok=True)
+        flat.save(snapshot, key=key)
+        return flat
+
+    def __init__(self, default=0):
         super().__init__()
+        self.flat = None
+        self.default = default
 
     def __getitem__(self, item):
-        return self.search_best(item).data['asn']
+        node = self.search_best(item)
+        return node.data['asn'] if node is not None else self.default
 
     def __setitem__(self, key, value):
+        self.flat = None
         self.add(key).data['asn'] = value
 
+    def flatten(self):
+        """
+        Returns the prefixes as a FlatTable. The table is cached until a prefix is added through add_prefix or
+        __setitem__, so call invalidate after using the radix add or delete methods directly.
+        """
+        if self.flat is None:
+            prefixes = {socket.AF_INET: [], socket.AF_INET6: []}
+            for node in self.nodes():
+                bits = 32 if node.family == socket.AF_INET else 128
+                start = int.from_bytes(node.packed, 'big')
+                prefixes[node.family].append(
+                    (start, node.prefixlen, start + (1 << (bits - node.prefixlen)), node.data['asn']))
+            for family_prefixes in prefixes.values():
+                family_prefixes.sort()
+            starts, asns = flatten([(start, end, asn) for start, _, end, asn in prefixes[socket.AF_INET]], 1 << 32)
+            starts6, asns6 = flatten(
+                [(start, end, asn) for start, _, end, asn in prefixes[socket.AF_INET6]], 1 << 128, dtype=object)
+            starts6 = keys6(np.array([(start >> 64, start & 0xffffffffffffffff) for start in starts6.tolist()],
+                                     dtype=np.uint64).reshape(-1, 2))
+            self.flat = FlatTable(starts, asns, starts6, asns6, default=self.default)
+        return self.flat
+
+    def lookup_many(self, ipnums, default=None):
+        """
+        Vectorized longest prefix match for an array of IPv4 addresses (as integers).
+        :param ipnums: Array of IPv4 addresses as integers
+        :param default: Value used for addresses without a matching prefix, instead of the table's default
+        :return: Array of ASNs
+        """
+        return self.flatten().lookup_many(ipnums, default=default)
+
+    def lookup_many6(self, pairs, default=None):
+        """
+        Vectorized longest prefix match for an array of IPv6 addresses.
+        :param pairs: (n, 2) uint64 array of the high and low 64 bits of each address
+        :param default: Value used for addresses without a matching prefix, instead of the table's default
+        :return: Array of ASNs
+        """
+        return self.flatten().lookup_many6(pairs, default=default)
+
     def add_default(self):
         self.add_prefix(0, '0.0.0.0/0')
 
@@ -59,6 +289,7 @@ class RoutingTable(Radix):
         self.add_prefix(-1, network)
 
     def add_prefix(self, int asn, *args, **kwargs):
+        self.flat = None
         node = self.add(*args, **kwargs)
         node.data['asn'] = asn
 
@@ -99,9 +330,23 @@ class RoutingTable(Radix):
         for address, prefixlen, asn in rirrows:
             self.add_prefix(asn, address, prefixlen)
 
+    def invalidate(self):
+        self.flat = None
+
     def isglobal(self, str address):
         return self[address] >= -1
 
 
+def snapshot_key(filename, ixp_asns, ixp_prefixes, private, multicast):
+    """Hash of everything that affects a compiled table: the source file's identity and the overlay inputs."""
+    stat = os.stat(filename)
+    h = hashlib.sha1()
+    h.update(repr((FLAT_MAGIC, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)).encode())
+    h.update(repr(sorted(ixp_asns) if ixp_asns else None).encode())
+    h.update(repr(sorted(ixp_prefixes) if ixp_prefixes else None).encode())
+    h.update(repr((bool(private), bool(multicast))).encode())
+    return h.hexdigest()
+
+
 cpdef bint valid(long asn) except -1:
     return asn != 23456 and 0 < asn < 64496 or 131071 < asn < 4200000000
\ No newline at end of file
@@ -0,0 +1,272 @@
+import json
+import socket
+import threading
+from argparse import Namespace
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from time import perf_counter, time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from mapit import create_interface_graph, half_finder, infer, load_tables, read_inputs
+from updates import columns
+
+log = getLogger()
+
+# Options that a reload request can change, with their types. The others keep the values from the command line.
+RELOAD_OPTIONS = {'adjacencies': str, 'traceroutes': str, 'ip2as': str, 'as2org': str, 'ixp_asns': str,
+                  'ixp_prefixes': str, 'factor': float, 'iterations': int, 'warm_start': str, 'warm_start_stats': str}
+
+
+def reload_options(options):
+    """
+    Checks the options of a reload request and converts them to the types mapit's arguments have. Filenames can be
+    null to unset them, and the numbers can be JSON numbers or strings, as long as the iterations are a whole number.
+    :param options: Dict decoded from the request's JSON
+    :return: Dict of converted options
+    """
+    unknown = set(options) - RELOAD_OPTIONS.keys()
+    if unknown:
+        raise ValueError('Options that cannot be reloaded: {}'.format(', '.join(sorted(unknown))))
+    converted = {}
+    for name, value in options.items():
+        kind = RELOAD_OPTIONS[name]
+        if kind is str:
+            if value is not None and not isinstance(value, str):
+                raise ValueError('{} must be a filename'.format(name))
+            converted[name] = value
+            continue
+        # bool is a subclass of int, but true is not a number of iterations
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError('{} must be a number'.format(name))
+        try:
+            if kind is int and not isinstance(value, str) and value != int(value):
+                raise ValueError
+            converted[name] = kind(value)
+        except (ValueError, OverflowError):
+            raise ValueError('{} must be {}, not {!r}'.format(name, 'an integer' if kind is int else 'a number', value))
+    return converted
+
+
+def normalize(address):
+    """Validates an address, and converts IPv6 addresses to the notation used for the halves."""
+    if ':' in address:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+    try:
+        return socket.inet_ntop(family, socket.inet_pton(family, address))
+    except OSError:
+        raise ValueError('Invalid address {}'.format(address))
+
+
+class Snapshot:
+    """
+    The ip2as and AS2Org mappings, the interface halves, and the inferences for one set of inputs, with the inferences
+    indexed by address, ASN, and org pair. A snapshot is not modified after it is built, so a reload builds a new one
+    and swaps the reference, while requests that already started keep using the old one.
+    """
+
+    def __init__(self, ip2as, as2org, allhalves, updates, graph=None, stats=None, seconds=None):
+        """
+        :param ip2as: RoutingTable or FlatTable
+        :param as2org: AS2Org
+        :param allhalves: All halves
+        :param updates: Final Updates
+        :param graph: Graph when the halves are GraphHalf objects
+        :param stats: Iteration stats of the algorithm
+        :param seconds: Time taken to build the snapshot
+        """
+        self.ip2as = ip2as
+        self.as2org = as2org
+        self.allhalves = allhalves
+        self.graph = graph
+        self.updates = updates
+        self.stats = stats or []
+        self.seconds = seconds
+        self.created = time()
+        self.find = half_finder(allhalves, graph)
+        self.by_address = defaultdict(list)
+        self.by_asn = defaultdict(list)
+        self.by_orgs = defaultdict(list)
+        for row in updates.rows():
+            row = dict(zip(columns, row))
+            self.by_address[row['Address']].append(row)
+            self.by_asn[row['ASN']].append(row)
+            if row['ConnASN'] != row['ASN']:
+                self.by_asn[row['ConnASN']].append(row)
+            self.by_orgs[row['Org'], row['ConnOrg']].append(row)
+
+    @classmethod
+    def build(cls, args):
+        """Reads the inputs and runs the algorithm, as mapit does without --serve."""
+        start = perf_counter()
+        adjacencies, trace_addresses = read_inputs(args)
+        ip2as, as2org = load_tables(args)
+        allhalves, graph = create_interface_graph(args, adjacencies, ip2as, as2org, trace_addresses)
+        updates, stats, _ = infer(args, allhalves, graph)
+        seconds = perf_counter() - start
+        log.info('Built snapshot with {:,d} halves and {:,d} inferences in {:.2f}s'.format(
+            len(allhalves), len(updates), seconds))
+        return cls(ip2as, as2org, allhalves, updates, graph=graph, stats=stats, seconds=seconds)
+
+    def address(self, address):
+        """The address's ip2as mapping, its halves, and the inferences for them."""
+        address = normalize(address)
+        asn = self.ip2as[address]
+        halves = []
+        for direction in (False, True):
+            half = self.find(address, direction)
+            if half is not None:
+                halves.append({'Direction': direction, 'Neighbors': half.num_neighbors,
+                               'Otherside': half.otherside_address})
+        return {'Address': address, 'ASN': asn, 'Org': self.as2org[asn], 'Halves': halves,
+                'Inferences': self.by_address.get(address, [])}
+
+    def asn(self, asn):
+        """Inferences for halves mapped to the ASN, or connected to it."""
+        return {'ASN': asn, 'Org': self.as2org[asn], 'Inferences': self.by_asn.get(asn, [])}
+
+    def orgs(self, org, conn):
+        """Inferences for links between the two orgs, in either direction."""
+        inferences = list(self.by_orgs.get((org, conn), []))
+        if conn != org:
+            inferences.extend(self.by_orgs.get((conn, org), []))
+        return {'Org': org, 'ConnOrg': conn, 'Inferences': inferences}
+
+    def status(self):
+        return {'created': self.created, 'seconds': self.seconds, 'halves': len(self.allhalves),
+                'inferences': len(self.updates), 'iterations': len(self.stats)}
+
+
+class MapitServer(ThreadingHTTPServer):
+    """HTTP server that answers lookups from the current Snapshot."""
+
+    daemon_threads = True
+
+    def __init__(self, address, args, snapshot):
+        if ':' in address[0]:
+            self.address_family = socket.AF_INET6
+        super().__init__(address, Handler)
+        self.args = args
+        self.snapshot = snapshot
+        self.generation = 1
+        self.reload_lock = threading.Lock()
+
+    def reload(self, options=None):
+        """
+        Builds a new snapshot and swaps it in. Lookups use the previous snapshot until the build finishes, and keep it
+        if the build fails.
+
+        Org codes are interned process-wide (interning.ORGS), and the old snapshot can still be in use, so the interner
+        is reused rather than rebuilt. Orgs keep their codes across reloads, and the interner only grows by the org
+        names that no earlier snapshot had, which it keeps until the process exits.
+        :param options: Dict of RELOAD_OPTIONS to change. The changes are kept for later reloads
+        :return: The new snapshot's status, or None if another reload is running
+        """
+        options = reload_options(options or {})
+        if not self.reload_lock.acquire(blocking=False):
+            return None
+        try:
+            args = Namespace(**vars(self.args))
+            for name, value in options.items():
+                setattr(args, name, value)
+            log.info('Reloading snapshot')
+            snapshot = Snapshot.build(args)
+            self.args = args
+            self.snapshot = snapshot
+            self.generation += 1
+        finally:
+            self.reload_lock.release()
+        return self.status()
+
+    def status(self):
+        status = self.snapshot.status()
+        status['generation'] = self.generation
+        status['reloading'] = self.reload_lock.locked()
+        return status
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    GET /address/<address>, /asn/<asn>, /orgs?org=<org>&conn=<org>, and /status return JSON. POST /reload builds a new
+    snapshot, with an optional JSON object of RELOAD_OPTIONS to change.
+    """
+
+    server_version = 'mapit'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        # Every lookup in a request uses the same snapshot, even if a reload finishes in the meantime
+        snapshot = self.server.snapshot
+        try:
+            if parts == ['status']:
+                body = self.server.status()
+            elif len(parts) == 2 and parts[0] == 'address':
+                body = snapshot.address(parts[1])
+            elif len(parts) == 2 and parts[0] == 'asn':
+                body = snapshot.asn(int(parts[1]))
+            elif parts == ['orgs']:
+                query = parse_qs(url.query)
+                if 'org' not in query or 'conn' not in query:
+                    raise ValueError('/orgs requires org and conn')
+                body = snapshot.orgs(query['org'][0], query['conn'][0])
+            else:
+                self.send_json(404, {'error': 'Unknown path {}'.format(url.path)})
+                return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, body)
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip('/') != '/reload':
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            options = json.loads(self.rfile.read(length) or '{}')
+            if not isinstance(options, dict):
+                raise ValueError('The reload options must be a JSON object')
+            status = self.server.reload(options)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            log.exception('Reload failed, keeping the previous snapshot')
+            self.send_json(500, {'error': 'Reload failed: {}'.format(e)})
+            return
+        if status is None:
+            self.send_json(409, {'error': 'A reload is already running'})
+        else:
+            self.send_json(200, status)
+
+    def log_message(self, format, *args):
+        log.debug('{} {}'.format(self.address_string(), format % args))
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def parse_address(value):
+    """Splits [HOST:]PORT, where HOST defaults to localhost."""
+    host, _, port = value.rpartition(':')
+    return host.strip('[]') or 'localhost', int(port)
+
+
+def serve(args):
+    """Builds the snapshot for the command line inputs and answers lookups until interrupted."""
+    address = parse_address(args.serve)
+    snapshot = Snapshot.build(args)
+    with MapitServer(address, args, snapshot) as server:
+        log.info('Answering lookups on http://{}:{}'.format(*server.server_address[:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
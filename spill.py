@@ -0,0 +1,234 @@
+import os
+from logging import getLogger
+
+import numpy as np
+
+from adjacency import ipnum, write_binary_chunks
+
+log = getLogger()
+
+LOW32 = np.uint64(0xffffffff)
+SHIFT = np.uint64(32)
+# Smallest number of values read from each run at a time during a merge
+MIN_BLOCK = 1 << 16
+# Most run files open at once during a merge, which keeps well below the usual limit of 1024 open files per process
+MAX_RUNS = 64
+
+
+class SpillSet:
+    """
+    Set of uint64 values that is kept on disk.
+
+    Added values are buffered in memory. When the buffer reaches a third of the memory limit, which leaves room for
+    sorting it, the buffer is sorted, deduplicated, and written to a run file. merge then combines the runs with a
+    k-way merge that reads a fixed size block from each run at a time. With more than MAX_RUNS runs, they are first
+    merged in batches of MAX_RUNS into longer runs, until no more than MAX_RUNS are left.
+    """
+
+    def __init__(self, directory, memory_limit, name='values'):
+        """
+        :param directory: Directory for the run files
+        :param memory_limit: Approximate memory budget in bytes
+        :param name: Prefix of the run filenames
+        """
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.name = name
+        self.buffer_limit = max(memory_limit // 3 // 8, 1)
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+        self.count = 0
+        self.spilled = 0
+
+    def __len__(self):
+        """Upper bound on the number of unique values, since duplicates in different runs are counted separately."""
+        return self.count + self.buffered
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.uint64)
+        if not len(values):
+            return
+        self.buffer.append(values)
+        self.buffered += len(values)
+        if self.buffered >= self.buffer_limit:
+            self.spill()
+
+    def close(self):
+        """Removes the run files."""
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+        self.count = 0
+
+    def block_size(self, runs):
+        """Number of values read from each run at a time when merging this many runs."""
+        return max(self.memory_limit // 8 // (2 * runs + 2), MIN_BLOCK)
+
+    def combine(self):
+        """
+        Merges the runs in batches of MAX_RUNS, replacing each batch with one run. The new runs are listed before they
+        are written, so close removes them if the merge fails.
+        """
+        pending = len(self.runs)
+        while pending:
+            if pending == 1:
+                self.runs.append(self.runs.pop(0))
+                break
+            batch = self.runs[:min(pending, MAX_RUNS)]
+            filename = self.run_filename()
+            self.runs.append(filename)
+            with open(filename, 'wb') as f:
+                for chunk in merge_runs(batch, self.block_size(len(batch))):
+                    chunk.astype('<u8').tofile(f)
+            del self.runs[:len(batch)]
+            pending -= len(batch)
+            for run in batch:
+                os.remove(run)
+        self.count = sum(os.path.getsize(run) for run in self.runs) // 8
+
+    def merge(self):
+        """Yields the sorted unique values in ascending chunks."""
+        self.spill()
+        while len(self.runs) > MAX_RUNS:
+            runs = len(self.runs)
+            self.combine()
+            log.debug('Combined {:,d} runs of {} into {:,d}'.format(runs, self.name, len(self.runs)))
+        return merge_runs(self.runs, self.block_size(len(self.runs)))
+
+    def run_filename(self):
+        filename = os.path.join(self.directory, '{}-{:05d}.run'.format(self.name, self.spilled))
+        self.spilled += 1
+        return filename
+
+    def sorted(self):
+        """All of the sorted unique values in one array."""
+        chunks = list(self.merge())
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint64)
+
+    def spill(self):
+        if not self.buffered:
+            return
+        values = np.unique(np.concatenate(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+        filename = self.run_filename()
+        values.astype('<u8').tofile(filename)
+        self.runs.append(filename)
+        self.count += len(values)
+        log.debug('Spilled {:,d} {} to {}'.format(len(values), self.name, filename))
+
+
+def merge_runs(filenames, block_size):
+    """
+    K-way merge of sorted run files.
+
+    Every value up to the smallest last value of the current blocks is taken from every run at once, so each chunk can
+    be deduplicated on its own, and later chunks only have larger values.
+    :param filenames: Files of sorted unique little-endian uint64 values
+    :param block_size: Number of values read from each run at a time
+    :return: Iterator of sorted unique chunks
+    """
+    files = [open(filename, 'rb') for filename in filenames]
+    try:
+        blocks = [np.zeros(0, dtype=np.uint64) for _ in files]
+        while True:
+            for i, f in enumerate(files):
+                if not len(blocks[i]) and f is not None:
+                    blocks[i] = np.fromfile(f, dtype='<u8', count=block_size).astype(np.uint64)
+                    if not len(blocks[i]):
+                        f.close()
+                        files[i] = None
+            active = [i for i, block in enumerate(blocks) if len(block)]
+            if not active:
+                return
+            bound = min(blocks[i][-1] for i in active)
+            parts = []
+            for i in active:
+                k = np.searchsorted(blocks[i], bound, side='right')
+                parts.append(blocks[i][:k])
+                blocks[i] = blocks[i][k:]
+            yield np.unique(np.concatenate(parts))
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
+
+
+class SpilledAdjacencies:
+    """
+    Collects adjacencies as uint64 values in a SpillSet, with the source address in the high 32 bits and the target
+    address in the low 32 bits. Only IPv4 adjacencies are kept, as in the binary adjacency format.
+    """
+
+    def __init__(self, directory, memory_limit):
+        self.values = SpillSet(directory, memory_limit, name='adjacencies')
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def close(self):
+        self.values.close()
+
+    def update(self, adjacencies):
+        """Adds (address, address) string tuples."""
+        packed = [(ipnum(u) << 32) | ipnum(v) for u, v in adjacencies if ':' not in u and ':' not in v]
+        self.skipped += len(adjacencies) - len(packed)
+        self.values.add(np.array(packed, dtype=np.uint64))
+
+    def write(self, filename):
+        """
+        Merges the runs into a binary adjacency file. The adjacencies are deduplicated and written to a temporary file
+        of uint64 values while their addresses are collected, and then rewritten with address ids.
+        """
+        if self.skipped:
+            log.warning('Skipped {:,d} adjacencies with IPv6 addresses.'.format(self.skipped))
+        directory = self.values.directory
+        endpoints = SpillSet(directory, self.values.memory_limit, name='endpoints')
+        raw = os.path.join(directory, 'adjacencies.raw')
+        num_edges = 0
+        try:
+            with open(raw, 'wb') as f:
+                for chunk in self.values.merge():
+                    chunk.astype('<u8').tofile(f)
+                    num_edges += len(chunk)
+                    endpoints.add(np.unique(np.concatenate([chunk >> SHIFT, chunk & LOW32])))
+            ipnums = endpoints.sorted()
+            block_size = max(self.values.memory_limit // 8 // 4, MIN_BLOCK)
+            write_binary_chunks(filename, ipnums, num_edges, read_edges(raw, ipnums, block_size))
+        finally:
+            endpoints.close()
+            if os.path.exists(raw):
+                os.remove(raw)
+        log.info('Wrote {:,d} adjacencies between {:,d} addresses to {}'.format(num_edges, len(ipnums), filename))
+
+
+def read_edges(filename, ipnums, block_size):
+    """Reads packed adjacencies and converts them to (sources, targets) arrays of address ids."""
+    with open(filename, 'rb') as f:
+        while True:
+            values = np.fromfile(f, dtype='<u8', count=block_size).astype(np.uint64)
+            if not len(values):
+                return
+            yield np.searchsorted(ipnums, values >> SHIFT), np.searchsorted(ipnums, values & LOW32)
+
+
+class SpilledAddresses:
+    """Collects IPv4 addresses as uint64 values in a SpillSet."""
+
+    def __init__(self, directory, memory_limit):
+        self.values = SpillSet(directory, memory_limit, name='addresses')
+
+    def __len__(self):
+        return len(self.values)
+
+    def close(self):
+        self.values.close()
+
+    def sorted(self):
+        """Sorted unique addresses as integers."""
+        return self.values.sorted().astype(np.int64)
+
+    def update(self, addresses):
+        self.values.add(np.array([ipnum(address) for address in addresses if ':' not in address], dtype=np.uint64))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Writes traces.warts, traces.warts.gz, traces.warts.bz2, and traces.json.
+
+The warts file is encoded field by field from the record layouts in warts(5), independently of warts.py. traces.json
+is the expected sc_warts2json output for the fields MAP-IT reads, one trace object per line. When scamper is installed,
+tests/test_warts.py also checks traces.json against sc_warts2json, and the fixtures can be replaced by files written by
+scamper itself, as long as traces.json is regenerated with sc_warts2json.
+
+Run from the repository root: python tests/data/make_fixtures.py
+"""
+import bz2
+import gzip
+import json
+import os
+import socket
+import struct
+
+MAGIC = 0x1205
+TYPE_LIST = 0x0001
+TYPE_CYCLE_START = 0x0002
+TYPE_ADDRESS = 0x0005
+TYPE_TRACE = 0x0006
+
+STOP_REASONS = {0: 'NONE', 1: 'COMPLETED', 2: 'UNREACH', 3: 'ICMP', 4: 'LOOP', 5: 'GAPLIMIT', 6: 'ERROR',
+                7: 'HOPLIMIT', 8: 'GSS', 9: 'HALTED'}
+
+# Trace parameter flags
+TRACE_LIST_ID = 1
+TRACE_CYCLE_ID = 2
+TRACE_SRC_GID = 3
+TRACE_DST_GID = 4
+TRACE_START = 5
+TRACE_STOP_REASON = 6
+TRACE_STOP_DATA = 7
+TRACE_ATTEMPTS = 9
+TRACE_HOPLIMIT = 10
+TRACE_TYPE = 11
+TRACE_PROBE_SIZE = 12
+TRACE_FIRST_TTL = 15
+TRACE_HOP_COUNT = 19
+TRACE_SRC = 26
+TRACE_DST = 27
+TRACE_USER_ID = 28
+
+# Hop parameter flags
+HOP_ADDR_GID = 1
+HOP_PROBE_TTL = 2
+HOP_REPLY_TTL = 3
+HOP_FLAGS = 4
+HOP_PROBE_ID = 5
+HOP_RTT = 6
+HOP_ICMP_TYPE = 7
+HOP_PROBE_SIZE = 8
+HOP_REPLY_SIZE = 9
+HOP_REPLY_IPID = 10
+HOP_Q_TTL = 14
+HOP_ICMPEXT = 17
+HOP_ADDR = 18
+HOP_TX = 19
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def record(rtype, body):
+    return struct.pack('!HHL', MAGIC, rtype, len(body)) + body
+
+
+def flags(numbers):
+    """Flag field: seven flags per byte, with the high bit set when another byte follows."""
+    mask = 0
+    for number in numbers:
+        mask |= 1 << (number - 1)
+    if not mask:
+        return b'\x00'
+    out = bytearray()
+    while mask:
+        out.append((mask & 0x7f) | (0x80 if mask >> 7 else 0))
+        mask >>= 7
+    return bytes(out)
+
+
+def parameters(values):
+    """Flags, the uint16 length of the parameter data, and the parameter data in flag order."""
+    if not values:
+        return b'\x00'
+    data = b''.join(values[number] for number in sorted(values))
+    return flags(values) + struct.pack('!H', len(data)) + data
+
+
+class AddressTable:
+    """Addresses embedded in a trace record. Later uses of an address refer to its id in the record."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, address):
+        if address in self.ids:
+            return b'\x00' + struct.pack('!L', self.ids[address])
+        self.ids[address] = len(self.ids)
+        if ':' in address:
+            return bytes([16, 2]) + socket.inet_pton(socket.AF_INET6, address)
+        return bytes([4, 1]) + socket.inet_pton(socket.AF_INET, address)
+
+
+def trace_record(trace, table, global_ids=None):
+    """
+    Encodes a trace. Hops are dicts with optional addr, probe_ttl, icmp_q_ttl, and extra (dict of other hop parameters).
+    With global_ids, the addresses are references to the deprecated address records instead.
+    """
+    values = {TRACE_LIST_ID: struct.pack('!L', 1), TRACE_CYCLE_ID: struct.pack('!L', 1),
+              TRACE_START: struct.pack('!LL', 1500000000, 250000), TRACE_STOP_REASON: bytes([trace['stop_reason']]),
+              TRACE_STOP_DATA: b'\x00', TRACE_ATTEMPTS: b'\x02', TRACE_HOPLIMIT: b'\x00', TRACE_TYPE: b'\x03',
+              TRACE_PROBE_SIZE: struct.pack('!H', 44), TRACE_FIRST_TTL: b'\x01',
+              TRACE_HOP_COUNT: struct.pack('!H', trace['hop_count']), TRACE_USER_ID: struct.pack('!L', 0)}
+    if global_ids is None:
+        values[TRACE_SRC] = table.encode(trace['src'])
+        values[TRACE_DST] = table.encode(trace['dst'])
+    else:
+        values[TRACE_SRC_GID] = struct.pack('!L', global_ids[trace['src']])
+        values[TRACE_DST_GID] = struct.pack('!L', global_ids[trace['dst']])
+    body = parameters(values) + struct.pack('!H', len(trace['hops']))
+    for hop in trace['hops']:
+        hop_values = dict(hop.get('extra', {}))
+        if 'probe_ttl' in hop:
+            hop_values[HOP_PROBE_TTL] = bytes([hop['probe_ttl']])
+        # scamper only writes the quoted TTL when it is not 1
+        if hop.get('icmp_q_ttl', 1) != 1:
+            hop_values[HOP_Q_TTL] = bytes([hop['icmp_q_ttl']])
+        if 'addr' in hop:
+            if global_ids is None:
+                hop_values[HOP_ADDR] = table.encode(hop['addr'])
+            else:
+                hop_values[HOP_ADDR_GID] = struct.pack('!L', global_ids[hop['addr']])
+        body += parameters(hop_values)
+    # End of the optional trace sections
+    body += b'\x00\x00'
+    return record(TYPE_TRACE, body)
+
+
+def address_record(address, gid):
+    """Deprecated file-wide address record: the id modulo 255, the address type, and the address."""
+    if ':' in address:
+        data = bytes([2]) + socket.inet_pton(socket.AF_INET6, address)
+    else:
+        data = bytes([1]) + socket.inet_pton(socket.AF_INET, address)
+    return record(TYPE_ADDRESS, bytes([gid % 255]) + data)
+
+
+def hop(addr, probe_ttl, icmp_q_ttl=1, extra=None):
+    h = {'addr': addr, 'probe_ttl': probe_ttl, 'icmp_q_ttl': icmp_q_ttl}
+    if extra:
+        h['extra'] = extra
+    return h
+
+
+ICMP_TIME_EXCEEDED = {HOP_RTT: struct.pack('!L', 12345), HOP_ICMP_TYPE: bytes([11, 0]),
+                      HOP_REPLY_TTL: bytes([250]), HOP_REPLY_SIZE: struct.pack('!H', 56)}
+# One MPLS label stack extension
+ICMPEXT = struct.pack('!H', 8) + struct.pack('!HBB', 4, 1, 1) + struct.pack('!L', 0x00010140)
+
+TRACES = [
+    # Complete IPv4 trace with a repeated address, an ICMP extension block, and a transmit time after the address
+    {'src': '192.0.2.1', 'dst': '198.51.100.9', 'stop_reason': 1, 'hop_count': 5, 'hops': [
+        hop('10.0.0.1', 1, extra={HOP_PROBE_ID: b'\x01', HOP_PROBE_SIZE: struct.pack('!H', 44)}),
+        hop('10.0.1.1', 2, extra=ICMP_TIME_EXCEEDED),
+        hop('10.0.1.1', 2, extra={HOP_PROBE_ID: b'\x02'}),
+        hop('203.0.113.5', 3, extra={HOP_ICMPEXT: ICMPEXT, HOP_REPLY_IPID: struct.pack('!H', 7)}),
+        hop('203.0.113.9', 4, extra={HOP_TX: struct.pack('!LL', 1500000001, 10)}),
+        hop('198.51.100.9', 5, extra={HOP_ICMP_TYPE: bytes([0, 0])})]},
+    # Stopped by a loop
+    {'src': '192.0.2.1', 'dst': '198.51.100.77', 'stop_reason': 4, 'hop_count': 5, 'hops': [
+        hop('10.0.0.1', 1), hop('10.0.2.1', 2), hop('10.0.2.2', 3), hop('10.0.2.1', 4), hop('10.0.2.2', 5)]},
+    # A hop without an address, a hop without a probe TTL, and a response with a quoted TTL of 2
+    {'src': '192.0.2.1', 'dst': '198.51.100.200', 'stop_reason': 5, 'hop_count': 4, 'hops': [
+        hop('10.0.0.1', 1),
+        {'probe_ttl': 2, 'icmp_q_ttl': 1, 'extra': {HOP_RTT: struct.pack('!L', 500)}},
+        hop('10.0.3.1', 3, icmp_q_ttl=2),
+        {'addr': '10.0.3.9', 'icmp_q_ttl': 1},
+        hop('10.0.3.5', 4)]},
+    # IPv6
+    {'src': '2001:db8::1', 'dst': '2001:db8:ffff::1', 'stop_reason': 1, 'hop_count': 3, 'hops': [
+        hop('2001:db8:1::1', 1), hop('2001:db8:2::1', 2, extra=ICMP_TIME_EXCEEDED), hop('2001:db8:ffff::1', 3)]},
+    # Unreachable without any responses
+    {'src': '192.0.2.1', 'dst': '198.51.100.254', 'stop_reason': 2, 'hop_count': 0, 'hops': []},
+]
+
+# Traces that refer to the deprecated file-wide address records
+GLOBAL_ADDRESSES = ['192.0.2.1', '198.51.100.50', '10.0.0.1', '10.0.4.1']
+GLOBAL_TRACES = [
+    {'src': '192.0.2.1', 'dst': '198.51.100.50', 'stop_reason': 1, 'hop_count': 3, 'hops': [
+        hop('10.0.0.1', 1), hop('10.0.4.1', 2, extra=ICMP_TIME_EXCEEDED), hop('198.51.100.50', 3)]},
+]
+
+
+def expected_json(trace):
+    """The fields that MAP-IT reads from sc_warts2json's output for the trace."""
+    j = {'type': 'trace', 'src': trace['src'], 'dst': trace['dst'], 'stop_reason': STOP_REASONS[trace['stop_reason']],
+         'hop_count': trace['hop_count']}
+    if trace['hops']:
+        j['hops'] = [{key: h[key] for key in ('addr', 'probe_ttl', 'icmp_q_ttl') if key in h} for h in trace['hops']]
+    return j
+
+
+def build():
+    data = record(TYPE_LIST, struct.pack('!LL', 1, 1) + b'default\x00' + b'\x00')
+    data += record(TYPE_CYCLE_START, struct.pack('!LLLL', 1, 1, 1, 1500000000) + b'\x00')
+    for trace in TRACES:
+        data += trace_record(trace, AddressTable())
+    global_ids = {}
+    for address in GLOBAL_ADDRESSES:
+        if address not in global_ids:
+            # Ids start at 1, in the order of the address records
+            data += address_record(address, len(global_ids) + 1)
+            global_ids[address] = len(global_ids) + 1
+    for trace in GLOBAL_TRACES:
+        data += trace_record(trace, None, global_ids)
+    return data, [expected_json(trace) for trace in TRACES + GLOBAL_TRACES]
+
+
+def main():
+    data, traces = build()
+    filename = os.path.join(DIRECTORY, 'traces.warts')
+    with open(filename, 'wb') as f:
+        f.write(data)
+    with gzip.GzipFile(filename + '.gz', 'wb', mtime=0) as f:
+        f.write(data)
+    with bz2.open(filename + '.bz2', 'wb') as f:
+        f.write(data)
+    with open(os.path.join(DIRECTORY, 'traces.json'), 'w') as f:
+        for trace in traces:
+            f.write(json.dumps(trace) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import os
+import shutil
+
+import trace
+from cache import TraceCache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def test_unchanged_file_is_reused(tmp_path):
+    filename = str(tmp_path / 'traces.warts')
+    shutil.copy(os.path.join(DATA, 'traces.warts'), filename)
+    cache = TraceCache(str(tmp_path / 'cache'))
+    adjacencies, addresses = trace.process_trace_files([filename], cache=cache)
+    reopened = TraceCache(str(tmp_path / 'cache'))
+    assert reopened.get(filename) == (adjacencies, addresses)
+
+
+def test_file_grown_while_read_is_not_reused(tmp_path):
+    filename = str(tmp_path / 'traces.warts')
+    shutil.copy(os.path.join(DATA, 'traces.warts'), filename)
+    cache = TraceCache(str(tmp_path / 'cache'), use_hash=True)
+    stat = os.stat(filename)
+    results = trace.process_trace_file(filename)
+    # Traces appended after the file was read
+    with open(filename, 'ab') as f, open(os.path.join(DATA, 'traces.warts'), 'rb') as extra:
+        f.write(extra.read())
+    cache.put(filename, results, stat)
+    assert cache.get(filename) is None
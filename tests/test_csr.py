@@ -0,0 +1,25 @@
+import pytest
+
+from algorithm import algorithm
+from as2org import AS2Org
+from benchmarks.generate import generate
+from graph import build_graph
+from mapit import create_halves, read_adjacencies
+from routing_table import RoutingTable
+
+
+@pytest.fixture(scope='module')
+def inputs(tmp_path_factory):
+    """Synthetic inputs small enough that the two paths do not hit any of the ties broken by visiting order."""
+    files = generate(str(tmp_path_factory.mktemp('synthetic')), 2000, seed=0, traces=10)
+    return (read_adjacencies(files['adj']), RoutingTable.ip2as(files['pfx2as']),
+            AS2Org(files['as2org'], include_potaroo=False))
+
+
+def test_csr_matches_default(inputs):
+    adjacencies, ip2as, as2org = inputs
+    default = algorithm(create_halves(adjacencies, ip2as, as2org), factor=0.5)
+    graph = build_graph(adjacencies, ip2as, as2org)
+    csr = algorithm(graph.allhalves(), factor=0.5)
+    assert len(default) > 0
+    assert sorted(csr.rows()) == sorted(default.rows())
@@ -0,0 +1,64 @@
+import ipaddress
+from itertools import product
+
+import numpy as np
+import pytest
+
+from adjacency import keys6, pack6
+from graph import determine_othersides, determine_othersides6
+from mapit import address_int, determine_otherside
+
+# First addresses of /30 and /126 prefixes, including the ends of the address space and, for IPv6, prefixes where the
+# low 64 bits are about to carry into the high 64 bits
+PREFIXES4 = ['0.0.0.0', '10.0.0.4', '192.0.2.252', '255.255.255.252']
+PREFIXES6 = ['::', '2001:db8::4', '2001:db8:0:1:ffff:ffff:ffff:fffc', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:fffc']
+# Whether the network address and the broadcast address of the prefix are known interface addresses
+SEEN = list(product([False, True], repeat=2))
+
+
+def cases(prefix):
+    """Every address in the prefix, with every combination of its network and broadcast addresses being known."""
+    first = ipaddress.ip_address(prefix)
+    for position, (network, broadcast) in product(range(4), SEEN):
+        address = first + position
+        known = {address}
+        if network:
+            known.add(first)
+        if broadcast:
+            known.add(first + 3)
+        yield str(address), sorted(str(interface) for interface in known)
+
+
+@pytest.mark.parametrize('prefix', PREFIXES4)
+def test_determine_othersides(prefix):
+    for address, known in cases(prefix):
+        expected = determine_otherside(address, {address_int(interface) for interface in known})
+        all_interfaces = np.array(sorted(address_int(interface) for interface in known), dtype=np.int64)
+        otherside = determine_othersides(np.array([address_int(address)], dtype=np.int64), all_interfaces)
+        assert str(ipaddress.IPv4Address(int(otherside[0]))) == expected, (address, known)
+
+
+@pytest.mark.parametrize('prefix', PREFIXES6)
+def test_determine_othersides6(prefix):
+    for address, known in cases(prefix):
+        expected = determine_otherside(address, {address_int(interface) for interface in known})
+        all_interfaces = np.sort(keys6(pack6(known)))
+        otherside = determine_othersides6(pack6([address]), all_interfaces)
+        high, low = otherside[0].tolist()
+        assert str(ipaddress.IPv6Address(high << 64 | low)) == expected, (address, known)
+
+
+def test_determine_othersides_together():
+    """Every case at once, in one array, as build_graph calls it."""
+    addresses = []
+    known = set()
+    # Separate prefixes for every combination, since they share the known addresses
+    for i, (position, (network, broadcast)) in enumerate(product(range(4), SEEN)):
+        first = ipaddress.ip_address('10.0.0.0') + 4 * i
+        addresses.append(str(first + position))
+        known.update(str(interface) for interface, seen in [(first + position, True), (first, network),
+                                                             (first + 3, broadcast)] if seen)
+    expected = [determine_otherside(address, {address_int(interface) for interface in known}) for address in addresses]
+    othersides = determine_othersides(np.array([address_int(address) for address in addresses], dtype=np.int64),
+                                      np.array(sorted(address_int(interface) for interface in known), dtype=np.int64))
+    assert [str(ipaddress.IPv4Address(otherside)) for otherside in othersides.tolist()] == expected
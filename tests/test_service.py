@@ -0,0 +1,18 @@
+import pytest
+
+from service import reload_options
+
+
+def test_reload_options_are_converted():
+    options = reload_options({'factor': '0.5', 'iterations': 20.0, 'adjacencies': 'next.adj', 'warm_start': None})
+    assert options == {'factor': 0.5, 'iterations': 20, 'adjacencies': 'next.adj', 'warm_start': None}
+    assert type(options['factor']) is float and type(options['iterations']) is int
+
+
+@pytest.mark.parametrize('options', [
+    {'factor': 'half'}, {'factor': None}, {'factor': [0.5]}, {'iterations': 2.5}, {'iterations': '2.5'},
+    {'iterations': True}, {'adjacencies': 5}, {'output': 'out.csv'},
+])
+def test_invalid_reload_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        reload_options(options)
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+import spill
+from adjacency import read_binary_adjacencies
+from spill import SpillSet, SpilledAdjacencies, merge_runs
+
+
+def write_runs(directory, runs):
+    filenames = []
+    for i, run in enumerate(runs):
+        filename = os.path.join(str(directory), 'run-{}'.format(i))
+        np.unique(np.asarray(run, dtype=np.uint64)).astype('<u8').tofile(filename)
+        filenames.append(filename)
+    return filenames
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 1000])
+def test_merge_runs(tmp_path, block_size):
+    rng = np.random.default_rng(0)
+    runs = [rng.integers(0, 500, size=size) for size in (200, 50, 1, 300)] + [[2 ** 64 - 1, 0], []]
+    chunks = list(merge_runs(write_runs(tmp_path, runs), block_size))
+    merged = np.concatenate(chunks)
+    assert merged.tolist() == np.unique(np.concatenate([np.asarray(run, dtype=np.uint64) for run in runs])).tolist()
+    # Each chunk is deduplicated on its own, and later chunks only have larger values
+    assert all(np.all(chunk[1:] > chunk[:-1]) for chunk in chunks)
+    assert all(a[-1] < b[0] for a, b in zip(chunks, chunks[1:]))
+
+
+@pytest.mark.parametrize('runs', [3, 4, 17])
+def test_spill_set_removes_duplicates(tmp_path, monkeypatch, runs):
+    monkeypatch.setattr(spill, 'MAX_RUNS', 4)
+    monkeypatch.setattr(spill, 'MIN_BLOCK', 5)
+    values = SpillSet(str(tmp_path), 100 * 8 * 3)
+    rng = np.random.default_rng(runs)
+    added = []
+    for _ in range(runs):
+        batch = rng.integers(0, 1000, size=100)
+        added.append(batch)
+        values.add(batch)
+        values.add(batch[:10])
+    assert values.sorted().tolist() == np.unique(np.concatenate(added)).tolist()
+    assert len(values.runs) <= 4
+    assert len(values) >= len(np.unique(np.concatenate(added)))
+    values.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_spilled_adjacencies(tmp_path, monkeypatch):
+    monkeypatch.setattr(spill, 'MAX_RUNS', 2)
+    adjacencies = SpilledAdjacencies(str(tmp_path), 8 * 3)
+    pairs = [('10.0.0.{}'.format(i % 7), '10.0.1.{}'.format(i % 5)) for i in range(40)]
+    for i in range(0, len(pairs), 4):
+        adjacencies.update(pairs[i:i + 4] + [('10.0.0.1', '2001:db8::1')])
+    filename = str(tmp_path / 'adjacencies.bin')
+    adjacencies.write(filename)
+    adjacencies.close()
+    assert adjacencies.skipped == 10
+    assert set(read_binary_adjacencies(filename)) == set(pairs)
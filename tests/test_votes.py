@@ -0,0 +1,46 @@
+import pytest
+
+import algorithm
+from as2org import AS2Org
+from benchmarks.generate import generate
+from mapit import create_halves, read_adjacencies
+from routing_table import RoutingTable
+from votes import Votes
+
+
+class CheckedVotes(Votes):
+    """Votes that compares every answer with the neighbor count of the old connected_org."""
+
+    syncs = 0
+    checked = 0
+
+    def sync(self, updates):
+        super().sync(updates)
+        CheckedVotes.syncs += 1
+
+    def connected_org(self, half):
+        result = super().connected_org(half)
+        assert result == algorithm.connected_org(half, self.updates, self.f)
+        CheckedVotes.checked += 1
+        return result
+
+
+@pytest.fixture(scope='module')
+def halves(tmp_path_factory):
+    files = generate(str(tmp_path_factory.mktemp('synthetic')), 2000, seed=1, traces=10)
+    allhalves = create_halves(read_adjacencies(files['adj']), RoutingTable.ip2as(files['pfx2as']),
+                              AS2Org(files['as2org'], include_potaroo=False))
+    return [half for half in allhalves if half.num_neighbors > 1]
+
+
+@pytest.mark.parametrize('factor', [0, 0.5])
+def test_votes_match_connected_org(halves, factor, monkeypatch):
+    monkeypatch.setattr(algorithm, 'Votes', CheckedVotes)
+    monkeypatch.setattr(CheckedVotes, 'syncs', 0)
+    monkeypatch.setattr(CheckedVotes, 'checked', 0)
+    updates = algorithm.main_loop(halves, factor, 100)
+    # Several add and remove passes, each of which syncs the tallies to the passes' Updates
+    assert CheckedVotes.syncs >= 4
+    assert CheckedVotes.checked > len(halves)
+    recounted = algorithm.main_loop(halves, factor, 100, tallies=False)
+    assert sorted(updates.rows()) == sorted(recounted.rows())
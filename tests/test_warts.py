@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+from ipaddress import ip_address
+
+import pytest
+
+import trace
+from warts import WartsReader
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FILENAMES = ['traces.warts', 'traces.warts.gz', 'traces.warts.bz2']
+STOP_REASONS = {'NONE': 0, 'COMPLETED': 1, 'UNREACH': 2, 'ICMP': 3, 'LOOP': 4, 'GAPLIMIT': 5, 'ERROR': 6,
+                'HOPLIMIT': 7, 'GSS': 8, 'HALTED': 9}
+
+
+def expected_traces():
+    """The traces in traces.json as WartsTrace fields, with the defaults WartsReader uses for missing hop fields."""
+    with open(os.path.join(DATA, 'traces.json')) as f:
+        for line in f:
+            j = json.loads(line)
+            hops = [(hop.get('addr'), hop.get('probe_ttl', 0), hop.get('icmp_q_ttl', 1)) for hop in j.get('hops', [])]
+            yield STOP_REASONS[j['stop_reason']], j['hop_count'], hops
+
+
+@pytest.mark.parametrize('filename', FILENAMES)
+def test_reader_matches_json(filename):
+    traces = list(WartsReader(os.path.join(DATA, filename)))
+    assert [tuple(t) for t in traces] == list(expected_traces())
+
+
+def test_reader_packed():
+    strings = list(WartsReader(os.path.join(DATA, 'traces.warts')))
+    packed = list(WartsReader(os.path.join(DATA, 'traces.warts'), packed=True))
+    for s, p in zip(strings, packed):
+        assert [None if a is None else int(ip_address(a)) for a, _, _ in s.hops] == [a for a, _, _ in p.hops]
+
+
+def test_global_addresses():
+    # The last trace only refers to the deprecated file-wide address records
+    last = list(WartsReader(os.path.join(DATA, 'traces.warts')))[-1]
+    assert [addr for addr, _, _ in last.hops] == ['10.0.0.1', '10.0.4.1', '198.51.100.50']
+
+
+@pytest.mark.parametrize('filename', FILENAMES)
+def test_process_trace_file(filename):
+    adjacencies, addresses = trace.process_trace_file(os.path.join(DATA, filename))
+    assert adjacencies == {
+        ('10.0.0.1', '10.0.1.1'), ('10.0.1.1', '203.0.113.5'), ('203.0.113.5', '203.0.113.9'),
+        ('203.0.113.9', '198.51.100.9'),
+        ('2001:db8:1::1', '2001:db8:2::1'), ('2001:db8:2::1', '2001:db8:ffff::1'),
+        ('10.0.0.1', '10.0.4.1'), ('10.0.4.1', '198.51.100.50')}
+    assert None not in addresses
+    assert {'10.0.2.1', '10.0.3.1', '10.0.3.9', '10.0.3.5'} <= addresses
+
+
+@pytest.mark.skipif(shutil.which('sc_warts2json') is None, reason='scamper is not installed')
+@pytest.mark.parametrize('filename', FILENAMES)
+def test_sc_warts2json(filename):
+    with trace.Warts(os.path.join(DATA, filename)) as f:
+        traces = list(f)
+    fields = ('type', 'src', 'dst', 'stop_reason', 'hop_count')
+    with open(os.path.join(DATA, 'traces.json')) as f:
+        expected = [json.loads(line) for line in f]
+    assert [{k: t[k] for k in fields} for t in traces] == [{k: t[k] for k in fields} for t in expected]
+    for t, e in zip(traces, expected):
+        hops = [{k: h[k] for k in ('addr', 'probe_ttl', 'icmp_q_ttl') if k in h} for h in t.get('hops', [])]
+        assert hops == e.get('hops', [])
+    assert trace.process_trace_file_json(os.path.join(DATA, filename)) == trace.process_trace_file(
+        os.path.join(DATA, filename))
+
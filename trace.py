@@ -1,8 +1,19 @@
 import json
+import os
+from logging import getLogger
+from multiprocessing import Pool
 from subprocess import Popen, PIPE
 
 import numpy
 
+from progress import Counter, Progress, should_output
+from warts import WartsReader, STOP_LOOP
+
+log = getLogger()
+
+# Counter of processed traces, set in each worker by init_worker
+_counter = None
+
 
 class Warts:
     def __init__(self, filename, json=True):
@@ -42,7 +53,7 @@ def cycle_free(trace):
 def extract_trace(j):
     trace = numpy.full(j['hop_count'], fill_value=None, dtype='object')
     for hop in j['hops']:
-        if 'icmp_q_ttl' not in hop or hop['icmp_q_ttl'] == 1:
+        if ('icmp_q_ttl' not in hop or hop['icmp_q_ttl'] == 1) and 'addr' in hop and hop.get('probe_ttl', 0) >= 1:
             ttl = hop['probe_ttl'] - 1
             addr = hop['addr']
             if trace[ttl] is None:
@@ -52,15 +63,109 @@ def extract_trace(j):
     return trace
 
 
+def extract_hops(warts_trace):
+    trace = [None] * max(warts_trace.hop_count, max(probe_ttl for _, probe_ttl, _ in warts_trace.hops))
+    for addr, probe_ttl, q_ttl in warts_trace.hops:
+        # Hops without an address or a probe TTL cannot be placed in the trace
+        if q_ttl == 1 and addr is not None and probe_ttl >= 1:
+            ttl = probe_ttl - 1
+            if trace[ttl] is None:
+                trace[ttl] = addr
+            elif trace[ttl] != addr:
+                trace[ttl] = False
+    return trace
+
+
 def process_trace_file(filename):
+    addresses = set()
+    adjacencies = set()
+    counter = _counter
+    for warts_trace in WartsReader(filename):
+        if counter is not None:
+            counter.add()
+        if warts_trace.hops:
+            addresses.update(addr for addr, _, _ in warts_trace.hops if addr is not None)
+            if warts_trace.stop_reason != STOP_LOOP:
+                trace = extract_hops(warts_trace)
+                if cycle_free(trace):
+                    adjacencies.update((x, y) for x, y in zip(trace, trace[1:]) if x and y)
+    if counter is not None:
+        counter.flush()
+    return adjacencies, addresses
+
+
+def process_trace_file_json(filename):
     addresses = set()
     adjacencies = set()
     with Warts(filename) as f:
         for j in f:
             if 'hops' in j:
-                addresses.update(hop['addr'] for hop in j['hops'])
+                addresses.update(hop['addr'] for hop in j['hops'] if 'addr' in hop)
                 if j['stop_reason'] != 'LOOP':
                     trace = extract_trace(j)
                     if cycle_free(trace):
                         adjacencies.update((x, y) for x, y in zip(trace, trace[1:]) if x and y)
-    return adjacencies, addresses
\ No newline at end of file
+    return adjacencies, addresses
+
+
+def init_worker(counter):
+    global _counter
+    _counter = counter
+
+
+def process_named_trace_file(filename):
+    return filename, process_trace_file(filename)
+
+
+def process_trace_files(filenames, jobs=1, cache=None, adjacencies=None, addresses=None):
+    """
+    Extracts the adjacencies and addresses from each traceroute file, using a process pool when jobs > 1.
+    :param filenames: Traceroute filenames
+    :param jobs: Number of processes used to read the files
+    :param cache: Optional TraceCache. Only files that are missing from the cache or have changed are read.
+    :param adjacencies: Optional collection with an update method, such as SpilledAdjacencies, used instead of a set
+    :param addresses: Optional collection with an update method, such as SpilledAddresses, used instead of a set
+    :return: The union of the adjacencies and addresses across all files
+    """
+    adjacencies = set() if adjacencies is None else adjacencies
+    addresses = set() if addresses is None else addresses
+    # Taken before the files are read, so the cache entries describe the files as they were when read
+    stats = {}
+    if cache is not None:
+        unread = []
+        for filename in filenames:
+            results = cache.get(filename)
+            if results is None:
+                unread.append(filename)
+                stats[filename] = os.stat(filename)
+            else:
+                file_adjacencies, file_addresses = results
+                adjacencies.update(file_adjacencies)
+                addresses.update(file_addresses)
+        log.info('Using cached results for {:,d} of {:,d} traceroute files'.format(len(filenames) - len(unread), len(filenames)))
+        filenames = unread
+    # The workers count their traces, so the progress moves while large files are being read
+    counter = Counter('traces') if should_output() else None
+    pb = Progress(len(filenames), 'Processing traceroute files', counter=counter,
+                  callback=lambda: '{:,d} adjacencies'.format(len(adjacencies)))
+    if jobs > 1:
+        pool = Pool(jobs, initializer=init_worker, initargs=(counter,))
+        results = pool.imap_unordered(process_named_trace_file, filenames)
+    else:
+        pool = None
+        init_worker(counter)
+        results = map(process_named_trace_file, filenames)
+    try:
+        for filename, (file_adjacencies, file_addresses) in pb.iterator(results):
+            adjacencies.update(file_adjacencies)
+            addresses.update(file_addresses)
+            if cache is not None:
+                cache.put(filename, (file_adjacencies, file_addresses), stats[filename])
+    finally:
+        init_worker(None)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.save()
+    return adjacencies, addresses
@@ -1,8 +1,10 @@
+import csv
 from collections import namedtuple
-from copy import copy
 from logging import getLogger
 
-import pandas as pd
+import numpy as np
+
+from interning import org_code, org_name
 
 log = getLogger()
 
@@ -10,62 +12,220 @@ columns = ['Address', 'Direction', 'Otherside', 'ASN', 'ConnASN', 'Org', 'ConnOr
 UpdateInfo = namedtuple(
     'Update', columns)
 
+# The state of a half with an inference. Halves without one have no entry.
+Entry = namedtuple('Entry', ['asn', 'org', 'direct', 'stub'])
+
+FINGERPRINT_MASK = (1 << 64) - 1
+
+
+def entry_hash(half, entry):
+    return hash((half, entry))
+
+
+class Revision:
+    """
+    A committed state in the history shared by an Updates object and its copies. The state is the parent's state with
+    the halves in changes modified. A new history is started once the changes along it would outnumber the inferences,
+    so a history never holds more halves than there are inferences.
+    """
+
+    __slots__ = ('parent', 'changes', 'depth', 'total')
+
+    def __init__(self, parent=None, changes=frozenset()):
+        self.parent = parent
+        self.changes = changes
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.total = 0 if parent is None else parent.total + len(changes)
+
+
+def revision_changes(a, b):
+    """
+    Halves changed along the revisions from a and from b back to the latest revision they share.
+    :return: Set of halves, or None if they do not share a revision
+    """
+    halves = set()
+    while a is not b:
+        if a.depth >= b.depth:
+            if a.parent is None:
+                return None
+            halves |= a.changes
+            a = a.parent
+        else:
+            if b.parent is None:
+                return None
+            halves |= b.changes
+            b = b.parent
+    return halves
+
 
 class Updates:
-    def __init__(self, orgs=None, asns=None, direct=None, stubs=None):
-        self.orgs = {} if orgs is None else orgs
-        self.asns = {} if asns is None else asns
-        self.direct = set() if direct is None else direct
-        self.stubs = set() if stubs is None else stubs
+    """
+    The current inferences, stored as a dict from each half to its Entry, along with the halves changed since the last
+    committed Revision.
+
+    Reads are a single dict lookup. A copy is still a full copy of the dict and the direct set, which costs time in the
+    number of inferences. Copying also commits the changed halves as a new Revision shared by the original and the copy,
+    so the halves that differ between two related Updates objects are found by walking their revisions back to the
+    common one, without comparing every inference, and code that only needs to know what changed since some point can
+    keep that point's Revision instead of a copy. The halves with direct inferences are also kept in the direct
+    set, which is iterated in the same order as before the entries were introduced.
+
+    Every change is also added to the sets returned by watch, which are shared with the copies, so consumers that
+    follow the inferences from one pass to the next, such as Votes, do not have to compare states to find the changes.
+
+    The fingerprint is the sum of the hashes of every (half, Entry) pair. It is updated incrementally by each change,
+    so two states can be compared, or remembered, using only their fingerprints.
+    """
+
+    def __init__(self, orgs=None, asns=None, direct=None, stubs=None, entries=None, revision=None, watchers=None,
+                 fingerprint=None):
+        if entries is None:
+            entries = {}
+            if orgs:
+                direct = direct or set()
+                stubs = stubs or set()
+                for half, org in orgs.items():
+                    entries[half] = Entry(asns[half], org, half in direct, half in stubs)
+        if direct is None:
+            direct = {half for half, entry in entries.items() if entry.direct}
+        self.current = entries
+        self.direct = direct
+        self.revision = Revision() if revision is None else revision
+        self.dirty = set()
+        self.watchers = [] if watchers is None else watchers
+        if fingerprint is None:
+            fingerprint = sum(entry_hash(half, entry) for half, entry in entries.items()) & FINGERPRINT_MASK
+        self.fingerprint = fingerprint
 
     def __contains__(self, half):
-        return half in self.orgs
+        return half in self.current
 
     def __copy__(self):
         return self.copy()
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            if len(self.current) != len(other.current) or self.fingerprint != other.fingerprint:
+                return False
+            return next(self.changed(other), None) is None
         else:
             return False
 
     def __getitem__(self, half):
-        return self.orgs[half]
+        return self.org(half)
 
     def __iter__(self):
-        yield from self.orgs.keys()
+        return iter(self.current)
 
     def __len__(self):
-        return len(self.orgs)
+        return len(self.current)
 
     def asn(self, half):
-        return self.asns[half]
+        return self.get_entry(half).asn
 
     def asn_default(self, half, default=None):
-        return self.asns.get(half, default)
+        entry = self.entry(half)
+        return entry.asn if entry is not None else default
+
+    def commit(self):
+        """Records the halves changed since the last revision as a new revision."""
+        if self.dirty:
+            if self.revision.total + len(self.dirty) > len(self.current):
+                self.revision = Revision()
+            else:
+                self.revision = Revision(self.revision, frozenset(self.dirty))
+            self.dirty = set()
 
     def copy(self):
-        return Updates(copy(self.orgs), copy(self.asns), copy(self.direct), copy(self.stubs))
+        """
+        Commits the changed halves and returns an independent copy. The entries and the direct set are copied in full,
+        not layered on the original, so reads stay a single lookup.
+        """
+        self.commit()
+        return Updates(entries=dict(self.current), direct=self.direct.copy(), revision=self.revision,
+                       watchers=self.watchers, fingerprint=self.fingerprint)
 
     def dataframe(self):
+        import pandas as pd
         if len(self) > 0:
             return pd.DataFrame(self.iteritems()).set_index(['Address', 'Direction']).sort_index()
         else:
             log.warning('There were no inferences made. This is likely because the interface graph is too sparse.')
             return pd.DataFrame(columns=columns)
 
+    def changed_halves(self, other):
+        """
+        Halves that might have a different entry in other: the halves changed since the latest revision the two share.
+        Every half with an inference in either one is returned when they do not share a revision.
+        """
+        halves = revision_changes(self.revision, other.revision)
+        if halves is None:
+            return self.current.keys() | other.current.keys()
+        return halves | self.dirty | other.dirty
+
+    def changed_since(self, revision):
+        """
+        Halves that might have changed since revision, which is a revision committed by this object or by an object it
+        shares a history with, without keeping a copy of the inferences at that revision.
+        :return: Set of halves, or None if the history was restarted since revision
+        """
+        halves = revision_changes(self.revision, revision)
+        if halves is None:
+            return None
+        return halves | self.dirty
+
+    def certain_halves(self):
+        """
+        Every half for which iscertain is True, found with one pass over the inferences. A half can only be certain if
+        some inferred half has the inverse (org, connected org) pair, so only those halves have their neighbors checked.
+        """
+        entries = list(self.entries())
+        inverse_pairs = {(half.org, entry.org) for half, entry in entries}
+        certain = set()
+        for half, entry in entries:
+            if (entry.org, half.org) in inverse_pairs:
+                for neighbor in half.neighbors:
+                    if neighbor.org == entry.org:
+                        other = self.entry(neighbor)
+                        if other is not None and other.org == half.org:
+                            certain.add(half)
+                            break
+        return certain
+
+    def changed(self, other):
+        """Halves whose entries differ between self and other, including halves with an entry in only one of them."""
+        current = self.current
+        other_current = other.current
+        for half in self.changed_halves(other):
+            if current.get(half) != other_current.get(half):
+                yield half
+
     def difference(self, other):
-        for k in self.orgs.keys() | other.orgs.keys():
-            if self.orgs.get(k) != other.orgs.get(k):
+        for k in self.changed_halves(other):
+            if self.org_default(k) != other.org_default(k):
                 yield k
 
     def direct_mappings(self):
         for half in self.direct:
-            yield half, self.asns[half], self.orgs[half]
+            entry = self.current[half]
+            yield half, entry.asn, entry.org
+
+    def entries(self):
+        """The (half, Entry) pairs of the current inferences."""
+        return self.current.items()
+
+    def entry(self, half):
+        """Returns the half's Entry, or None if there is no inference for it."""
+        return self.current.get(half)
+
+    def get_entry(self, half):
+        entry = self.entry(half)
+        if entry is None:
+            raise KeyError(half)
+        return entry
 
     def has_duplicates(self):
-        return any(half.otherhalf in self.orgs for half in self.orgs)
+        return any(half.otherhalf in self for half in self)
 
     def iscertain(self, half):
         return any(self.is_inverse(half, neighbor) for neighbor in half.neighbors)
@@ -73,42 +233,157 @@ class Updates:
     def isdirect(self, half):
         return half in self.direct
 
+    def isstub(self, half):
+        entry = self.entry(half)
+        return entry is not None and entry.stub
+
     def is_inverse(self, half, neighbor):
-        return half.org == self.orgs.get(neighbor) and self.orgs.get(half) == neighbor.org
+        return half.org == self.org_default(neighbor) and self.org_default(half) == neighbor.org
 
     def iteritems(self):
-        for half, asn in self.asns.items():
+        for half, entry in self.entries():
             yield UpdateInfo(
                 Address=half.address, Direction=half.direction,
-                Otherside=half.otherside_address if half.asn != -2 else None, ASN=half.asn, ConnASN=asn, Org=half.org,
-                ConnOrg=self.orgs[half], Direct=half in self.direct, Certain=self.iscertain(half),
-                Stub=half in self.stubs)
+                Otherside=half.otherside_address if half.asn != -2 else None, ASN=half.asn, ConnASN=entry.asn,
+                Org=org_name(half.org), ConnOrg=org_name(entry.org), Direct=entry.direct, Certain=self.iscertain(half), Stub=entry.stub)
 
     def mapping(self, half):
-        return self.asns[half], self.orgs[half]
+        entry = self.get_entry(half)
+        return entry.asn, entry.org
+
+    def mark(self, half):
+        """Records that the half's entry changed."""
+        self.dirty.add(half)
+        for changes in self.watchers:
+            changes.add(half)
 
     def org(self, half):
-        return self.orgs[half]
+        return self.get_entry(half).org
 
     def org_default(self, half, default=None):
-        return self.orgs.get(half, default)
+        entry = self.entry(half)
+        return entry.org if entry is not None else default
 
     def remove(self, half):
-        if half in self:
-            del self.asns[half]
-            del self.orgs[half]
+        entry = self.current.pop(half, None)
+        if entry is not None:
+            self.fingerprint = (self.fingerprint - entry_hash(half, entry)) & FINGERPRINT_MASK
+            self.mark(half)
+            self.direct.discard(half)
+
+    def remove_direct(self, half):
+        """Keeps the half's inference but marks it as indirect."""
+        entry = self.get_entry(half)
+        self.set_entry(half, entry, entry._replace(direct=False))
         self.direct.discard(half)
 
+    def scan_stubs(self):
+        """Every half with a stub inference, found by scanning all of the inferences."""
+        return [half for half, entry in self.current.items() if entry.stub]
+
+    def set_entry(self, half, old, new):
+        self.fingerprint = (self.fingerprint - entry_hash(half, old) + entry_hash(half, new)) & FINGERPRINT_MASK
+        self.current[half] = new
+        self.mark(half)
+
+    def unwatch(self, changes):
+        """Stops adding changed halves to a set returned by watch."""
+        self.watchers[:] = [watcher for watcher in self.watchers if watcher is not changes]
+
     def update(self, half, asn, org, isdirect=True, isstub=False):
-        self.asns[half] = asn
-        self.orgs[half] = org
+        entry = self.current.get(half)
+        if entry is None:
+            new = Entry(asn, org, isdirect, isstub)
+            self.fingerprint = (self.fingerprint + entry_hash(half, new)) & FINGERPRINT_MASK
+            self.current[half] = new
+            self.mark(half)
+        else:
+            self.set_entry(half, entry, Entry(asn, org, isdirect or entry.direct, isstub or entry.stub))
         if isdirect:
             self.direct.add(half)
-        if isstub:
-            self.stubs.add(half)
 
     def update_from_half(self, half, other, isdirect=False):
-        self.update(half, self.asns[other], self.orgs[other], isdirect)
+        self.update(half, self.asn(other), self.org(other), isdirect)
+
+    def watch(self):
+        """
+        Returns a set that every half changed from now on is added to, whether it changes in this Updates or in any
+        Updates copied from the same original, so a consumer can find the changes without comparing states.
+        """
+        changes = set()
+        self.watchers.append(changes)
+        return changes
+
+    def rows(self):
+        """Yields the output rows, in the same columns as UpdateInfo, sorted by address and direction."""
+        certain = self.certain_halves()
+        for half, entry in sorted(self.entries(), key=lambda item: (item[0].address, item[0].direction)):
+            yield (
+                half.address, half.direction, half.otherside_address if half.asn != -2 else None, half.asn, entry.asn,
+                org_name(half.org), org_name(entry.org), entry.direct, half in certain, entry.stub)
+
+    def write(self, filename, format='csv'):
+        """
+        Writes the inferences sorted by address and direction.
+        :param filename: Filename or file object for csv, and a filename for the other formats
+        :param format: csv, npz (one NumPy array per column), or parquet (requires pyarrow)
+        """
+        if not len(self):
+            log.warning('There were no inferences made. This is likely because the interface graph is too sparse.')
+        if format == 'csv':
+            write_csv(filename, self.rows())
+        elif format == 'npz':
+            # np.savez appends .npz to filenames that do not end with it, so it gets an open file instead
+            with open(filename, 'wb') as f:
+                np.savez(f, **column_arrays(self.rows()))
+        elif format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(pyarrow.table(column_arrays(self.rows())), filename)
+        else:
+            raise ValueError('Unknown output format {}'.format(format))
+
+
+def read_updates(filename, find):
+    """
+    Loads the direct inferences from a previous run's CSV output, for use as the starting point of a new run. Indirect
+    and stub inferences are skipped because the algorithm derives them from the direct inferences.
+    :param filename: Results written by Updates.write
+    :param find: Function from (address, direction) to the current half, or None if the half no longer exists
+    :return: Updates, and the number of rows whose half no longer exists
+    """
+    entries = {}
+    missing = 0
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['Direct'] != 'True' or row['Stub'] == 'True':
+                continue
+            half = find(row['Address'], row['Direction'] == 'True')
+            if half is None:
+                missing += 1
+                continue
+            entries[half] = Entry(int(row['ConnASN']), org_code(row['ConnOrg']), True, False)
+    return Updates(entries=entries), missing
+
+
+def column_arrays(rows):
+    """Converts the output rows into one NumPy array per column. Missing othersides become empty strings."""
+    values = list(zip(*rows)) or [()] * len(columns)
+    arrays = {}
+    for name, column in zip(columns, values):
+        if name in ('Direction', 'Direct', 'Certain', 'Stub'):
+            arrays[name] = np.array(column, dtype=bool)
+        elif name in ('ASN', 'ConnASN'):
+            arrays[name] = np.array(column, dtype=np.int64)
+        else:
+            arrays[name] = np.array(['' if value is None else value for value in column], dtype=str)
+    return arrays
+
 
-    def write(self, filename):
-        self.dataframe().to_csv(filename)
+def write_csv(filename, rows):
+    if isinstance(filename, str):
+        with open(filename, 'w', newline='') as f:
+            return write_csv(f, rows)
+    writer = csv.writer(filename, lineterminator='\n')
+    writer.writerow(columns)
+    writer.writerows(rows)
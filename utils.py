@@ -3,32 +3,32 @@ import gzip
 import json
 import pickle
 import signal
-from socket import inet_ntoa, inet_aton
+from socket import AF_INET6, inet_ntoa, inet_aton, inet_ntop, inet_pton
 from itertools import filterfalse
 from struct import pack, unpack
 from sys import stderr
 from time import sleep
 
-import numpy as np
 from subprocess import Popen, PIPE, STDOUT, DEVNULL
 
 import subprocess
-from ipyparallel import Client
 
 
 class File2:
-    def __init__(self, filename, compression='infer', read=True):
+    def __init__(self, filename, compression='infer', read=True, binary=False):
         self.filename = filename
         self.compression = infer_compression(filename) if compression == 'infer' else compression
         self.read = read
+        self.binary = binary
 
     def __enter__(self):
+        mode = ('r' if self.read else 'w') + ('b' if self.binary else 't')
         if self.compression == 'gzip':
-            self.f = gzip.open(self.filename, 'rt' if self.read else 'wt')
+            self.f = gzip.open(self.filename, mode)
         elif self.compression == 'bzip2':
-            self.f = bz2.open(self.filename, 'rt' if self.read else 'wt')
+            self.f = bz2.open(self.filename, mode)
         else:
-            self.f = open(self.filename, 'r' if self.read else 'w')
+            self.f = open(self.filename, mode)
         return self.f
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -49,8 +49,8 @@ def infer_compression(filename, default=None):
 def max2(iterable, key=None):
     first = None
     second = None
-    first_value = np.NINF
-    second_value = np.NINF
+    first_value = float('-inf')
+    second_value = float('-inf')
     for v in iterable:
         n = key(v) if key is not None else v
         if n > first_value:
@@ -108,6 +108,7 @@ def stop_cluster():
 
 
 def setup_parallel():
+    from ipyparallel import Client
     rc = Client()
     dv = rc[:]
     lv = rc.load_balanced_view()
@@ -123,19 +124,28 @@ def ls(fregex):
 def otherside(address, prefixlen=None, network=None):
     if prefixlen is None:
         prefixlen = int(network.partition('/')[2])
-    ipnum = unpack("!L", inet_aton(address))[0]
-    if prefixlen == 30:
+    ipv6 = ':' in address
+    if ipv6:
+        ipnum = int.from_bytes(inet_pton(AF_INET6, address), 'big')
+        # The other sides in /126 and /127 prefixes are found the same way as in /30 and /31 prefixes
+        length = prefixlen - 96
+    else:
+        ipnum = unpack("!L", inet_aton(address))[0]
+        length = prefixlen
+    if length == 30:
         remainder = ipnum % 4
         if remainder == 1:
             oside = ipnum + 1
         else:
             oside = ipnum - 1
-    elif prefixlen == 31:
+    elif length == 31:
         remainder = ipnum % 2
         if remainder == 0:
             oside = ipnum + 1
         else:
             oside = ipnum - 1
     else:
-        raise Exception('{} is not 30 or 31'.format(prefixlen))
+        raise Exception('{} is not {}'.format(prefixlen, '126 or 127' if ipv6 else '30 or 31'))
+    if ipv6:
+        return inet_ntop(AF_INET6, oside.to_bytes(16, 'big'))
     return inet_ntoa(pack('!L', oside))
@@ -0,0 +1,140 @@
+from logging import getLogger
+
+log = getLogger()
+
+# Marks a half without a cached answer, since None is a valid answer
+UNKNOWN = object()
+
+
+class Votes:
+    """
+    Maintains the connected_org answer for each half as the inferences change.
+
+    Each half queried gets a tally, a dict with the number of its neighbors voting for each (org, ASN) pair, where a
+    neighbor votes for its inferred org and ASN, or its own when there is no inference. The Updates objects push every
+    half they change into a set returned by Updates.watch. Neighbors are symmetric, so syncing to a new Updates object
+    only adjusts the tallies of the neighbors of changed halves whose vote changed, and only those answers are
+    recomputed.
+    """
+
+    def __init__(self, f):
+        """
+        :param f: 0 <= f <= 1, the same factor passed to connected_org
+        """
+        self.f = f
+        self.tallies = {}
+        self.results = {}
+        self.updates = None
+        self.changes = None
+
+    def close(self):
+        """Stops following the changes of the synced Updates."""
+        if self.updates is not None:
+            self.updates.unwatch(self.changes)
+            self.updates = None
+            self.changes = None
+
+    def connected_org(self, half):
+        """
+        Same result as algorithm.connected_org for the Updates object most recently passed to sync.
+        :return: (asn, org) or None
+        """
+        result = self.results.get(half, UNKNOWN)
+        if result is UNKNOWN:
+            tally = self.tallies.get(half)
+            if tally is None:
+                tally = self.tally(half)
+            result = self.results[half] = self.decide(half, tally)
+        return result
+
+    def decide(self, half, tally):
+        if len(tally) == 1:
+            org, asn = next(iter(tally))
+            return asn, org
+        orgs = {}
+        for (org, _), count in tally.items():
+            orgs[org] = orgs.get(org, 0) + count
+        if len(orgs) == 1:
+            org = next(iter(orgs))
+        else:
+            # A tie for the most votes never yields an org, so which tied org wins does not matter
+            org = None
+            first = second = 0
+            for o, count in orgs.items():
+                if count > first:
+                    org, first, second = o, count, first
+                elif count > second:
+                    second = count
+            if org is None or first == second or first <= half.num_neighbors * self.f:
+                return None
+        asn = None
+        most = 0
+        asns = 0
+        for (o, a), count in tally.items():
+            if o == org:
+                asns += 1
+                if count > most:
+                    asn, most = a, count
+        if asns == 1:
+            return asn, org
+        # connected_org picks the ASN with the most votes that appears first among the neighbors
+        updates = self.updates
+        for neighbor in half.neighbors:
+            vote = self.vote(neighbor, updates)
+            if vote[0] == org and tally[vote] == most:
+                return vote[1], org
+
+    def sync(self, updates):
+        """
+        Adjusts the tallies for every half whose vote changed since the previous sync. Updates is expected to be the
+        previously synced object, or a copy of it made after that sync, possibly through other copies. The synced object
+        must not change until the next sync. An Updates object from a different original discards the tallies.
+        """
+        previous = self.updates
+        if previous is None or updates.watchers is not previous.watchers:
+            self.close()
+            self.tallies = {}
+            self.results = {}
+            self.updates = updates
+            self.changes = updates.watch()
+            return
+        self.updates = updates
+        tallies = self.tallies
+        results = self.results
+        changed = 0
+        for neighbor in self.changes:
+            old = self.vote(neighbor, previous)
+            new = self.vote(neighbor, updates)
+            if old != new:
+                changed += 1
+                for half in neighbor.neighbors:
+                    tally = tallies.get(half)
+                    if tally is not None:
+                        count = tally[old] - 1
+                        if count:
+                            tally[old] = count
+                        else:
+                            del tally[old]
+                        tally[new] = tally.get(new, 0) + 1
+                        results.pop(half, None)
+        log.debug('Votes: {:,d} of {:,d} changed halves changed their votes'.format(changed, len(self.changes)))
+        self.changes.clear()
+
+    def tally(self, half):
+        entry = self.updates.entry
+        tally = self.tallies[half] = {}
+        for neighbor in half.neighbors:
+            inferred = entry(neighbor)
+            if inferred is not None:
+                vote = inferred.org, inferred.asn
+            else:
+                vote = neighbor.org, neighbor.asn
+            tally[vote] = tally.get(vote, 0) + 1
+        return tally
+
+    @staticmethod
+    def vote(neighbor, updates):
+        entry = updates.entry(neighbor)
+        if entry is not None:
+            return entry.org, entry.asn
+        return neighbor.org, neighbor.asn
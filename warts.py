@@ -0,0 +1,177 @@
+from collections import namedtuple
+from socket import inet_ntop, AF_INET, AF_INET6
+from struct import Struct
+
+from utils import File2
+
+WARTS_MAGIC = 0x1205
+WARTS_TYPE_ADDRESS = 0x0005
+WARTS_TYPE_TRACE = 0x0006
+
+STOP_LOOP = 4
+
+ADDR_IPV4 = 1
+ADDR_IPV6 = 2
+
+HEADER = Struct('!HHL')
+UINT16 = Struct('!H')
+UINT32 = Struct('!L')
+
+# Sizes of the trace parameters, in flag order, up to the last address parameter. A size of None is an address.
+TRACE_PARAMS = [4, 4, 4, 4, 8, 1, 1, 1, 1, 1, 1, 2, 2, 2, 1, 1, 1, 1, 2, 1, 1, 1, 2, 1, 1, None, None, 4, 2, None]
+TRACE_STOP_REASON = 6
+TRACE_HOP_COUNT = 19
+
+# Sizes of the hop parameters, in flag order, up to the hop address. -1 is the variable length ICMP extension block.
+HOP_PARAMS = [4, 1, 1, 1, 1, 4, 2, 2, 2, 2, 1, 2, 2, 1, 1, 1, -1, None]
+HOP_ADDR_GID = 1
+HOP_PROBE_TTL = 2
+HOP_Q_TTL = 14
+HOP_ADDR = 18
+
+WartsTrace = namedtuple('WartsTrace', ['stop_reason', 'hop_count', 'hops'])
+
+
+class WartsError(Exception):
+    pass
+
+
+def ipv4_str(data):
+    return inet_ntop(AF_INET, data)
+
+
+def ipv6_str(data):
+    return inet_ntop(AF_INET6, data)
+
+
+def packed_int(data):
+    return int.from_bytes(data, 'big')
+
+
+class WartsReader:
+    """
+    Streams the traces in a warts, warts.gz, or warts.bz2 file without sc_warts2json.
+
+    Only the fields MAP-IT uses are decoded and every other record type is skipped. Each trace is a WartsTrace whose
+    hops are (address, probe_ttl, icmp_q_ttl) tuples. Addresses are strings in the same notation as sc_warts2json, or
+    integers if packed is True. The quoted TTL defaults to 1 when the hop does not include one, which matches how
+    scamper interprets the field.
+    """
+
+    def __init__(self, filename, packed=False):
+        self.filename = filename
+        if packed:
+            self.converters = {ADDR_IPV4: packed_int, ADDR_IPV6: packed_int}
+        else:
+            self.converters = {ADDR_IPV4: ipv4_str, ADDR_IPV6: ipv6_str}
+        self.global_addresses = [None]
+
+    def __iter__(self):
+        with File2(self.filename, binary=True) as f:
+            while True:
+                header = f.read(8)
+                if not header:
+                    break
+                if len(header) < 8:
+                    raise WartsError('Truncated record header in {}'.format(self.filename))
+                magic, rtype, length = HEADER.unpack(header)
+                if magic != WARTS_MAGIC:
+                    raise WartsError('Invalid warts magic {:#x} in {}'.format(magic, self.filename))
+                data = f.read(length)
+                if len(data) < length:
+                    raise WartsError('Truncated record in {}'.format(self.filename))
+                if rtype == WARTS_TYPE_TRACE:
+                    yield self.read_trace(data)
+                elif rtype == WARTS_TYPE_ADDRESS:
+                    self.read_global_address(data)
+
+    def read_global_address(self, data):
+        # Deprecated file-wide address records: an id modulo byte, a type byte, and the address
+        self.global_addresses.append(self.convert(data[1], data[2:]))
+
+    def convert(self, atype, data):
+        converter = self.converters.get(atype)
+        return converter(data) if converter else None
+
+    def read_address(self, data, off, table):
+        length = data[off]
+        off += 1
+        if length:
+            address = self.convert(data[off], data[off + 1:off + 1 + length])
+            table.append(address)
+            return address, off + 1 + length
+        return table[UINT32.unpack_from(data, off)[0]], off + 4
+
+    def read_trace(self, data):
+        table = []
+        stop_reason = None
+        hop_count = 0
+        flags, off = read_flags(data, 0)
+        if flags:
+            end = off + 2 + UINT16.unpack_from(data, off)[0]
+            off += 2
+            for flag, size in enumerate(TRACE_PARAMS, 1):
+                if not flags & (1 << (flag - 1)):
+                    continue
+                if size is None:
+                    _, off = self.read_address(data, off, table)
+                    continue
+                if flag == TRACE_STOP_REASON:
+                    stop_reason = data[off]
+                elif flag == TRACE_HOP_COUNT:
+                    hop_count = UINT16.unpack_from(data, off)[0]
+                off += size
+            off = end
+        num_hops = UINT16.unpack_from(data, off)[0]
+        off += 2
+        hops = []
+        for _ in range(num_hops):
+            hop, off = self.read_hop(data, off, table)
+            hops.append(hop)
+        return WartsTrace(stop_reason, hop_count, hops)
+
+    def read_hop(self, data, off, table):
+        address = None
+        probe_ttl = 0
+        q_ttl = 1
+        flags, off = read_flags(data, off)
+        if not flags:
+            return (address, probe_ttl, q_ttl), off
+        end = off + 2 + UINT16.unpack_from(data, off)[0]
+        off += 2
+        for flag, size in enumerate(HOP_PARAMS, 1):
+            if not flags & (1 << (flag - 1)):
+                continue
+            if flag == HOP_ADDR:
+                address, off = self.read_address(data, off, table)
+                continue
+            if flag == HOP_ADDR_GID:
+                address = self.global_addresses[UINT32.unpack_from(data, off)[0]]
+            elif flag == HOP_PROBE_TTL:
+                probe_ttl = data[off]
+            elif flag == HOP_Q_TTL:
+                q_ttl = data[off]
+            elif size == -1:
+                size = 2 + UINT16.unpack_from(data, off)[0]
+            off += size
+        return (address, probe_ttl, q_ttl), end
+
+
+def read_flags(data, off):
+    """
+    Reads a warts flag field, where the low seven bits of each byte are flags and the high bit marks another byte.
+    :return: Bitmask of the flags, where flag n is bit n - 1, and the offset after the field
+    """
+    flags = 0
+    shift = 0
+    while True:
+        b = data[off]
+        off += 1
+        flags |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return flags, off
+        shift += 7
+
+
+def read_warts(filename, packed=False):
+    return iter(WartsReader(filename, packed=packed))